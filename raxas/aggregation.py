@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import math
+import re
+
+# share of the lowest and of the highest values left out by trimmed_mean
+TRIM_PROPORTION = 0.1
+
+# weight of the newest value in ewma
+EWMA_ALPHA = 0.5
+
+# pN aggregators, e.g. p95 or p99.9
+PERCENTILE_PATTERN = re.compile(r'^p(100|\d{1,2}(?:\.\d+)?)$')
+
+
+def mean(values):
+    """This function returns the arithmetic mean of values.
+
+    """
+    return math.fsum(values) / len(values)
+
+
+def percentile(values, percent):
+    """This function returns the percent-th percentile of values,
+       interpolating linearly between the two closest ranks.
+
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100.0
+    lower = int(math.floor(rank))
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def median(values):
+    """This function returns the median of values.
+
+    """
+    return percentile(values, 50)
+
+
+def trimmed_mean(values, proportion=TRIM_PROPORTION):
+    """This function returns the mean of values without the lowest and the
+       highest proportion of them.
+
+    """
+    ordered = sorted(values)
+    cut = int(len(ordered) * proportion)
+    return mean(ordered[cut:len(ordered) - cut] or ordered)
+
+
+def maximum(values):
+    """This function returns the largest of values.
+
+    """
+    return max(values)
+
+
+def ewma(values, alpha=EWMA_ALPHA):
+    """This function returns the exponentially weighted moving average of
+       values, oldest first.
+
+    """
+    iterator = iter(values)
+    average = next(iterator)
+    for value in iterator:
+        average = alpha * value + (1 - alpha) * average
+    return average
+
+
+AGGREGATORS = {
+    'mean': mean,
+    'median': median,
+    'trimmed_mean': trimmed_mean,
+    'max': maximum,
+    'ewma': ewma
+}
+
+
+# aggregators whose result depends on the order of the values, which must be
+# oldest first
+ORDERED_AGGREGATORS = frozenset(['ewma'])
+
+
+def is_ordered(name):
+    """This function tells whether the aggregator called name depends on the
+       order of the values.
+
+    """
+    return str(name).lower() in ORDERED_AGGREGATORS
+
+
+def get_aggregator(name):
+    """This function returns the aggregator called name.
+
+    :param name: mean, median, trimmed_mean, max, ewma or pN, e.g. p95
+    :returns: function taking a non empty list of numbers
+    :raises ValueError: if there is no such aggregator
+    """
+    name = str(name).lower()
+    if name in AGGREGATORS:
+        return AGGREGATORS[name]
+
+    match = PERCENTILE_PATTERN.match(name)
+    if match is not None:
+        return functools.partial(percentile, percent=float(match.group(1)))
+
+    raise ValueError('unknown aggregate %r, expected one of %s or pN' %
+                     (name, ', '.join(sorted(AGGREGATORS))))
+
+
+def aggregate(name, values):
+    """This function reduces values with the aggregator called name.
+
+    :param name: aggregator name, see get_aggregator
+    :param values: list of numbers, oldest first
+    :returns: aggregated value, None if values is empty
+    """
+    aggregator = get_aggregator(name)
+    if not values:
+        return None
+    return aggregator(values)
@@ -18,14 +18,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import datetime
 import json
 import logging
 import os.path
 import pprint
 import pyrax
+import time
 import traceback
 from pyrax.exceptions import AuthenticationFailed
 
+from raxas import common
+
+try:
+    import fcntl
+except ImportError:
+    # no file locking on windows
+    fcntl = None
+
+# tokens are refreshed with the credentials once they expire within this many
+# seconds, instead of being reused from the token file
+TOKEN_REFRESH_MARGIN = 300
+
+# format of the token expiry stored in the token file, as returned by the
+# identity service
+EXPIRES_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# seconds a process waits for another one to refresh the token
+TOKEN_LOCK_TIMEOUT = 60
+
 
 class Auth(object):
     """
@@ -53,6 +75,10 @@ class Auth(object):
         self._token_filename = token_filename
         self._token = None
         self._tenant_id = None
+        self._tenant_name = None
+        self._expires = None
+        self._user = None
+        self._catalog = None
         logger.debug(self.__str__())
 
     def __str__(self, *args, **kwargs):
@@ -86,39 +112,126 @@ class Auth(object):
         """
         return self._token_filename
 
+    @staticmethod
+    def token_expires_soon(margin=TOKEN_REFRESH_MARGIN):
+        """
+        This checks whether the token pyrax is using expires within margin
+        seconds, or pyrax is not authenticated at all
+
+        :param margin: seconds before expiry the token is considered stale
+        :returns: True or False (Boolean)
+        """
+        expires = getattr(pyrax.identity, 'expires', None)
+        if not expires:
+            return True
+        # pyrax converts the expiry to a naive UTC datetime
+        return expires - datetime.datetime.utcnow() < datetime.timedelta(seconds=margin)
+
+    def token_valid(self, margin=TOKEN_REFRESH_MARGIN):
+        """
+        This checks whether the loaded token expires in more than margin
+        seconds. Tokens saved without their expiry are never valid.
+
+        :param margin: seconds before expiry the token is considered stale
+        :returns: True or False (Boolean)
+        """
+        if self._expires is None:
+            return False
+        return self._expires - datetime.datetime.utcnow() > datetime.timedelta(seconds=margin)
+
     def authenticate(self):
         """
         This method loads a token from a file,
         authenticate with it, and if it fails then tries to authenticate
         with credentials
 
+        A valid token is used without locking the token file. Otherwise the
+        file is locked while the token is validated or refreshed, so
+        concurrent processes wait and reuse the token of the first one
+        instead of all authenticating at once.
+
         :returns: True or False (Boolean)
         """
         logger = logging.getLogger(__name__)
-        # try to authenticate with token
-        if self.load_token():
-            logger.debug("loaded token '%s' from file '%s'",
-                         pprint.pformat(self._token), self._token_filename)
-            if self.authenticate_token():
+        if self.load_token() and self.token_valid() and self.authenticate_cached():
+            logger.info('authenticated successfully')
+            logger.debug("authenticated with cached token '%s' from file '%s'",
+                         self._token, self._token_filename)
+            return True
+
+        with self.token_lock():
+            # try to authenticate with token, another process may have
+            # refreshed it while we were waiting for the lock
+            if self.load_token():
+                logger.debug("loaded token '%s' from file '%s'",
+                             pprint.pformat(self._token), self._token_filename)
+                if self._expires is not None and not self.token_valid():
+                    logger.info("token from file '%s' expires at %s, refreshing it",
+                                self._token_filename, self._expires)
+                elif self.token_valid() and self.authenticate_cached():
+                    logger.info('authenticated successfully')
+                    logger.debug("authenticated with cached token '%s' from file '%s'",
+                                 self._token, self._token_filename)
+                    return True
+                elif self.authenticate_token():
+                    logger.info('authenticated successfully')
+                    logger.debug("authenticated with token '%s' from file '%s'",
+                                 self._token, self._token_filename)
+                    return True
+                else:
+                    logger.debug("cannot authenticate with token '%s' from file '%s'",
+                                 self._token, self._token_filename)
+            # try to authenticate with credentials
+            if self.authenticate_credentials():
                 logger.info('authenticated successfully')
-                logger.debug("authenticated with token '%s' from file '%s'",
-                             self._token, self._token_filename)
+                logger.debug("authenticated with credentials, username: %s,"
+                             "api-key: %s, region: %s, identity_type: %s",
+                             self._username, self._apikey, self._region, self._identity_type)
                 return True
             else:
-                logger.debug("cannot authenticate with token '%s' from file '%s'",
-                             self._token, self._token_filename)
-        # try to authenticate with credentials
-        if self.authenticate_credentials():
-            logger.info('authenticated successfully')
-            logger.debug("authenticated with credentials, username: %s,"
-                         "api-key: %s, region: %s, identity_type: %s",
-                         self._username, self._apikey, self._region, self._identity_type)
-            return True
-        else:
-            logger.debug("cannot authenticate with credentials, username: %s, "
-                         "api-key: %s, region: %s, identity_type: %s",
-                         self._username, self._apikey, self._region, self._identity_type)
-            return False
+                logger.debug("cannot authenticate with credentials, username: %s, "
+                             "api-key: %s, region: %s, identity_type: %s",
+                             self._username, self._apikey, self._region, self._identity_type)
+                return False
+
+    @contextlib.contextmanager
+    def token_lock(self, timeout=TOKEN_LOCK_TIMEOUT):
+        """
+        This holds an exclusive lock on '<token_filename>.lock'. If the lock
+        is not acquired within timeout seconds the caller goes on without it.
+
+        :param timeout: seconds to wait for the lock
+        """
+        logger = logging.getLogger(__name__)
+        lock_file = None
+        locked = False
+
+        if fcntl is not None:
+            try:
+                lock_file = open(self._token_filename + '.lock', 'a')
+            except IOError as error:
+                logger.warning("cannot open token lock file '%s.lock': %s",
+                               self._token_filename, error)
+
+        deadline = time.time() + timeout
+        while lock_file is not None and not locked:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+            except IOError:
+                if time.time() >= deadline:
+                    logger.warning("timed out waiting for lock on token file "
+                                   "'%s'", self._token_filename)
+                    break
+                time.sleep(0.1)
+
+        try:
+            yield
+        finally:
+            if lock_file is not None:
+                if locked:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
 
     def authenticate_credentials(self):
         """
@@ -139,8 +252,7 @@ class Auth(object):
                         self._username, self._apikey, self._region, self._identity_type)
             logger.debug("user authenticated: %s", pyrax.identity.authenticated)
             if pyrax.identity.authenticated:
-                self._token = pyrax.identity.auth_token
-                self._tenant_id = pyrax.identity.tenant_id
+                self.read_identity()
                 self.save_token()
             return pyrax.identity.authenticated
         except AuthenticationFailed:
@@ -159,6 +271,9 @@ class Auth(object):
             pyrax.auth_with_token(self._token, self._tenant_id, region=self._region)
             logging.info('authenticated with token:%s, tenant_id:%s, region:%s',
                          self._token, self._tenant_id, self._region)
+            # store the expiry and catalog, so the next run skips validation
+            self.read_identity()
+            self.save_token()
             return True
         except AuthenticationFailed:
             logging.info('cannot authenticate with token:%s, tenant_id:%s, region:%s',
@@ -166,6 +281,74 @@ class Auth(object):
             logger.debug(traceback.format_exc())
             return False
 
+    def authenticate_cached(self):
+        """
+        This rebuilds the pyrax identity and clients from the token, expiry
+        and endpoint catalog loaded from the token file, without calling the
+        identity service.
+
+        :returns: True or False (Boolean)
+        """
+        logger = logging.getLogger(__name__)
+        if self._expires is None or not self._catalog or not self._user:
+            return False
+
+        access = {'access': {
+            'token': {'id': self._token,
+                      'expires': self._expires.strftime(EXPIRES_FORMAT),
+                      'tenant': {'id': self._tenant_id,
+                                 'name': self._tenant_name}},
+            'serviceCatalog': self._catalog,
+            'user': self._user}}
+
+        try:
+            pyrax.set_setting('identity_type', self._identity_type)
+            identity = pyrax.create_context(self._identity_type,
+                                            username=self._username,
+                                            api_key=self._apikey)
+            identity._parse_response(access)
+            identity.region = self._region
+            identity.authenticated = True
+
+            pyrax.identity = identity
+            pyrax.regions = tuple(identity.regions)
+            pyrax.services = tuple(identity.services.keys())
+            pyrax.connect_to_services(region=self._region)
+        except Exception as error:
+            logger.warning('cannot rebuild pyrax clients from cached token: %s',
+                           error)
+            logger.debug(traceback.format_exc())
+            return False
+
+        logger.info('authenticated with cached token, tenant_id:%s, region:%s, '
+                    'expires:%s', self._tenant_id, self._region, self._expires)
+        return True
+
+    def read_identity(self):
+        """
+        This copies the token, its expiry and the endpoints of our region from
+        the authenticated pyrax identity
+        """
+        identity = pyrax.identity
+        self._token = identity.auth_token
+        self._tenant_id = identity.tenant_id
+        self._tenant_name = getattr(identity, 'tenant_name', None)
+        self._user = getattr(identity, 'user', None)
+
+        expires = getattr(identity, 'expires', None)
+        self._expires = expires if isinstance(expires, datetime.datetime) else None
+
+        self._catalog = None
+        catalog = getattr(identity, 'service_catalog', None)
+        if isinstance(catalog, list):
+            self._catalog = []
+            for service in catalog:
+                # endpoints without a region are global, e.g. cloudFilesCDN
+                endpoints = [endpoint for endpoint in service.get('endpoints', [])
+                             if endpoint.get('region') in (None, self._region)]
+                if endpoints:
+                    self._catalog.append(dict(service, endpoints=endpoints))
+
     def force_unauthenticate(self):
         """
         This unauthenticate and delete token file
@@ -204,12 +387,22 @@ class Auth(object):
         try:
             self._token = data['token']
             self._tenant_id = data['tenant_id']
-            return True
         except KeyError as error:
             logger.error("cannot load token from data: '%s': %s", data, error)
             logger.debug(traceback.format_exc())
             return False
 
+        # files written by older versions only hold the token and tenant_id
+        try:
+            self._expires = datetime.datetime.strptime(data['expires'],
+                                                       EXPIRES_FORMAT)
+            self._tenant_name = data.get('tenant_name')
+            self._user = data.get('user')
+            self._catalog = data.get('catalog')
+        except (KeyError, TypeError, ValueError):
+            self._expires = None
+        return True
+
     def save_token(self):
         """
         This saves token to a file
@@ -218,12 +411,18 @@ class Auth(object):
         """
         logger = logging.getLogger(__name__)
         data = {'token': self._token, 'tenant_id': self._tenant_id}
+        if self._expires is not None:
+            data.update({'expires': self._expires.strftime(EXPIRES_FORMAT),
+                         'tenant_name': self._tenant_name,
+                         'user': self._user,
+                         'catalog': self._catalog})
 
+        # readers never see a partially written token
         try:
-            with open(self._token_filename, 'w') as f:
-                json.dump(data, f)
+            common.write_atomically(self._token_filename,
+                                    lambda f: json.dump(data, f))
             return True
-        except (TypeError, IOError) as error:
+        except (TypeError, ValueError, IOError, OSError) as error:
             logger.error("cannot write data '%s' to file '%s': %s",
                          pprint.pformat(data), self._token_filename, error)
             logger.debug(traceback.format_exc())
@@ -21,31 +21,111 @@
 
 import argparse
 import logging.config
+import os
+import signal
 import socket
-from stevedore.named import NamedExtensionManager
+import threading
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 
+# pyrax and requests are imported by the functions that need them,
+# so --help, --version and slave nodes in cluster mode start quickly
 from raxas import common
+from raxas import plugin_registry
+from raxas.decision import DecisionState
 from raxas.enums import *
 from raxas.colouredconsolehandler import ColouredConsoleHandler
-from raxas.auth import Auth
 from raxas.version import return_version
 from raxas.scaling_group import ScalingGroup
 
+logger = logging.getLogger(__name__)
 
-# CHECK logging.conf
-logging_config = common.check_file('logging.conf')
+# seconds a plugin may spend in make_decision() unless its config sets
+# 'decision_timeout'
+DEFAULT_DECISION_TIMEOUT = 60
 
-if logging_config is None:
-    logging.handlers.ColouredConsoleHandler = ColouredConsoleHandler
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
+# plugin classes resolved from the 'raxas.ext' namespace, kept for the
+# lifetime of the process so daemon mode only imports them once
+_plugin_classes = {}
 
-else:
 
-    logging_conf_file = logging_config
-    logging.handlers.ColouredConsoleHandler = ColouredConsoleHandler
-    logging.config.fileConfig(logging_conf_file)
-    logger = logging.getLogger(__name__)
+def load_plugins(scaling_group):
+    """This function instantiates the plugins configured for a scaling group.
+
+    Plugin classes are looked up once per process and reused on later calls.
+
+    :param scaling_group: raxas.scaling_group.ScalingGroup
+    :returns: list of plugin objects
+    """
+    names = sorted(scaling_group.plugin_config.keys())
+
+    missing = [name for name in names if name not in _plugin_classes]
+    if missing:
+        registry = plugin_registry.get_registry()
+        if not set(missing).issubset(registry):
+            # installed without changing the environment fingerprint, e.g.
+            # a plugin in a directory added to sys.path
+            registry = plugin_registry.get_registry(rescan=True)
+        for name in missing:
+            if name not in registry:
+                continue
+            try:
+                _plugin_classes[name] = plugin_registry.load_class(registry[name])
+            except (ImportError, AttributeError) as error:
+                logger.error('Unable to import plugin %s: %s', name, error)
+
+    plugins = []
+    for name in names:
+        if name not in _plugin_classes:
+            logger.error('Unable to find plugin: %s', name)
+            continue
+        try:
+            plugins.append(_plugin_classes[name](scaling_group))
+        except Exception as error:
+            logger.error('Unable to load plugin %s: %s', name, error)
+
+    return plugins
+
+
+def make_decisions(plugins, plugin_config):
+    """This function calls make_decision() on every plugin concurrently.
+
+    A plugin that raises an exception or does not return within its
+    'decision_timeout' counts as having no data.
+
+    :param plugins: list of plugin objects
+    :param plugin_config: dict of plugin name -> configuration.PluginConfig
+    :returns: list of decisions, one per plugin (1, 0, -1 or None)
+    """
+    if not plugins:
+        return []
+
+    pool = ThreadPool(len(plugins))
+    started = time.time()
+    pending = [(plugin, pool.apply_async(plugin.make_decision))
+               for plugin in plugins]
+
+    results = []
+    for plugin, result in pending:
+        timeout = plugin_config[plugin.name].decision_timeout
+        if timeout is None:
+            timeout = DEFAULT_DECISION_TIMEOUT
+        try:
+            results.append(result.get(max(0, started + timeout - time.time())))
+        except TimeoutError:
+            logger.warning('Plugin %s did not make a decision within %ss, '
+                           'ignoring it', plugin.name, timeout)
+            results.append(None)
+        except Exception as error:
+            logger.error('Plugin %s failed to make a decision: %s',
+                         plugin.name, error)
+            results.append(None)
+
+    # don't join: a plugin that timed out keeps running in a daemon thread
+    pool.close()
+
+    return results
 
 
 def autoscale(group, config_data, args):
@@ -69,18 +149,12 @@ def autoscale(group, config_data, args):
         if scaling_group.is_master in [NodeStatus.Slave, NodeStatus.Unknown]:
             return ScaleEvent.NotMaster
 
-    plugin_config = scaling_group.plugin_config
-    mgr = NamedExtensionManager(
-        namespace='raxas.ext',
-        names=plugin_config.keys(),
-        invoke_on_load=True,
-        invoke_args=(scaling_group,)
-        )
-    logger.info('Loaded plugins: %s' % mgr.names())
-
-    results = [result for result
-               in mgr.map_method('make_decision')
-               if result is not None]
+    plugins = load_plugins(scaling_group)
+    logger.info('Loaded plugins: %s' % [plugin.name for plugin in plugins])
+
+    decisions = make_decisions(plugins, scaling_group.plugin_config)
+    results = [result for result in decisions if result is not None]
+    scaling_group.request_cache.log_stats()
     scaling_decision = sum(results)
     if scaling_decision <= -1:
         scaling_decision = -1
@@ -88,17 +162,64 @@ def autoscale(group, config_data, args):
         scaling_decision = 1
 
     scale = ScaleDirection(scaling_decision)
+    state = DecisionState(scaling_group.group_uuid)
+    try:
+        return execute_decision(scaling_group, state, scale, args,
+                                dict((plugin.name, decision) for plugin, decision
+                                     in zip(plugins, decisions)))
+    finally:
+        # a dry run must not change what the next real run does
+        if not args['dry_run']:
+            state.save()
+
+
+def execute_decision(scaling_group, state, scale, args, decisions):
+    """This function executes the policy of a scaling decision unless fewer
+       consecutive evaluations than configured agreed on it, or the group is
+       still cooling down from its last scaling action.
+
+    :param scaling_group: raxas.scaling_group.ScalingGroup
+    :param state: raxas.decision.DecisionState of the group, updated
+    :param scale: raxas.enums.ScaleDirection
+    :param args: user provided arguments
+    :param decisions: dict of plugin name -> plugin decision
+    :returns: enums.ScaleEvent
+    """
+    streak = state.observe(scale)
+
     if scale is ScaleDirection.Nothing:
         logger.info('Cluster within target parameters')
         return ScaleEvent.NoAction
 
+    settings = scaling_group.hysteresis_settings
+    direction = scale.name.lower()
+    required = settings['scale_%s_after' % direction]
+    if streak < required:
+        logger.info('Threshold reached - Scaling %s wanted by %d of %d consecutive '
+                    'evaluations', scale.name, streak, required)
+        return ScaleEvent.NoAction
+
+    now = time.time()
+    # the Autoscale API would reject the policy during its own cooldowns
+    group_cooldown, policy_cooldown = scaling_group.get_cooldowns(scale)
+    cooldown = max(settings['scale_%s_cooldown' % direction], group_cooldown)
+    if state.last_action == scale:
+        cooldown = max(cooldown, policy_cooldown)
+    remaining = state.cooldown_remaining(cooldown, now)
+    if remaining:
+        logger.info('Threshold reached - Scaling %s held back for %d more '
+                    'seconds of cooldown', scale.name, remaining)
+        return ScaleEvent.NoAction
+
     logger.info('Threshold reached - Scaling %s', scale.name)
     if not args['dry_run']:
-        scaling_group.execute_webhook(scale, HookType.Pre)
+        payload = scaling_group.webhook_payload(scale, decisions)
+        scaling_group.execute_webhook(scale, HookType.Pre, payload)
 
         policy_result = scaling_group.execute_policy(scale)
         if policy_result == ScaleEvent.Success:
-            scaling_group.execute_webhook(scale, HookType.Post)
+            state.record_action(scale, now)
+            scaling_group.execute_webhook(scale, HookType.Post, payload)
             return ScaleEvent.Success
         elif policy_result == ScaleEvent.NoAction:
             return ScaleEvent.Success
@@ -109,6 +230,46 @@ def autoscale(group, config_data, args):
         return ScaleEvent.Success
 
 
+def autoscale_groups(groups, config_data, args):
+    """This function evaluates several scaling groups concurrently.
+
+    All groups share the current pyrax session, at most args['workers']
+    groups are evaluated at the same time.
+
+    :param groups: list of group names
+    :param config_data: json configuration data
+    :param args: user provided arguments
+    :returns: dict of group name -> enums.ScaleEvent
+    """
+    def evaluate(group):
+        return autoscale(group, config_data, args)
+
+    results = common.parallel_map(evaluate, groups,
+                                  max_workers=args.get('workers', 4))
+
+    summary = {}
+    for group, result in zip(groups, results):
+        summary[group] = ScaleEvent.Error if result is None else result
+        logger.info('Scaling group %s: %s', group, summary[group].name)
+
+    return summary
+
+
+def setup_logging():
+    """This function configures logging from logging.conf if it exists,
+       otherwise INFO messages are logged to the console.
+
+    """
+    logging.handlers.ColouredConsoleHandler = ColouredConsoleHandler
+
+    logging_config = common.check_file('logging.conf')
+    if logging_config is None:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.config.fileConfig(logging_config,
+                                  disable_existing_loggers=False)
+
+
 def parse_args():
     """This function validates user arguments and data in configuration file.
 
@@ -134,17 +295,161 @@ def parse_args():
                         action='store_true',
                         help='Do not actually perform any scaling operations '
                              'or call webhooks')
+    parser.add_argument('--all-groups', required=False, default=False,
+                        action='store_true',
+                        help='Evaluate every group in autoscale_groups '
+                             'instead of a single --as-group')
+    parser.add_argument('--workers', required=False, default=4, type=int,
+                        help='Maximum number of groups evaluated concurrently '
+                             'with --all-groups (default: 4)')
+    parser.add_argument('--daemon', required=False, default=False,
+                        action='store_true',
+                        help='Keep running and evaluate the scaling group '
+                             'every --interval seconds')
+    parser.add_argument('--interval', required=False, default=60, type=int,
+                        help='Seconds between evaluations in --daemon mode '
+                             '(default: 60)')
+    parser.add_argument('--validate-config', required=False, default=False,
+                        action='store_true',
+                        help='Check the config file, report every problem '
+                             'and exit without contacting any API')
     args = vars(parser.parse_args())
 
     return args
 
 
+def validate_config(config_data):
+    """This function reports every problem of the configuration, including
+       plugins that are not installed, without contacting any API.
+
+    :param config_data: raxas.configuration.Config object
+    :returns: True if the configuration has no errors, warnings are allowed
+    """
+    errors = list(config_data.errors)
+
+    plugins = set()
+    for group in config_data.groups.values():
+        plugins.update(getattr(group, 'plugins', {}))
+    registry = plugin_registry.get_registry()
+    if not plugins.issubset(registry):
+        registry = plugin_registry.get_registry(rescan=True)
+
+    for group_name, group in sorted(config_data.groups.items()):
+        for plugin_name in sorted(getattr(group, 'plugins', {})):
+            if plugin_name not in registry:
+                errors.append('autoscale_groups.%s.plugins.%s: plugin is not '
+                              'installed' % (group_name, plugin_name))
+
+    for warning in config_data.warnings:
+        logger.warning('Config: %s', warning)
+    for error in errors:
+        logger.error('Config: %s', error)
+
+    return not errors
+
+
+def get_as_group(args, config_data):
+    """This function returns the name of the scaling group to evaluate.
+
+    :param args: user provided arguments
+    :param config_data: json configuration data
+    :returns: group name
+    """
+    as_group = args.get('as_group')
+    if not as_group:
+        if len(config_data['autoscale_groups'].keys()) == 1:
+            as_group = config_data['autoscale_groups'].keys()[0]
+        else:
+            logger.debug("Getting system hostname")
+            hostname = socket.gethostname()
+            as_group = hostname.rsplit('-', 1)[0]
+
+    return as_group
+
+
+def run_daemon(config_file, config_data, session, args, stop=None):
+    """This function runs autoscale every args['interval'] seconds until
+       SIGTERM or SIGINT is received.
+
+    The authenticated session and loaded plugins are kept between runs, the
+    config file is only read again when its modification time changes and
+    the session is only re-authenticated when its token is about to expire.
+
+    :param config_file: absolute path of the json configuration file
+    :param config_data: json configuration data
+    :param session: raxas.auth.Auth object, already authenticated
+    :param args: user provided arguments
+    :param stop: threading.Event used to end the loop
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logger.info('Received signal %d, shutting down', signum)
+        stop.set()
+
+    handlers = {signal.SIGTERM: signal.signal(signal.SIGTERM, handle_signal),
+                signal.SIGINT: signal.signal(signal.SIGINT, handle_signal)}
+
+    interval = max(1, args.get('interval', 60))
+    config_mtime = os.path.getmtime(config_file)
+    logger.info('Daemon mode enabled, interval: %ds', interval)
+
+    try:
+        while not stop.is_set():
+            started = time.time()
+
+            try:
+                mtime = os.path.getmtime(config_file)
+            except OSError as error:
+                logger.error('Unable to stat config file: %s', error)
+                mtime = config_mtime
+            if mtime != config_mtime:
+                new_config = common.get_config(config_file)
+                if new_config is None:
+                    logger.error('Failed to reload config file, '
+                                 'keeping previous configuration')
+                elif not new_config.valid:
+                    for error in new_config.errors:
+                        logger.error('Config: %s', error)
+                    logger.error('Invalid config file, '
+                                 'keeping previous configuration')
+                else:
+                    config_data = new_config
+                config_mtime = mtime
+
+            if session.token_expires_soon() and not session.authenticate():
+                logger.error('Authentication failed')
+            else:
+                if args.get('all_groups'):
+                    autoscale_groups(sorted(config_data['autoscale_groups']),
+                                     config_data, args)
+                else:
+                    as_group = get_as_group(args, config_data)
+                    try:
+                        scale_result = autoscale(as_group, config_data, args)
+                        logger.info('Scaling group %s: %s',
+                                    as_group, scale_result.name)
+                    except (Exception, SystemExit) as error:
+                        # exit_with_error() must not end the daemon
+                        logger.error('Error evaluating scaling group %s: %s',
+                                     as_group, error)
+
+            stop.wait(max(0, interval - (time.time() - started)))
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    logger.info('Daemon stopped')
+
+
 def main():
     """This function calls auth class for authentication and autoscale to
        execute scaling policy
 
     """
     args = parse_args()
+    setup_logging()
     logger.info(return_version())
     for arg in args:
         logger.debug('argument provided by user ' + arg + ' : ' +
@@ -160,14 +465,20 @@ def main():
     if config_data is None:
         common.exit_with_error('Failed to read config file: ' + config_file)
 
-    as_group = args.get('as_group')
-    if not as_group:
-        if len(config_data['autoscale_groups'].keys()) == 1:
-            as_group = config_data['autoscale_groups'].keys()[0]
-        else:
-            logger.debug("Getting system hostname")
-            hostname = socket.gethostname()
-            as_group = hostname.rsplit('-', 1)[0]
+    if args['validate_config']:
+        if not validate_config(config_data):
+            common.exit_with_error('Invalid config file: ' + config_file)
+        logger.info('Config file is valid: %s', config_file)
+        return
+
+    for warning in config_data.warnings:
+        logger.warning('Config: %s', warning)
+    if not config_data.groups:
+        for error in config_data.errors:
+            logger.error('Config: %s', error)
+        common.exit_with_error('Invalid config file: ' + config_file)
+
+    as_group = get_as_group(args, config_data)
 
     username = common.get_auth_value(args, config_data, 'os_username')
     api_key = common.get_auth_value(args, config_data, 'os_password')
@@ -176,11 +487,34 @@ def main():
         common.exit_with_error('Authentication credentials not set')
     region = region.upper()
 
+    if args['cluster'] and not (args['daemon'] or args['all_groups']):
+        # a slave node known from the caches has nothing to do, exit before
+        # authenticating and importing pyrax
+        group_config = config_data['autoscale_groups'].get(as_group)
+        if group_config is not None:
+            scaling_group = ScalingGroup(group_config, as_group)
+            if scaling_group.cached_node_status == NodeStatus.Slave:
+                logger.info('Node is not a master, nothing to do. Exiting')
+                return
+
+    from raxas.auth import Auth
     session = Auth(username, api_key, region)
     if not session.authenticate():
         common.exit_with_error('Authentication failed')
 
-    scale_result = autoscale(as_group, config_data, args)
+    if args['daemon']:
+        run_daemon(config_file, config_data, session, args)
+        return
+
+    if args['all_groups']:
+        summary = autoscale_groups(sorted(config_data['autoscale_groups']),
+                                   config_data, args)
+        scale_result = ScaleEvent.Success
+        if ScaleEvent.Error in summary.values():
+            scale_result = ScaleEvent.Error
+    else:
+        scale_result = autoscale(as_group, config_data, args)
+
     if scale_result == ScaleEvent.Error:
         common.exit_with_error(None)
     else:
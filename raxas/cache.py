@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+
+
+class RequestCache(object):
+    """
+    This class memoizes remote API calls for the duration of one evaluation
+    of a scaling group, so each resource is fetched at most once even when
+    several plugins ask for it at the same time.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, resource, func, *args):
+        """
+        This returns func(*args), calling it only the first time a given
+        resource and arguments are requested. Exceptions are not cached.
+
+        :param resource: name of the kind of resource, part of the cache key
+        :param func: function fetching the resource
+        :param args: hashable arguments passed to func, part of the cache key
+        :returns: the value returned by func
+        """
+        key = (resource,) + args
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._values:
+                    self.hits += 1
+                    return self._values[key]
+                self.misses += 1
+
+            value = func(*args)
+
+            with self._lock:
+                self._values[key] = value
+            return value
+
+    def clear(self):
+        """
+        This drops every cached value
+        """
+        with self._lock:
+            self._values.clear()
+            self._locks.clear()
+
+    def log_stats(self):
+        """
+        This logs the number of cache hits and misses
+        """
+        logger = logging.getLogger(__name__)
+        logger.info('Request cache: %d hits, %d misses', self.hits, self.misses)
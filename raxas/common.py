@@ -20,13 +20,26 @@
 
 from __future__ import print_function
 import os
-import pyrax
 import sys
 import json
 import logging
+import subprocess
+import threading
+import time
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from uuid import UUID
 import netifaces
 
+from raxas import configuration
+
+# seconds a server fetched by get_server() is reused
+SERVER_CACHE_TTL = 300
+
+# server id -> (server, expiry time)
+_server_cache = {}
+_server_cache_lock = threading.Lock()
+
 
 def get_logger():
     """This function instantiate the logger.
@@ -61,26 +74,55 @@ def check_file(fname):
 def get_config(config_file):
     """This function read and returns jsons configuration data
 
+      The compiled configuration is cached next to the config file, so
+      runs after the first one skip parsing while the file is unchanged.
+
       :param config_file: json configuration file name
-      :returns: json data
+      :returns: raxas.configuration.Config object, used like the json data
 
     """
     logger = get_logger()
     logger.info('Loading config file: "%s"', config_file)
     try:
-        json_data = open(config_file)
-        data = json.load(json_data)
-        return data
+        return configuration.load_config(config_file)
     except Exception as e:
         logger.error("Error: %s", e)
 
     return None
 
 
+def write_atomically(file_path, write, mode='w'):
+    """This function replaces a file through a temporary file in the same
+       directory, so concurrent readers never see a partially written file.
+       The temporary file is removed if writing fails.
+
+    :param file_path: name of the file to replace
+    :param write: function called with the open temporary file
+    :param mode: 'w' or 'wb'
+    :raises: IOError or OSError, or whatever write raised
+    """
+    import tempfile
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(file_path)),
+        prefix='.%s.' % os.path.basename(file_path))
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            write(tmp_file)
+        os.rename(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
 def read_uuid_cache():
     logger = get_logger()
 
-    # we're storing files in /dev/shm/ to ensure the cache is deleted on reboot
+    # we're storing files in /dev/shm/ to ensure the cache is deleted on reboot,
+    # tmpfs is never captured in an image either
     uuid_files = ['/dev/shm/.raxas-uuid.cache',
                   # instance-id is populated with the uuid if the server was
                   # spun up with config_drive set to True
@@ -128,13 +170,57 @@ def write_uuid_cache(uuid):
         logger.error('unable to write uuid cache file: %s', error.args)
 
 
+def read_metadata_uuid():
+    """This function returns the server's UUID from the hypervisor metadata
+       (xenstore 'name' is 'instance-<uuid>' on Rackspace cloud servers),
+       or None if it is not available.
+
+    """
+    logger = get_logger()
+
+    try:
+        process = subprocess.Popen(['xenstore-read', 'name'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output = process.communicate()[0].strip()
+    except OSError as error:
+        logger.debug('unable to run xenstore-read: %s', error)
+        return None
+
+    if process.returncode != 0 or not output.startswith('instance-'):
+        return None
+
+    try:
+        return str(UUID(output[len('instance-'):]))
+    except ValueError:
+        logger.info('invalid uuid found in xenstore: %s', output)
+        return None
+
+
+def get_local_ips():
+    """This function returns the set of IPv4 addresses of this server,
+       excluding localhost.
+
+    """
+    local_ips = set()
+    for interface in netifaces.interfaces():  # pylint: disable=E1101
+        try:
+            for ip in netifaces.ifaddresses(interface)[netifaces.AF_INET]:  # pylint: disable=E1101
+                if ip['addr'] != '127.0.0.1':
+                    local_ips.add(ip['addr'])
+        except KeyError:
+            continue
+    return local_ips
+
+
 def get_machine_uuid(scaling_group):
     """This function will search for the server's UUID and return it.
 
-    First it searches in a rax-autoscaler cache, followed by cloud-init cache.
-    If it cannot find a cached UUID, it will get the details of each server in
-    the scaling group in turn and attempt to match the local IP address with
-    that of the server object returned from the API
+    First it searches in a rax-autoscaler cache, followed by cloud-init cache
+    and the xenstore metadata. If none of them has the UUID, it lists the
+    servers once and matches the local IP addresses against the addresses of
+    the active servers in the scaling group. A UUID found this way is cached
+    until the next reboot.
 
     :param scaling_group: raxas.scaling_group.ScalingGroup object
     :return: None if no UUID could be matched against a cache file or the API.
@@ -147,30 +233,37 @@ def get_machine_uuid(scaling_group):
         logger.info('found server UUID from cache: %s', uuid)
         return uuid
 
-    # if we didn't get anything from any cache files, we'll loop through the
-    # servers in the scaling group, get the server details and cross check the
-    # ip addresses against what's on *this* server
+    uuid = read_metadata_uuid()
+    if uuid is not None:
+        logger.info('found server UUID from xenstore: %s', uuid)
+        write_uuid_cache(uuid)
+        return uuid
+
+    # if we didn't get anything from any cache files, we'll list the servers
+    # once, index the ip addresses of the active servers in the scaling group
+    # and cross check them against what's on *this* server
+    import pyrax
+    active_servers = set(scaling_group.active_servers)
+    try:
+        servers = pyrax.cloudservers.servers.list()
+    except Exception as error:
+        logger.error('unable to list servers: %s', error)
+        return None
 
-    local_ips = []
-    for interface in netifaces.interfaces():  # pylint: disable=E1101
-        try:
-            for ip in netifaces.ifaddresses(interface)[netifaces.AF_INET]:  # pylint: disable=E1101
-                if ip['addr'] != '127.0.0.1':
-                    local_ips.append(ip['addr'])
-        except KeyError:
+    ip_index = {}
+    for server in servers:
+        if server.id not in active_servers:
             continue
+        for network in server.networks.values():
+            for ip in network:
+                ip_index[ip] = server.id
 
-    servers_api = pyrax.cloudservers
-    for active_uuid in scaling_group.active_servers:
-        server = servers_api.servers.get(active_uuid)
-
-        server_ips = [ip for network in server.networks.values()
-                      for ip in network]
-        matching_ips = set(server_ips).intersection(local_ips)
-        if len(matching_ips) > 0:
-            logger.info('found uuid from matching ip address: %s', server.id)
-            write_uuid_cache(server.id)
-            return server.id
+    matching_ips = get_local_ips().intersection(ip_index)
+    if matching_ips:
+        server_id = ip_index[matching_ips.pop()]
+        logger.info('found uuid from matching ip address: %s', server_id)
+        write_uuid_cache(server_id)
+        return server_id
 
     # only reached if we couldn't read from the cache file and couldn't find
     # this server's ip address in the scaling group's active server list
@@ -227,17 +320,116 @@ def exit_with_error(msg):
     sys.exit(1)
 
 
+def _call_guarded(func, item):
+    """Calls func(item), turning SystemExit into an exception so a call to
+    exit_with_error() inside a worker thread can't hang the pool.
+
+    """
+    try:
+        return func(item)
+    except SystemExit as error:
+        raise RuntimeError('exited with code %s' % error.code)
+
+
+def parallel_map(func, items, max_workers=10, timeout=None):
+    """This function calls func for each item on a bounded pool of threads.
+
+    :param func: function taking a single argument
+    :param items: list of arguments
+    :param max_workers: maximum number of concurrent calls
+    :param timeout: seconds to wait for all the results, None waits forever
+    :returns: list of results in the same order as items. The result is None
+              for items whose call raised an exception or did not complete
+              before the timeout.
+    """
+    logger = get_logger()
+    items = list(items)
+    if not items:
+        return []
+
+    pool = ThreadPool(max(1, min(max_workers, len(items))))
+    try:
+        pending = [pool.apply_async(_call_guarded, (func, item))
+                   for item in items]
+        deadline = None if timeout is None else time.time() + timeout
+
+        results = []
+        for item, result in zip(items, pending):
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            try:
+                results.append(result.get(remaining))
+            except TimeoutError:
+                logger.error('Timed out waiting for %s(%s)',
+                             getattr(func, '__name__', func), item)
+                results.append(None)
+            except Exception as error:
+                logger.error('Error calling %s(%s): %s',
+                             getattr(func, '__name__', func), item, error)
+                results.append(None)
+    finally:
+        # don't join: calls that timed out keep running in daemon threads
+        pool.close()
+
+    return results
+
+
+def drop_expired(cache, now):
+    """ It removes the expired entries of a key -> (value, expiry time) cache,
+        so caches kept by a long running daemon do not grow without limit.
+        The caller holds the cache's lock.
+
+    :param cache: dict of key -> (value, expiry time)
+    :param now: current time in seconds since the epoch
+    """
+    for key in [key for key, (_, expires) in cache.items() if expires <= now]:
+        del cache[key]
+
+
 def get_server(server_id):
     """ It gets Cloud server object by server_id
 
+    Servers are fetched by id and cached for SERVER_CACHE_TTL seconds.
+
+    :param server_id: server uuid
+    :returns: server object or None if it could not be fetched
     """
-    cs = pyrax.cloudservers
+    with _server_cache_lock:
+        cached = _server_cache.get(server_id)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    import pyrax
     try:
-        return [s for s in cs.list() if s.id == server_id]
-    except:
-        logging.info('no cloud server with id: %s', server_id)
+        server = pyrax.cloudservers.servers.get(server_id)
+    except Exception as error:
+        get_logger().info('no cloud server with id: %s (%s)', server_id, error)
         return None
 
+    now = time.time()
+    with _server_cache_lock:
+        drop_expired(_server_cache, now)
+        _server_cache[server_id] = (server, now + SERVER_CACHE_TTL)
+    return server
+
+
+def get_servers(server_ids, max_workers=10):
+    """ It gets Cloud server objects for several server ids concurrently
+
+    :param server_ids: list of server uuids
+    :param max_workers: maximum number of concurrent requests
+    :returns: list of server objects in the same order as server_ids, None
+              for servers that could not be fetched
+    """
+    return parallel_map(get_server, server_ids, max_workers=max_workers)
+
+
+def clear_server_cache():
+    """ It drops every server cached by get_server
+
+    """
+    with _server_cache_lock:
+        _server_cache.clear()
+
 
 def is_ipv4(address):
     """It checks if address is valid IP v4
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cPickle as pickle
+import hashlib
+import json
+import logging
+import os
+
+from raxas import aggregation
+
+# bump whenever Config, GroupConfig, PluginConfig or the schemas change, so
+# configs compiled by an older version are not reused
+CONFIG_CACHE_VERSION = 8
+
+NUMBER = (int, long, float)
+STRING = basestring
+
+# Declarative description of config.json. Each key maps to a rule with the
+# accepted 'type', whether it is 'required', a 'min' value for numbers, the
+# allowed 'choices', a 'check' function raising ValueError for invalid values,
+# 'keys' for nested objects and 'items' for the elements of lists. Keys that
+# are not described are reported as warnings, values of the wrong type or
+# missing required keys as errors.
+URL_LIST = {'type': list, 'items': {'type': STRING}}
+
+HOOKS = {'type': dict, 'keys': {'pre': URL_LIST, 'post': URL_LIST}}
+
+AUTH_SCHEMA = {
+    'os_username': {'type': STRING},
+    'os_password': {'type': STRING},
+    'os_region_name': {'type': STRING}
+}
+
+WEBHOOKS_SCHEMA = {
+    'scale_up': HOOKS,
+    'scale_down': HOOKS,
+    'timeout': {'type': NUMBER, 'min': 0},
+    'retries': {'type': int, 'min': 0},
+    'backoff': {'type': NUMBER, 'min': 0},
+    'post_async': {'type': bool},
+    'include_config': {'type': bool}
+}
+
+HYSTERESIS_SCHEMA = {
+    'scale_up_after': {'type': int, 'min': 1},
+    'scale_down_after': {'type': int, 'min': 1},
+    'scale_up_cooldown': {'type': NUMBER, 'min': 0},
+    'scale_down_cooldown': {'type': NUMBER, 'min': 0}
+}
+
+GROUP_SCHEMA = {
+    'group_id': {'type': STRING, 'required': True},
+    'scale_up_policy': {'type': STRING, 'required': True},
+    'scale_down_policy': {'type': STRING, 'required': True},
+    'webhooks': {'type': dict, 'keys': WEBHOOKS_SCHEMA},
+    'hysteresis': {'type': dict, 'keys': HYSTERESIS_SCHEMA},
+    'plugins': {'type': dict},
+    # pre v0.3 groups configure raxmon at the top level
+    'scale_up_threshold': {'type': NUMBER},
+    'scale_down_threshold': {'type': NUMBER},
+    'check_config': {'type': (dict, STRING)},
+    'metric_name': {'type': STRING},
+    'check_type': {'type': STRING}
+}
+
+
+def check_ewma_alpha(value):
+    """This function checks the weight of the newest sample in an ewma.
+
+    :param value: json number
+    :raises ValueError: unless 0 < value <= 1
+    """
+    if not 0 < value <= 1:
+        raise ValueError('must be greater than 0 and at most 1, got %s'
+                         % json.dumps(value))
+
+
+AGGREGATE = {'type': STRING, 'check': aggregation.get_aggregator}
+
+DATA_POINTS = {'type': STRING, 'choices': ['latest', 'all']}
+
+# keys every plugin accepts
+PLUGIN_SCHEMA = {
+    'decision_timeout': {'type': NUMBER, 'min': 0}
+}
+
+# keys of the plugins shipped with rax-autoscaler, other plugins are not
+# checked beyond PLUGIN_SCHEMA
+BUILTIN_PLUGIN_SCHEMAS = {
+    'raxmon': {
+        'scale_up_threshold': {'type': NUMBER},
+        'scale_down_threshold': {'type': NUMBER},
+        'check_config': {'type': (dict, STRING)},
+        'metric_name': {'type': STRING},
+        'check_type': {'type': STRING},
+        'max_samples': {'type': int, 'min': 1},
+        'aggregate': AGGREGATE,
+        'data_points': DATA_POINTS,
+        'mode': {'type': STRING, 'choices': ['threshold', 'predictive']},
+        'prediction_horizon': {'type': NUMBER, 'min': 0},
+        'trend_window': {'type': NUMBER, 'min': 120}
+    },
+    'raxmon_autoscale': {
+        'check_config': {'type': dict},
+        'metric_name': {'type': STRING},
+        'check_type': {'type': STRING},
+        'load_balancers': {'type': list, 'items': {'type': int}},
+        'num_static_servers': {'type': int, 'min': 0},
+        'max_samples': {'type': int, 'min': 1}
+    },
+    'raxclb': {
+        'scale_up_threshold': {'type': NUMBER},
+        'scale_down_threshold': {'type': NUMBER},
+        'check_type': {'type': STRING},
+        'loadbalancers': {'type': list, 'items': {'type': int}},
+        'historical_average': {'type': STRING, 'choices': ['mean', 'ewma']},
+        'ewma_alpha': {'type': NUMBER, 'check': check_ewma_alpha}
+    },
+    'newrelic': {
+        # newrelic-api falls back to the NEW_RELIC_API_KEY environment variable
+        'api_key': {'type': STRING},
+        'application': {'type': STRING},
+        'application_name': {'type': STRING},
+        'metric_name': {'type': STRING},
+        'metric_value': {'type': STRING},
+        'time_period': {'type': NUMBER, 'min': 1},
+        'scale_up_threshold': {'type': NUMBER},
+        'scale_down_threshold': {'type': NUMBER},
+        'aggregate': AGGREGATE,
+        'data_points': DATA_POINTS
+    }
+}
+
+TYPE_NAMES = {dict: 'an object', list: 'a list', bool: 'true or false',
+              int: 'an integer', NUMBER: 'a number', STRING: 'a string',
+              (dict, STRING): 'an object or a string'}
+
+
+def type_matches(value, expected):
+    """This function checks a json value against the type of a schema rule.
+       Booleans are not accepted as numbers.
+
+    :param value: json value
+    :param expected: type or tuple of types
+    :returns: True or False (Boolean)
+    """
+    if isinstance(value, bool) and expected is not bool:
+        return False
+    return isinstance(value, expected)
+
+
+def validate(data, schema, path):
+    """This function checks a json object against a schema and returns every
+       problem found, instead of stopping at the first one.
+
+    :param data: json object
+    :param schema: dict of key -> rule
+    :param path: dotted path of data, used in the messages
+    :returns: tuple of lists of error and warning messages
+    """
+    errors, warnings = [], []
+
+    for key in sorted(schema):
+        if schema[key].get('required') and data.get(key) is None:
+            errors.append('%s.%s: missing required key' % (path, key))
+
+    for key in sorted(data):
+        key_path = '%s.%s' % (path, key)
+        rule = schema.get(key)
+        if rule is None:
+            warnings.append('%s: unknown key' % key_path)
+            continue
+
+        value = data[key]
+        if value is None:
+            # reported above if the key is required
+            continue
+        if not type_matches(value, rule['type']):
+            errors.append('%s: expected %s, got %s' %
+                          (key_path, TYPE_NAMES[rule['type']], json.dumps(value)))
+        elif 'min' in rule and value < rule['min']:
+            errors.append('%s: must be at least %s, got %s' %
+                          (key_path, rule['min'], json.dumps(value)))
+        elif 'choices' in rule and value not in rule['choices']:
+            errors.append('%s: must be one of %s, got %s' %
+                          (key_path, ', '.join(rule['choices']), json.dumps(value)))
+        elif 'check' in rule:
+            try:
+                rule['check'](value)
+            except ValueError as error:
+                errors.append('%s: %s' % (key_path, error))
+        elif 'keys' in rule:
+            key_errors, key_warnings = validate(value, rule['keys'], key_path)
+            errors.extend(key_errors)
+            warnings.extend(key_warnings)
+        elif 'items' in rule:
+            for index, item in enumerate(value):
+                if not type_matches(item, rule['items']['type']):
+                    errors.append('%s[%d]: expected %s, got %s' %
+                                  (key_path, index,
+                                   TYPE_NAMES[rule['items']['type']],
+                                   json.dumps(item)))
+
+    return errors, warnings
+
+
+def validate_aggregate_order(data, path):
+    """This function checks that an aggregate depending on the order of the
+       samples, such as ewma, is only used with every data point of the time
+       period. The latest values of the servers have no order.
+
+    :param data: plugin configuration
+    :param path: dotted path of data, used in the messages
+    :returns: list of error messages
+    """
+    aggregate = data.get('aggregate')
+    if (isinstance(aggregate, STRING) and aggregation.is_ordered(aggregate) and
+            data.get('data_points', 'latest') != 'all'):
+        return ['%s.aggregate: %s needs data_points "all"' % (path, aggregate)]
+    return []
+
+
+def legacy_plugins(data):
+    """This function converts the top level raxmon settings of a pre v0.3
+       scaling group into a plugins section.
+
+    :param data: scaling group configuration
+    :returns: dict of plugin name -> plugin configuration
+    """
+    return {
+        'raxmon': {
+            'scale_up_threshold': data.get('scale_up_threshold', 0.6),
+            'scale_down_threshold': data.get('scale_down_threshold', 0.4),
+            'check_config': data.get('check_config', '{}'),
+            'metric_name': data.get('metric_name', '1m'),
+            'check_type': data.get('check_type', 'agent.load_average')
+        }
+    }
+
+
+class PluginConfig(dict):
+    """
+    This class holds the configuration of one plugin of a scaling group.
+    Plugins read it like the dict from the config file.
+    """
+
+    def __init__(self, name, data):
+        super(PluginConfig, self).__init__(data)
+        self.name = name
+        self.decision_timeout = data.get('decision_timeout')
+
+
+class GroupConfig(dict):
+    """
+    This class holds the configuration of one scaling group, with the
+    required keys checked and the plugins section compiled to PluginConfig
+    objects. It can be used like the dict from the config file.
+    """
+
+    def __init__(self, data, name=None):
+        super(GroupConfig, self).__init__(data)
+        self.name = name
+        path = 'autoscale_groups.%s' % (name or 'group')
+        self.errors, self.warnings = validate(data, GROUP_SCHEMA, path)
+
+        self.group_id = data.get('group_id')
+        self.scale_up_policy = data.get('scale_up_policy')
+        self.scale_down_policy = data.get('scale_down_policy')
+        self.webhooks = data.get('webhooks') or {}
+        self.hysteresis = data.get('hysteresis') or {}
+
+        self.legacy = data.get('plugins') is None
+        plugins = legacy_plugins(data) if self.legacy else data['plugins']
+        self.plugins = {}
+        if isinstance(plugins, dict):
+            for plugin_name, plugin_data in sorted(plugins.items()):
+                plugin_path = '%s.plugins.%s' % (path, plugin_name)
+                if not isinstance(plugin_data, dict):
+                    self.errors.append('%s: expected an object, got %s' %
+                                       (plugin_path, json.dumps(plugin_data)))
+                    continue
+                schema = dict(PLUGIN_SCHEMA)
+                if plugin_name in BUILTIN_PLUGIN_SCHEMAS:
+                    schema.update(BUILTIN_PLUGIN_SCHEMAS[plugin_name])
+                else:
+                    # third party plugin, only check the common keys
+                    plugin_data = dict((key, value) for key, value
+                                       in plugin_data.items() if key in schema)
+                plugin_errors, plugin_warnings = validate(plugin_data, schema,
+                                                          plugin_path)
+                if 'aggregate' in schema:
+                    plugin_errors.extend(validate_aggregate_order(plugin_data,
+                                                                  plugin_path))
+                self.errors.extend(plugin_errors)
+                self.warnings.extend(plugin_warnings)
+                self.plugins[plugin_name] = PluginConfig(plugin_name,
+                                                         plugins[plugin_name])
+        self['plugins'] = self.plugins
+
+
+class Config(dict):
+    """
+    This class holds the compiled configuration file, with every scaling
+    group compiled to a GroupConfig object. It can be used like the dict
+    from the config file.
+
+    errors and warnings list every problem found in the file.
+    """
+
+    def __init__(self, data):
+        super(Config, self).__init__(data)
+        self.auth = data.get('auth') or {}
+        self.errors, self.warnings = [], []
+
+        if not isinstance(self.auth, dict):
+            self.errors.append('auth: expected an object, got %s' %
+                               json.dumps(self.auth))
+            self.auth = {}
+        else:
+            self.errors, self.warnings = validate(self.auth, AUTH_SCHEMA, 'auth')
+
+        groups = data.get('autoscale_groups')
+        self.groups = {}
+        if not isinstance(groups, dict) or not groups:
+            self.errors.append('autoscale_groups: expected an object with at '
+                               'least one scaling group')
+            return
+
+        for group_name, group_data in sorted(groups.items()):
+            if isinstance(group_data, dict):
+                group = GroupConfig(group_data, group_name)
+                self.errors.extend(group.errors)
+                self.warnings.extend(group.warnings)
+            else:
+                group = group_data
+                self.errors.append('autoscale_groups.%s: expected an object, '
+                                   'got %s' % (group_name, json.dumps(group_data)))
+            self.groups[group_name] = group
+        self['autoscale_groups'] = self.groups
+
+    @property
+    def valid(self):
+        """True if the configuration has no errors, warnings are allowed"""
+        return not self.errors
+
+
+def cache_file_name(config_file):
+    """This function returns the name of the compiled config cache, a hidden
+       file next to the config file.
+
+    :param config_file: config file name
+    :returns: cache file name
+    """
+    directory, name = os.path.split(os.path.abspath(config_file))
+    return os.path.join(directory, '.%s.cache' % name)
+
+
+def read_cache(config_file):
+    """This function returns the cache entry of a config file, or None if
+       there is none we can trust.
+
+    The cache is only read if it belongs to the current user and nobody
+    else can write it, it holds pickled objects.
+
+    :param config_file: config file name
+    :returns: dict with version, mtime, size, digest and config keys
+    """
+    logger = logging.getLogger(__name__)
+    file_path = cache_file_name(config_file)
+
+    try:
+        with open(file_path, 'rb') as cache_file:
+            stat = os.fstat(cache_file.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                logger.warning('ignoring config cache %s, it is not private',
+                               file_path)
+                return None
+            entry = pickle.load(cache_file)
+        if entry['version'] == CONFIG_CACHE_VERSION:
+            return entry
+    except (IOError, OSError, EOFError, KeyError, TypeError,
+            pickle.UnpicklingError, AttributeError, ImportError) as error:
+        logger.debug('unable to read config cache %s: %s', file_path, error)
+
+    return None
+
+
+def write_cache(config_file, entry):
+    """This function replaces the cache entry of a config file atomically.
+       A config directory we can't write to just means no caching.
+
+    :param config_file: config file name
+    :param entry: dict with version, mtime, size, digest and config keys
+    """
+    # raxas.common imports this module
+    from raxas import common
+
+    logger = logging.getLogger(__name__)
+    file_path = cache_file_name(config_file)
+
+    try:
+        common.write_atomically(
+            file_path,
+            lambda cache_file: pickle.dump(entry, cache_file, pickle.HIGHEST_PROTOCOL),
+            mode='wb')
+    except (IOError, OSError, pickle.PicklingError) as error:
+        logger.debug('unable to write config cache %s: %s', file_path, error)
+
+
+def load_config(config_file):
+    """This function returns the compiled configuration of a config file.
+
+    The compiled configuration is cached next to the config file. It is
+    reused as long as the file has the same modification time and size, or
+    failing that the same content.
+
+    :param config_file: json configuration file name
+    :returns: Config object
+    """
+    try:
+        stat = os.stat(config_file)
+    except OSError:
+        stat = None
+
+    entry = read_cache(config_file) if stat is not None else None
+    if entry is not None and (entry['mtime'], entry['size']) == \
+            (stat.st_mtime, stat.st_size):
+        return entry['config']
+
+    with open(config_file) as json_file:
+        content = json_file.read()
+    digest = hashlib.sha1(content).hexdigest()
+
+    if entry is not None and entry['digest'] == digest:
+        config = entry['config']
+    else:
+        config = Config(json.loads(content))
+
+    if stat is not None:
+        write_cache(config_file, {'version': CONFIG_CACHE_VERSION,
+                                  'mtime': stat.st_mtime,
+                                  'size': stat.st_size,
+                                  'digest': digest,
+                                  'config': config})
+    return config
@@ -22,27 +22,133 @@
 #             "plugins":{
 #                 "newrelic":{
 #                     "api_key": "",
-#                     "application_name":"<optional>",
+#                     "application":"<optional>",
 #                     "scale_up_threshold": 0.6,
 #                     "scale_down_threshold": 0.4,
 #                     "metric_name": "System/Load",
-#                     "metric_value": "average_value"
+#                     "metric_value": "average_value",
+#                     "aggregate": "mean",
+#                     "data_points": "latest"
 #                 }
 #
 # To see valid metric names and values please use the API explorer.
 # For applications : https://rpm.newrelic.com/api/explore/applications/metric_names
 # For Servers : https://rpm.newrelic.com/api/explore/servers/names
 
+import hashlib
+import json
 import logging
+import operator
+import os
+import time
 from datetime import datetime as dt, timedelta
-import pyrax
+from raxas import aggregation, common
 from raxas.core_plugins.base import PluginBase
 try:
     from newrelic_api import Applications, Servers
+    from newrelic_api.exceptions import NewRelicAPIServerException
 except ImportError:
+    # reported when the plugin is loaded, so groups that don't use New Relic
+    # keep working without newrelic-api installed
+    Applications = Servers = NewRelicAPIServerException = None
+
+# New Relic ids by name for each api key, kept between runs
+ID_CACHE_FILE = '/dev/shm/.raxas-newrelic-%s.cache'
+
+# seconds a server or application id is reused, and a name unknown to New
+# Relic is not looked up again. Application ids are also dropped as soon as
+# New Relic doesn't find them any more.
+SERVER_ID_TTL = 3600
+APPLICATION_ID_TTL = 86400
+MISSING_ID_TTL = 300
+
+# upper bound on the pages of servers listed at once
+MAX_SERVER_PAGES = 50
+
+
+def id_cache_file(api_key):
+    """This function returns the name of the id cache of an api key.
+
+    :param api_key: New Relic api key
+    :returns: file path
+    """
+    return ID_CACHE_FILE % hashlib.sha1(api_key or '').hexdigest()[:16]
+
+
+def read_id_cache(api_key, kind):
+    """This function returns the cached New Relic ids of one kind of entity.
+
+    :param api_key: New Relic api key
+    :param kind: 'servers' or 'applications'
+    :returns: dict of name -> id, the id is None for names New Relic does
+              not know about. Expired entries are left out.
+    """
+    logger = logging.getLogger(__name__)
+    file_path = id_cache_file(api_key)
+
+    try:
+        with open(file_path, 'r') as cache_file:
+            entries = json.load(cache_file).get(kind, {})
+        now = time.time()
+        return dict((name, entity_id) for name, (entity_id, expires)
+                    in entries.items() if expires > now)
+    except (IOError, ValueError, TypeError, AttributeError) as error:
+        logger.debug('unable to read New Relic id cache %s: %s', file_path, error)
+        return {}
+
+
+def _update_id_cache(api_key, update):
     logger = logging.getLogger(__name__)
-    logger.error('Please install newrelic-api.')
-    exit(1)
+    file_path = id_cache_file(api_key)
+
+    try:
+        with open(file_path, 'r') as cache_file:
+            cache = json.load(cache_file)
+        if not isinstance(cache, dict):
+            cache = {}
+    except (IOError, ValueError):
+        cache = {}
+
+    update(cache)
+
+    try:
+        common.write_atomically(file_path,
+                                lambda cache_file: json.dump(cache, cache_file))
+    except (IOError, OSError) as error:
+        logger.error('unable to write New Relic id cache %s: %s', file_path, error)
+
+
+def write_id_cache(api_key, kind, ids, ttl):
+    """This function adds New Relic ids of one kind of entity to the cache.
+
+    :param api_key: New Relic api key
+    :param kind: 'servers' or 'applications'
+    :param ids: dict of name -> id, None for unknown names
+    :param ttl: seconds the ids are valid
+    """
+    expires = time.time() + ttl
+
+    def update(cache):
+        entries = cache.setdefault(kind, {})
+        for name, entity_id in ids.items():
+            entries[name] = [entity_id, expires]
+
+    _update_id_cache(api_key, update)
+
+
+def invalidate_id_cache(api_key, kind, names):
+    """This function drops cached New Relic ids of one kind of entity.
+
+    :param api_key: New Relic api key
+    :param kind: 'servers' or 'applications'
+    :param names: list of names
+    """
+    def update(cache):
+        entries = cache.get(kind, {})
+        for name in names:
+            entries.pop(name, None)
+
+    _update_id_cache(api_key, update)
 
 
 class NewRelic(PluginBase):
@@ -53,20 +159,159 @@ class NewRelic(PluginBase):
     def __init__(self, scaling_group):
         super(NewRelic, self).__init__(scaling_group)
 
+        if Applications is None:
+            raise ImportError('Please install newrelic-api.')
+
         config = scaling_group.plugin_config.get(self.name)
-        self.api_key = config.get('api_key', None)
-        self.application_name = config.get('application', None)
+        # the same fallback newrelic-api uses, so the id cache is keyed by
+        # the key actually sent
+        self.api_key = (config.get('api_key') or os.environ.get('NEW_RELIC_API_KEY') or
+                        os.environ.get('NEWRELIC_API_KEY'))
+        # application_name is what earlier versions documented
+        self.application_name = config.get('application', config.get('application_name'))
         self.metric_name = config.get('metric_name', 'System/Load')
         self.metric_value = config.get('metric_value', 'average_value')
         self.time_period = config.get('time_period', 30)
         self.scale_up_threshold = config.get('scale_up_threshold', 0.6)
         self.scale_down_threshold = config.get('scale_down_threshold', 0.4)
+        self.aggregate = config.get('aggregate', 'mean')
+        self.all_points = config.get('data_points', 'latest') == 'all'
         self.scaling_group = scaling_group
 
+        # fail when the plugin is loaded rather than on every decision
+        aggregation.get_aggregator(self.aggregate)
+        if aggregation.is_ordered(self.aggregate) and not self.all_points:
+            raise ValueError('aggregate %s needs data_points "all"' % self.aggregate)
+
     @property
     def name(self):
         return 'newrelic'
 
+    def get_values(self, data):
+        """This function returns the metric values of a metric_data response.
+
+        The response has a single summarized timeslice unless every data
+        point of the time period was requested.
+
+        :param data: metric_data response
+        :returns: list of (timeslice start, value) tuples with a value
+                  greater than 0, oldest first
+        """
+        logger = logging.getLogger(__name__)
+
+        try:
+            timeslices = data["metric_data"]["metrics"][0]["timeslices"]
+        except (KeyError, IndexError, TypeError):
+            return []
+
+        values = []
+        for timeslice in timeslices:
+            value = timeslice.get("values", {}).get(self.metric_value)
+            if value is not None and value > 0:
+                values.append((timeslice.get("from", ""), float(value)))
+
+        if values:
+            logger.info('Found metric for: %s, value: %s',
+                        self.metric_name, str(values[-1][1]))
+        return values
+
+    def get_application_id(self, applications):
+        """This function resolves the New Relic id of the application.
+
+        :param applications: newrelic_api Applications
+        :returns: application id, None if New Relic has no such application
+        """
+        app_ids = read_id_cache(self.api_key, 'applications')
+        if self.application_name in app_ids:
+            return app_ids[self.application_name]
+
+        app_list = applications.list(filter_name=self.application_name)
+        if app_list["applications"]:
+            app_id = app_list["applications"][0]["id"]
+            write_id_cache(self.api_key, 'applications',
+                           {self.application_name: app_id}, APPLICATION_ID_TTL)
+        else:
+            app_id = None
+            write_id_cache(self.api_key, 'applications',
+                           {self.application_name: None}, MISSING_ID_TTL)
+        return app_id
+
+    def get_application_data(self, applications, from_dt, to_dt):
+        """This function fetches the metric of the application.
+
+        A cached application id New Relic doesn't find any more is dropped
+        and resolved again.
+
+        :param applications: newrelic_api Applications
+        :param from_dt: start of the time period
+        :param to_dt: end of the time period
+        :returns: metric_data response, None if the application is not found
+        """
+        logger = logging.getLogger(__name__)
+
+        for attempt in range(2):
+            app_id = self.get_application_id(applications)
+            if app_id is None:
+                logger.error('New Relic application %s not found',
+                             self.application_name)
+                return None
+
+            try:
+                return applications.metric_data(
+                    app_id, [self.metric_name], values=[self.metric_value],
+                    summarize=not self.all_points, from_dt=from_dt, to_dt=to_dt)
+            except NewRelicAPIServerException as error:
+                if not str(error).startswith('404'):
+                    raise
+                logger.warning('New Relic application %s (%s) not found, '
+                               'looking it up again', self.application_name, app_id)
+                invalidate_id_cache(self.api_key, 'applications',
+                                    [self.application_name])
+
+        return None
+
+    def get_server_ids(self, servers, hostnames):
+        """This function resolves the New Relic server ids of hostnames.
+
+        Ids are cached, the servers of the account are listed once when some
+        hostnames are not.
+
+        :param servers: newrelic_api Servers
+        :param hostnames: list of hostnames
+        :returns: list of (hostname, server id) tuples of the hostnames known
+                  to New Relic
+        """
+        logger = logging.getLogger(__name__)
+
+        server_ids = read_id_cache(self.api_key, 'servers')
+        missing = [hostname.lower() for hostname in hostnames
+                   if hostname.lower() not in server_ids]
+
+        if missing:
+            listed = {}
+            for page in range(1, MAX_SERVER_PAGES + 1):
+                response = servers.list(page=page)
+                for server in response.get('servers', []):
+                    listed[server['name'].lower()] = server['id']
+                if 'next' not in response.get('pages', {}):
+                    break
+
+            unknown = dict((hostname, None) for hostname in missing
+                           if hostname not in listed)
+            write_id_cache(self.api_key, 'servers', listed, SERVER_ID_TTL)
+            write_id_cache(self.api_key, 'servers', unknown, MISSING_ID_TTL)
+            server_ids.update(listed)
+            server_ids.update(unknown)
+
+        result = []
+        for hostname in hostnames:
+            server_id = server_ids.get(hostname.lower())
+            if server_id is None:
+                logger.warning('No New Relic server found for %s', hostname)
+            else:
+                result.append((hostname, server_id))
+        return result
+
     def make_decision(self):
         """
         This function decides to scale up or scale down
@@ -81,63 +326,46 @@ class NewRelic(PluginBase):
 
         if self.application_name:
             a = Applications(self.api_key)
-            app_list = a.list(filter_name=self.application_name)
-            if app_list["applications"]:
-                logger.info('Gathering Monitoring Data')
-                app_id = app_list["applications"][0]["id"]
-                then = dt.now() - timedelta(minutes=self.time_period)
-                data = a.metric_data(app_id, [self.metric_name], values=[self.metric_value],
-                                     summarize=True, from_dt=then, to_dt=dt.now())
-                try:
-                    value = (data["metric_data"]["metrics"][0]
-                             ["timeslices"][0]["values"][self.metric_value])
-
-                    if value > 0:
-                            logger.info('Found metric for: %s, value: %s',
-                                        self.metric_name, str(value))
-                            results.append(float(value))
-                except KeyError:
-                    pass
+            logger.info('Gathering Monitoring Data')
+            then = dt.now() - timedelta(minutes=self.time_period)
+            values = self.get_values(self.get_application_data(a, then, dt.now()))
+            results = [value for _, value in values]
 
         else:
-            hostnames = []
-            active_servers = self.scaling_group.active_servers
-            for server_id in active_servers:
-                server = pyrax.cloudservers.servers.get(server_id)
-                hostnames.append(server.human_id)
+            hostnames = [server.human_id for server
+                         in common.get_servers(self.scaling_group.active_servers)
+                         if server is not None]
 
             logger.info('Gathering Monitoring Data')
 
             s = Servers(self.api_key)
-            for host in hostnames:
-                relic_server = s.list(filter_name=host)
-
-                if relic_server["servers"]:
-                    id = relic_server["servers"][0]["id"]
-                    then = dt.now() - timedelta(minutes=self.time_period)
-                    data = s.metric_data(id, [self.metric_name],
-                                         values=[self.metric_value], summarize=True,
-                                         from_dt=then, to_dt=dt.now())
-                    try:
-                        value = (data["metric_data"]["metrics"][0]
-                                 ["timeslices"][0]["values"][self.metric_value])
-
-                        if value > 0:
-                                logger.info('Found metric for: %s, value: %s',
-                                            self.metric_name, str(value))
-                                results.append(float(value))
-                                break
-                    except KeyError:
-                        continue
+            server_ids = self.get_server_ids(s, hostnames)
+            then = dt.now() - timedelta(minutes=self.time_period)
+            now = dt.now()
+
+            def fetch(server_id):
+                return s.metric_data(server_id, [self.metric_name],
+                                     values=[self.metric_value],
+                                     summarize=not self.all_points,
+                                     from_dt=then, to_dt=now)
+
+            fetched = common.parallel_map(fetch, [server_id for _, server_id
+                                                  in server_ids])
+
+            # the values of every server, oldest first
+            values = []
+            for data in fetched:
+                values.extend(self.get_values(data))
+            results = [value for _, value in sorted(values, key=operator.itemgetter(0))]
 
         if len(results) == 0:
             logger.error('No data available')
             return None
         else:
-            average = sum(results)/len(results)
+            average = aggregation.aggregate(self.aggregate, results)
 
-        logger.info('Cluster average for %s (%s) at: %s',
-                    self.metric_name, self.metric_value, str(average))
+        logger.info('Cluster %s for %s (%s) over %d value(s) at: %s', self.aggregate,
+                    self.metric_name, self.metric_value, len(results), str(average))
 
         if average > self.scale_up_threshold:
             logger.info("Raxmon reports scale up.")
@@ -24,14 +24,58 @@
 #         "scale_up_threshold": 50,
 #         "scale_down_threshold": 1,
 #         "check_type": "",
-#         "load_balancers": <optional>
+#         "load_balancers": <optional>,
+#         "historical_average": "mean",
+#         "ewma_alpha": 0.5
 #     }
 
 import pyrax
+from raxas import common
 from raxas.core_plugins.base import PluginBase
 from datetime import datetime, timedelta
+import calendar
 import logging
+import re
 from pyrax.exceptions import NotFound
+from raxas.timeseries import RingBuffer
+
+# historical connection counts of each load balancer and check type, kept
+# between runs so that only the usage records newer than the stored ones are
+# fetched
+USAGE_STORE_FILE = '/dev/shm/.raxas-clb-%s-%s.ts'
+USAGE_STORE_SIZE = 64
+
+# timestamps of usage records, e.g. 2016-02-01T10:00:00Z or
+# 2016-02-01T04:00:00-06:00
+TIME_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?'
+                          r'(?:Z|([+-])(\d{2}):?(\d{2}))?$')
+
+
+def parse_time(value):
+    """This function converts the timestamp of a usage record to UTC.
+
+    :param value: timestamp string
+    :returns: naive datetime in UTC, None if value can't be parsed
+    """
+    match = TIME_PATTERN.match(value or '')
+    if match is None:
+        return None
+
+    timestamp, sign, hours, minutes = match.groups()
+    result = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+    if sign is not None:
+        offset = timedelta(hours=int(hours), minutes=int(minutes))
+        result = result - offset if sign == '+' else result + offset
+    return result
+
+
+def epoch(value):
+    """This function converts a naive UTC datetime to seconds since the epoch.
+
+    :param value: naive datetime in UTC
+    :returns: seconds since the epoch
+    """
+    return calendar.timegm(value.utctimetuple())
 
 
 class Raxclb(PluginBase):
@@ -49,6 +93,12 @@ class Raxclb(PluginBase):
         self.scale_down_threshold = config.get('scale_down_threshold', 1)
         self.check_type = config.get('check_type', '')
         self.lb_ids = config.get('loadbalancers', [])
+        self.historical_average = config.get('historical_average', 'mean')
+        self.ewma_alpha = config.get('ewma_alpha', 0.5)
+        if not 0 < self.ewma_alpha <= 1:
+            logging.getLogger(__name__).warning(
+                'ewma_alpha must be greater than 0 and at most 1, using 0.5')
+            self.ewma_alpha = 0.5
         self.check_time = 2
         self.scaling_group = scaling_group
 
@@ -56,6 +106,47 @@ class Raxclb(PluginBase):
     def name(self):
         return 'raxclb'
 
+    def get_usage_store(self, loadbalancer, lb_id, start_time, metric):
+        """This function returns the historical values of a metric of a load
+           balancer since start_time.
+
+        The values are kept in a ring buffer between runs, only the newest
+        stored usage record and the ones after it are fetched again.
+
+        :param loadbalancer: pyrax CloudLoadBalancer
+        :param lb_id: load balancer id
+        :param start_time: naive datetime in UTC
+        :param metric: name of the usage record field
+        :returns: RingBuffer
+        """
+        logger = logging.getLogger(__name__)
+
+        store = RingBuffer(USAGE_STORE_FILE % (lb_id, metric),
+                           capacity=USAGE_STORE_SIZE, alpha=self.ewma_alpha)
+        store.expire(epoch(start_time))
+
+        # the newest record may still be updated, so fetch it again
+        fetch_from = start_time
+        if store.last_timestamp is not None:
+            fetch_from = max(start_time, datetime.utcfromtimestamp(store.last_timestamp))
+        usage = loadbalancer.get_usage(start=fetch_from)
+
+        samples = []
+        for record in usage.get('loadBalancerUsageRecords') or []:
+            record_time = parse_time(record.get('startTime'))
+            if record_time is None or record.get(metric) is None:
+                logger.debug('Ignoring usage record %s of lb %s', record, lb_id)
+                continue
+            samples.append((epoch(record_time), record.get(metric)))
+
+        for timestamp, value in sorted(samples):
+            if store.last_timestamp is None or timestamp >= store.last_timestamp:
+                store.append(timestamp, value)
+        store.expire(epoch(start_time))
+
+        store.save()
+        return store
+
     def make_decision(self):
         """
         This function decides to scale up or scale down
@@ -100,27 +191,34 @@ class Raxclb(PluginBase):
             hist_check = 'averageNumConnections'
             cur_check = 'currentConn'
 
-        for lb in self.lb_ids:
+        def fetch(lb):
             try:
-                check_clb = clb.get(lb)
+                check_clb = self.scaling_group.cached('loadbalancer', clb.get, lb)
             except NotFound:
-                logger.error('Loadbalancer specified does not exist')
+                logger.error('Loadbalancer %s specified does not exist', lb)
                 return None
 
-            usage = check_clb.get_usage(start=start_time)
-            current_usage = check_clb.get_stats()
+            return (self.get_usage_store(check_clb, lb, start_time, hist_check),
+                    check_clb.get_stats())
 
-            records = []
+        # all load balancers are queried at once, sharing the same client
+        fetched = common.parallel_map(fetch, self.lb_ids)
 
-            for record in usage.get('loadBalancerUsageRecords'):
-                records.append(record.get(hist_check))
+        for lb, data in zip(self.lb_ids, fetched):
+            if data is None:
+                continue
+            store, current_usage = data
 
-            try:
-                current_conn = current_usage.get(cur_check)
-                average_historical = sum(records) / len(records)
+            current_conn = current_usage.get(cur_check)
+            if self.historical_average.lower() == 'ewma':
+                average_historical = store.ewma
+            else:
+                average_historical = store.mean
+
+            if average_historical is None:
+                average = current_conn
+            else:
                 average = ((current_conn * 1.5) + average_historical) / 2
-            except ZeroDivisionError:
-                average = current_usage.get(cur_check)
 
             if average > self.scale_up_threshold:
                 results.append(1)
@@ -132,4 +230,7 @@ class Raxclb(PluginBase):
                 results.append(0)
                 logger.info("Raxclb reports normal for lb %s", lb)
 
+        if not results:
+            return None
+
         return sum(results)
@@ -24,16 +24,30 @@
 #         "check_config": {},
 #         "metric_name": "1m",
 #         "check_type": "agent.load_average",
-#         "max_samples": 10
+#         "max_samples": 10,
+#         "aggregate": "mean",
+#         "data_points": "latest",
+#         "mode": "threshold",
+#         "prediction_horizon": 300,
+#         "trend_window": 900
 #     }
 
 import logging
+import operator
 import random
 import time
+from raxas import aggregation, timeseries
 from raxas.core_plugins.base import PluginBase
 import raxas.monitoring as monitoring
 
 
+# seconds of data points aggregated into one sample of the metric history
+HISTORY_INTERVAL = 60
+
+# seconds of data points fetched when there is no history to continue from
+METRIC_WINDOW = 600
+
+
 class Raxmon(PluginBase):
     """
     Rackspace cloud monitoring plugin.
@@ -51,12 +65,51 @@ class Raxmon(PluginBase):
         self.metric_name = config.get('metric_name', '1m')
         self.check_type = config.get('check_type', 'agent.load_average')
         self.max_samples = config.get('max_samples', 10)
+        self.aggregate = config.get('aggregate', 'mean')
+        self.all_points = config.get('data_points', 'latest') == 'all'
+        self.mode = config.get('mode', 'threshold')
+        self.prediction_horizon = config.get('prediction_horizon', 300)
+        self.trend_window = config.get('trend_window', 900)
         self.scaling_group = scaling_group
 
+        # fail when the plugin is loaded rather than on every decision
+        aggregation.get_aggregator(self.aggregate)
+        if aggregation.is_ordered(self.aggregate) and not self.all_points:
+            raise ValueError('aggregate %s needs data_points "all"' % self.aggregate)
+        if self.mode not in ('threshold', 'predictive'):
+            raise ValueError('unknown mode %r, expected threshold or predictive'
+                             % self.mode)
+
+    @property
+    def predictive(self):
+        return self.mode == 'predictive'
+
     @property
     def name(self):
         return 'raxmon'
 
+    def update_history(self, history, series):
+        """
+        This function adds data points to the metric history. The points of
+        all servers are aggregated per HISTORY_INTERVAL, the newest stored
+        interval is replaced as it may have been incomplete.
+
+        :param history: RingBuffer
+        :param series: list of (timestamp in ms, value) lists, one per server
+        """
+        buckets = {}
+        for points in series:
+            for timestamp, value in points:
+                bucket = int(timestamp / 1000) // HISTORY_INTERVAL * HISTORY_INTERVAL
+                buckets.setdefault(bucket, []).append((timestamp, float(value)))
+
+        for bucket in sorted(buckets):
+            if history.last_timestamp is None or bucket >= history.last_timestamp:
+                points = sorted(buckets[bucket], key=operator.itemgetter(0))
+                history.append(bucket, aggregation.aggregate(
+                    self.aggregate, [value for _, value in points]))
+        history.save()
+
     def make_decision(self):
         """
         This function decides to scale up or scale down
@@ -68,8 +121,6 @@ class Raxmon(PluginBase):
         """
         logger = logging.getLogger(__name__)
 
-        results = []
-
         entities = monitoring.get_entities(self.scaling_group)
 
         monitoring.add_entity_checks(entities,
@@ -84,40 +135,64 @@ class Raxmon(PluginBase):
         # Shuffle entities so the sample uses different servers
         entities = random.sample(entities, len(entities))
 
-        for ent in entities:
-            ent_checks = ent.list_checks()
-            for check in ent_checks:
-                if check.type == self.check_type:
-                    data = check.get_metric_data_points(self.metric_name,
-                                                        int(time.time())-600,
-                                                        int(time.time()),
-                                                        resolution='FULL')
-                    if len(data) > 0:
-                        point = len(data)-1
-                        logger.info('Found metric for: %s, value: %s',
-                                    ent.name, str(data[point]['average']))
-                        results.append(float(data[point]['average']))
-                        break
-
-            # Restrict number of data points to save on API calls
-            if len(results) >= self.max_samples:
-                logger.info('max_samples value of %s reached, not gathering any more statistics',
-                            self.max_samples)
-                break
+        now = time.time()
+        window = METRIC_WINDOW
+        history = None
+        if self.predictive:
+            history = timeseries.open_history(self.scaling_group.group_uuid,
+                                              self.check_type, self.metric_name)
+            if history.last_timestamp is not None and not self.all_points:
+                # only the data points since the newest stored interval, the
+                # threshold is checked against the latest point of each server
+                window = int(min(METRIC_WINDOW,
+                                 max(HISTORY_INTERVAL, now - history.last_timestamp)))
+
+        samples = monitoring.get_metric_samples(entities,
+                                                self.check_type,
+                                                self.metric_name,
+                                                window,
+                                                self.max_samples,
+                                                all_points=(self.all_points or
+                                                            self.predictive))
+
+        if self.all_points:
+            # every data point of every server, oldest first
+            results = [float(value) for _, value
+                       in sorted((point for points in samples for point in points),
+                                 key=operator.itemgetter(0))]
+        elif self.predictive:
+            results = [float(points[-1][1]) for points in samples]
+        else:
+            results = [float(value) for value in samples]
+
+        predicted = None
+        if history is not None:
+            self.update_history(history, samples)
+            predicted = timeseries.forecast(history.since(now - self.trend_window),
+                                            now + self.prediction_horizon)
+            if predicted is not None:
+                logger.info('Predicted %s for %s (%s) in %ss: %s', self.aggregate,
+                            self.check_type, self.metric_name,
+                            self.prediction_horizon, str(predicted))
 
         if len(results) == 0:
             logger.error('No data available')
             return None
         else:
-            average = sum(results)/len(results)
+            average = aggregation.aggregate(self.aggregate, results)
 
-        logger.info('Cluster average for %s (%s) at: %s',
-                    self.check_type, self.metric_name, str(average))
+        logger.info('Cluster %s for %s (%s) at: %s',
+                    self.aggregate, self.check_type, self.metric_name, str(average))
 
         if average > self.scale_up_threshold:
             logger.info("Raxmon reports scale up.")
             return 1
-        elif average < self.scale_down_threshold:
+        elif predicted is not None and predicted > self.scale_up_threshold:
+            logger.info("Raxmon predicts the scale up threshold will be crossed, "
+                        "reports scale up.")
+            return 1
+        elif average < self.scale_down_threshold and (
+                predicted is None or predicted < self.scale_down_threshold):
             logger.info("Raxmon reports scale down.")
             return -1
         else:
@@ -61,7 +61,6 @@
 
 import logging
 import random
-import time
 import pyrax
 import operator
 from raxas.core_plugins.base import PluginBase
@@ -102,7 +101,6 @@ class Raxmon_autoscale(PluginBase):
         """
         logger = logging.getLogger(__name__)
 
-        results = []
         entities = monitoring.get_entities(self.scaling_group)
 
         monitoring.add_entity_checks(entities,
@@ -115,26 +113,11 @@ class Raxmon_autoscale(PluginBase):
         # Shuffle entities so the sample uses different servers
         entities = random.sample(entities, len(entities))
 
-        for ent in entities:
-            ent_checks = ent.list_checks()
-            for check in ent_checks:
-                if check.type == self.check_type:
-                    data = check.get_metric_data_points(self.metric_name,
-                                                        int(time.time()) - 300,
-                                                        int(time.time()),
-                                                        resolution='FULL')
-                    if len(data) > 0:
-                        point = len(data) - 1
-                        logger.info('Found metric for: %s, value: %s',
-                                    ent.name, str(data[point]['average']))
-                        results.append(data[point]['average'])
-                        break
-
-            # Restrict number of data points to save on API calls
-            if len(results) >= self.max_samples:
-                logger.info('max_samples value of %s reached, not gathering any more statistics',
-                            self.max_samples)
-                break
+        results = monitoring.get_metric_samples(entities,
+                                                self.check_type,
+                                                self.metric_name,
+                                                300,
+                                                self.max_samples)
 
         scale_down = -1
         scale_up = 1
@@ -183,7 +166,7 @@ class Raxmon_autoscale(PluginBase):
             This is in order to prevent scaling down when the nodes in an existing group
             are unhealthy
         """
-        lb = clb.get(load_balancer)
+        lb = self.scaling_group.cached('loadbalancer', clb.get, load_balancer)
         # If there are no nodes at all under an LB, the attribute 'nodes'
         # doesn't exist at all
         try:
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import time
+
+from raxas import common
+from raxas.enums import ScaleDirection
+
+# decisions of each scaling group, kept between evaluations
+DECISION_STATE_FILE = '/dev/shm/.raxas-decision-%s.state'
+
+
+class DecisionState(object):
+    """
+    This class remembers the last scaling action of a scaling group and how
+    many consecutive evaluations agreed on the current scaling direction, so
+    a single outlier evaluation or an action during cooldown can be held
+    back before it reaches the Autoscale API.
+    """
+
+    def __init__(self, group_id):
+        self.file_path = DECISION_STATE_FILE % group_id
+        self.direction = ScaleDirection.Nothing
+        self.streak = 0
+        self.last_action = None
+        self.last_action_time = None
+
+        self.load()
+
+    def observe(self, direction):
+        """
+        This records the decision of an evaluation.
+
+        :param direction: raxas.enums.ScaleDirection
+        :returns: number of consecutive evaluations that decided direction,
+                  including this one
+        """
+        if direction == self.direction:
+            self.streak += 1
+        else:
+            self.direction = direction
+            self.streak = 1
+        return self.streak
+
+    def cooldown_remaining(self, cooldown, now):
+        """
+        :param cooldown: seconds to wait after the last scaling action
+        :param now: current time in seconds since the epoch
+        :returns: seconds left until cooldown has passed, 0 if it has
+        """
+        if self.last_action_time is None:
+            return 0
+        return max(0, self.last_action_time + cooldown - now)
+
+    def record_action(self, direction, now):
+        """
+        This records a scaling action. The next action needs a new run of
+        agreeing evaluations.
+
+        :param direction: raxas.enums.ScaleDirection
+        :param now: time of the action in seconds since the epoch
+        """
+        self.last_action = direction
+        self.last_action_time = now
+        self.streak = 0
+
+    def load(self):
+        """
+        This restores the state saved by a previous evaluation. A missing or
+        unreadable file, or one that could have been written by another user,
+        leaves the initial state. A last action in the future is ignored, it
+        would hold back every action.
+        """
+        logger = logging.getLogger(__name__)
+
+        try:
+            with open(self.file_path, 'r') as state_file:
+                stat = os.fstat(state_file.fileno())
+                if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                    logger.warning('Ignoring decision state %s, it is not private',
+                                   self.file_path)
+                    return
+                data = json.load(state_file)
+            direction = ScaleDirection(data['direction'])
+            streak = int(data['streak'])
+            last_action, last_action_time = None, None
+            if data.get('last_action') is not None:
+                last_action = ScaleDirection(data['last_action'])
+                last_action_time = float(data['last_action_time'])
+                if last_action_time > time.time():
+                    raise ValueError('last action at %s is in the future'
+                                     % last_action_time)
+            self.direction, self.streak = direction, streak
+            self.last_action, self.last_action_time = last_action, last_action_time
+        except (IOError, OSError):
+            pass
+        except (ValueError, KeyError, TypeError) as error:
+            logger.warning('Ignoring decision state %s: %s', self.file_path, error)
+
+    def save(self):
+        """
+        This writes the state for the next evaluation.
+        """
+        logger = logging.getLogger(__name__)
+
+        data = {
+            'direction': self.direction.value,
+            'streak': self.streak,
+            'last_action': None if self.last_action is None else self.last_action.value,
+            'last_action_time': self.last_action_time
+        }
+
+        try:
+            common.write_atomically(self.file_path,
+                                    lambda state_file: json.dump(data, state_file))
+        except (IOError, OSError) as error:
+            logger.error('Unable to save decision state %s: %s', self.file_path, error)
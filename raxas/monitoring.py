@@ -18,18 +18,158 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import logging
+import Queue
+import threading
+import time
+from multiprocessing.pool import ThreadPool
 import pyrax
+import pyrax.exceptions
+
+from raxas import common
+
+# per scaling group agent_id -> entity_id index, kept in /dev/shm so it is
+# discarded on reboot
+ENTITY_INDEX_FILE = '/dev/shm/.raxas-entity-index-%s.cache'
+
+# seconds an active server without a monitoring entity is remembered, so it
+# does not cause a listing of every entity on the account each run
+MISSING_ENTITY_TTL = 300
+
+# seconds a check found on an entity is reused before listing checks again
+CHECK_CACHE_TTL = 600
+
+# (agent_id, check_type) -> (check, expiry time)
+_check_cache = {}
+_check_cache_lock = threading.Lock()
+
+# upper bound on concurrent Cloud Monitoring requests issued by
+# get_metric_samples()
+MAX_FETCH_WORKERS = 10
+
+
+def read_entity_index(group_id):
+    """Returns the agent_id -> entity_id index saved by get_entities for a
+       scaling group, or an empty dict if there is none. Agents without an
+       entity map to the time until which they are known to have none.
+
+    """
+    logger = logging.getLogger(__name__)
+    file_path = ENTITY_INDEX_FILE % group_id
+
+    try:
+        with open(file_path, 'r') as index_file:
+            index = json.load(index_file)
+    except (IOError, ValueError) as error:
+        logger.debug('unable to read entity index %s: %s', file_path, error)
+        return {}
+
+    if not isinstance(index, dict):
+        return {}
+    return index
+
+
+def write_entity_index(group_id, index):
+    """Saves the agent_id -> entity_id index used by get_entities for a
+       scaling group
+
+    """
+    logger = logging.getLogger(__name__)
+    file_path = ENTITY_INDEX_FILE % group_id
+
+    try:
+        common.write_atomically(file_path,
+                                lambda index_file: json.dump(index, index_file))
+    except (IOError, OSError) as error:
+        logger.error('unable to write entity index %s: %s',
+                     file_path, error.args)
 
 
 def get_entities(scaling_group):
     """ Returns a list of the cloud monitoring entities
         belonging to the active servers in a scaling group
+
+        Entities already in the local agent_id -> entity_id index are fetched
+        directly, the account's entities are only listed when an active server
+        is missing from the index. Servers found to have no entity are kept in
+        the index with the time until which they are not looked up again.
     """
     cm = pyrax.cloud_monitoring
-    active_servers = scaling_group.active_servers
-    return [entity for entity in cm.list_entities()
-            if entity.agent_id in active_servers]
+    active_servers = set(scaling_group.active_servers)
+    index = read_entity_index(scaling_group.group_uuid)
+    now = time.time()
+
+    indexed = [agent_id for agent_id in active_servers
+               if isinstance(index.get(agent_id), basestring)]
+    fetched = common.parallel_map(lambda agent_id: cm.get_entity(index[agent_id]),
+                                  indexed)
+
+    entities = []
+    missing = set(active_servers)
+    for agent_id, entity in zip(indexed, fetched):
+        # a stale index entry is treated as a miss
+        if entity is not None and entity.agent_id == agent_id:
+            entities.append(entity)
+            missing.discard(agent_id)
+
+    new_index = {}
+    for agent_id in missing:
+        missing_until = index.get(agent_id)
+        if isinstance(missing_until, (int, long, float)) and missing_until > now:
+            new_index[agent_id] = missing_until
+    missing.difference_update(new_index)
+
+    if missing:
+        listed = [entity for entity in cm.list_entities()
+                  if entity.agent_id in missing]
+        entities.extend(listed)
+        missing.difference_update(entity.agent_id for entity in listed)
+        for agent_id in missing:
+            new_index[agent_id] = now + MISSING_ENTITY_TTL
+
+    new_index.update((entity.agent_id, entity.id) for entity in entities)
+    if new_index != index:
+        write_entity_index(scaling_group.group_uuid, new_index)
+
+    return entities
+
+
+def get_entity_check(entity, check_type):
+    """Returns the check of type check_type on entity, or None if the entity
+       has no such check. Checks are cached for CHECK_CACHE_TTL seconds so
+       that ensuring the check exists and reading its metrics only list the
+       entity's checks once.
+
+    """
+    key = (entity.agent_id, check_type)
+    with _check_cache_lock:
+        cached = _check_cache.get(key)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    for check in entity.list_checks():
+        if check.type == check_type:
+            now = time.time()
+            with _check_cache_lock:
+                common.drop_expired(_check_cache, now)
+                _check_cache[key] = (check, now + CHECK_CACHE_TTL)
+            return check
+
+    return None
+
+
+def invalidate_check_cache(agent_id=None):
+    """Drops the cached checks of one entity, or of every entity if
+       agent_id is None
+
+    """
+    with _check_cache_lock:
+        if agent_id is None:
+            _check_cache.clear()
+            return
+        for key in [key for key in _check_cache if key[0] == agent_id]:
+            del _check_cache[key]
 
 
 def add_entity_checks(entities, check_type, metric_name, check_config=None,
@@ -44,10 +184,7 @@ def add_entity_checks(entities, check_type, metric_name, check_config=None,
     logger.info('Ensuring monitoring checks exist')
 
     for entity in entities:
-        check_exists = len([c for c in entity.list_checks()
-                            if c.type == check_type])
-
-        if not check_exists:
+        if get_entity_check(entity, check_type) is None:
             ip_address = entity.ip_addresses.values()[0]
             logger.debug(
                 'server_id: %s, ip_address: %s', entity.agent_id, ip_address)
@@ -61,3 +198,128 @@ def add_entity_checks(entities, check_type, metric_name, check_config=None,
         else:
             logger.info('SKIP - Cloud monitoring check (%s) already exists on server id: %s',
                         check_type, entity.agent_id)
+
+
+def get_metric_points(entity, check_type, metric_name, window):
+    """Returns the (timestamp, average) data points reported for metric_name
+       by the check_type check on entity during the last window seconds,
+       oldest first, or None if they could not be fetched.
+
+    """
+    logger = logging.getLogger(__name__)
+
+    try:
+        check = get_entity_check(entity, check_type)
+        if check is None:
+            return None
+        data = check.get_metric_data_points(metric_name,
+                                            int(time.time()) - window,
+                                            int(time.time()),
+                                            resolution='FULL')
+        return [(point.get('timestamp', 0), point['average']) for point in data]
+    except pyrax.exceptions.NotFound as error:
+        # the check or entity was deleted since it was cached
+        logger.error('Unable to get metric for %s: %s', entity.agent_id, error)
+        invalidate_check_cache(entity.agent_id)
+    except Exception as error:
+        logger.error('Unable to get metric for %s: %s', entity.agent_id, error)
+
+    return None
+
+
+def get_latest_metric(entity, check_type, metric_name, window):
+    """Returns the average of the most recent data point reported for
+       metric_name by the check_type check on entity, or None if no data was
+       reported during the last window seconds.
+
+    """
+    logger = logging.getLogger(__name__)
+
+    points = get_metric_points(entity, check_type, metric_name, window)
+    if points:
+        logger.info('Found metric for: %s, value: %s',
+                    entity.name, str(points[-1][1]))
+        return points[-1][1]
+
+    return None
+
+
+def get_all_metrics(entity, check_type, metric_name, window):
+    """Returns every data point reported for metric_name by the check_type
+       check on entity during the last window seconds, or None if there are
+       none.
+
+    """
+    logger = logging.getLogger(__name__)
+
+    points = get_metric_points(entity, check_type, metric_name, window)
+    if points:
+        logger.info('Found %d data points for: %s, latest value: %s',
+                    len(points), entity.name, str(points[-1][1]))
+        return points
+
+    return None
+
+
+def _put_result(queue, func, *args):
+    """Calls func(*args) and puts its result on queue, or None if it raised,
+       so the caller waiting on queue always hears back.
+
+    """
+    try:
+        result = func(*args)
+    except Exception as error:
+        logging.getLogger(__name__).error('Unable to get metric: %s', error)
+        result = None
+    queue.put(result)
+
+
+def get_metric_samples(entities, check_type, metric_name, window,
+                       max_samples, all_points=False):
+    """This function fetches the latest metric of up to max_samples entities
+       concurrently.
+
+    Entities are tried in order. No more requests are in flight than samples
+    are still needed, and no further entity is queried once max_samples
+    values have been collected.
+
+    :param all_points: return every data point of the window of each entity
+                       instead of the latest one
+    :returns: list of data point averages, or with all_points list of
+              (timestamp, average) lists, one per entity
+    """
+    logger = logging.getLogger(__name__)
+
+    results = []
+    entities = list(entities)
+    if not entities or max_samples < 1:
+        return results
+
+    fetch = get_all_metrics if all_points else get_latest_metric
+    finished = Queue.Queue()
+    pool = ThreadPool(min(MAX_FETCH_WORKERS, max_samples, len(entities)))
+    in_flight = 0
+    try:
+        while True:
+            while entities and in_flight < max_samples - len(results):
+                pool.apply_async(_put_result,
+                                 (finished, fetch, entities.pop(0), check_type,
+                                  metric_name, window))
+                in_flight += 1
+            if not in_flight:
+                break
+
+            value = finished.get()
+            in_flight -= 1
+            if value is not None:
+                results.append(value)
+
+            # Restrict number of data points to save on API calls
+            if len(results) >= max_samples:
+                logger.info('max_samples value of %s reached, not gathering '
+                            'any more statistics', max_samples)
+                break
+    finally:
+        pool.close()
+
+    return results
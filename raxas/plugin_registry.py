@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+
+from raxas import common
+
+PLUGIN_NAMESPACE = 'raxas.ext'
+
+# plugin name -> 'module:attribute' of every entry point in PLUGIN_NAMESPACE,
+# valid as long as the installed distributions don't change. One file per
+# user, as the cache decides which modules are imported.
+REGISTRY_CACHE_FILE = '/dev/shm/.raxas-plugins-%s.cache'
+
+# metadata files and directories pip, setuptools and easy_install leave in
+# sys.path entries, one per installed distribution
+DISTRIBUTION_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link', '.egg')
+
+
+def environment_fingerprint():
+    """This function returns a fingerprint of the installed distributions.
+
+    It hashes the name and modification time of the distribution metadata
+    found in every sys.path entry, so installing, upgrading or removing a
+    package changes it, without importing pkg_resources.
+
+    :returns: hex digest (string)
+    """
+    digest = hashlib.sha1(sys.version)
+
+    for path in sys.path:
+        try:
+            entries = sorted(os.listdir(path or os.curdir))
+        except OSError:
+            continue
+
+        digest.update(path)
+        for entry in entries:
+            if not entry.endswith(DISTRIBUTION_SUFFIXES):
+                continue
+            try:
+                mtime = os.path.getmtime(os.path.join(path or os.curdir, entry))
+            except OSError:
+                continue
+            digest.update('%s %r' % (entry, mtime))
+
+    return digest.hexdigest()
+
+
+def scan_entry_points():
+    """This function walks the entry points of every installed distribution.
+
+    :returns: dict of plugin name -> 'module:attribute'
+    """
+    import pkg_resources
+
+    return dict((entry_point.name, '%s:%s' % (entry_point.module_name,
+                                              '.'.join(entry_point.attrs)))
+                for entry_point in pkg_resources.iter_entry_points(PLUGIN_NAMESPACE))
+
+
+def registry_cache_file():
+    """This function returns the registry cache file of the current user."""
+    return REGISTRY_CACHE_FILE % os.getuid()
+
+
+def read_registry(fingerprint):
+    """This function returns the cached registry, or None if it is missing,
+       was written for another environment or could have been written by
+       another user.
+
+    :param fingerprint: value of environment_fingerprint()
+    :returns: dict of plugin name -> 'module:attribute'
+    """
+    logger = logging.getLogger(__name__)
+    file_path = registry_cache_file()
+
+    try:
+        with open(file_path, 'r') as cache_file:
+            stat = os.fstat(cache_file.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                logger.warning('ignoring plugin registry %s, it is not private',
+                               file_path)
+                return None
+            data = json.load(cache_file)
+        if data['fingerprint'] == fingerprint:
+            return data['plugins']
+    except (IOError, OSError, ValueError, KeyError, TypeError) as error:
+        logger.debug('unable to read plugin registry %s: %s', file_path, error)
+
+    return None
+
+
+def write_registry(fingerprint, registry):
+    """This function caches the registry for the current environment.
+
+    :param fingerprint: value of environment_fingerprint()
+    :param registry: dict of plugin name -> 'module:attribute'
+    """
+    logger = logging.getLogger(__name__)
+    file_path = registry_cache_file()
+    data = {'fingerprint': fingerprint, 'plugins': registry}
+
+    try:
+        common.write_atomically(file_path,
+                                lambda cache_file: json.dump(data, cache_file))
+    except (IOError, OSError) as error:
+        logger.error('unable to write plugin registry %s: %s', file_path, error)
+
+
+def get_registry(rescan=False):
+    """This function returns every plugin available in PLUGIN_NAMESPACE.
+
+    The entry points are only scanned when the cached registry is missing,
+    the installed distributions have changed since it was written or rescan
+    is set.
+
+    :param rescan: ignore the cached registry
+    :returns: dict of plugin name -> 'module:attribute'
+    """
+    logger = logging.getLogger(__name__)
+    fingerprint = environment_fingerprint()
+
+    registry = None if rescan else read_registry(fingerprint)
+    if registry is None:
+        logger.debug('scanning %s entry points', PLUGIN_NAMESPACE)
+        registry = scan_entry_points()
+        write_registry(fingerprint, registry)
+
+    return registry
+
+
+def load_class(target):
+    """This function imports the object an entry point refers to.
+
+    :param target: 'module:attribute' as stored in the registry
+    :returns: plugin class
+    """
+    module_name, attrs = target.split(':', 1)
+
+    value = importlib.import_module(module_name)
+    for attr in attrs.split('.'):
+        value = getattr(value, attr)
+
+    return value
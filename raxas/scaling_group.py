@@ -19,13 +19,88 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import json
-import requests
-import requests.exceptions
-import pyrax
-import pyrax.exceptions
+import os
+import threading
+import time
 
 from raxas import common
+from raxas import configuration
 from raxas import enums
+from raxas.cache import RequestCache
+
+# defaults for the optional timeout/retries/backoff/post_async keys of the
+# webhooks section
+WEBHOOK_DEFAULTS = {
+    'timeout': 10,
+    'retries': 2,
+    'backoff': 0.5,
+    'post_async': False,
+    'include_config': False
+}
+
+# defaults for the optional keys of the hysteresis section: how many
+# consecutive evaluations must agree before scaling, and how many seconds
+# after the last scaling action the group may scale up or down again
+HYSTERESIS_DEFAULTS = {
+    'scale_up_after': 1,
+    'scale_down_after': 1,
+    'scale_up_cooldown': 0,
+    'scale_down_cooldown': 0
+}
+
+# version of the json document posted to webhooks, bump on incompatible changes
+WEBHOOK_PAYLOAD_VERSION = 1
+
+# first two active servers of each scaling group, cached in /dev/shm so
+# slave nodes can exit without calling the Autoscale API
+MASTER_CACHE_FILE = '/dev/shm/.raxas-masters-%s.cache'
+MASTER_CACHE_TTL = 180
+
+# pooled keep-alive sessions used to send webhooks, keyed by retry settings
+_webhook_sessions = {}
+_webhook_sessions_lock = threading.Lock()
+
+
+def with_defaults(defaults, configured):
+    """This function fills in the optional keys of a configuration section.
+
+    :param defaults: dict of key -> default value
+    :param configured: configuration section, only keys of defaults are used
+    :returns: dict with every key of defaults
+    """
+    settings = dict(defaults)
+    for key in settings:
+        if key in configured:
+            settings[key] = configured[key]
+    return settings
+
+
+def get_webhook_session(retries, backoff):
+    """This function returns a requests.Session reusing connections per host
+       and retrying failed POST requests with exponential backoff.
+
+    :param retries: number of times a failed request is retried
+    :param backoff: backoff factor in seconds between retries
+    :returns: requests.Session
+    """
+    # requests is only needed when a webhook is called, importing it lazily
+    # keeps it off the startup path
+    import requests
+    import requests.adapters
+    from requests.packages.urllib3.util.retry import Retry
+
+    with _webhook_sessions_lock:
+        session = _webhook_sessions.get((retries, backoff))
+        if session is None:
+            retry = Retry(total=retries, backoff_factor=backoff,
+                          method_whitelist=frozenset(['POST']),
+                          status_forcelist=[500, 502, 503, 504])
+            adapter = requests.adapters.HTTPAdapter(max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _webhook_sessions[(retries, backoff)] = session
+        return session
 
 
 class ScalingGroup(object):
@@ -37,47 +112,55 @@ class ScalingGroup(object):
         """
         self._group_name = group_name
         self._config = self.check_config(config)
+        self._webhook_settings = with_defaults(WEBHOOK_DEFAULTS, self._config.webhooks)
+        self._hysteresis_settings = with_defaults(HYSTERESIS_DEFAULTS,
+                                                  self._config.hysteresis)
 
         self._scaling_group = None
         self._servers_state = None
         self._active_servers = None
+        self._request_cache = RequestCache()
 
     @classmethod
     def check_config(cls, config):
         logger = common.get_logger()
 
-        if None in [
-                config.get('group_id'),
-                config.get('scale_up_policy'),
-                config.get('scale_down_policy')]:
+        if not isinstance(config, configuration.GroupConfig):
+            config = configuration.GroupConfig(config)
+
+        if config.errors:
+            for error in config.errors:
+                logger.error('Invalid config: %s', error)
             common.exit_with_error('Invalid group configuration')
-        if None in [
-                config.get('plugins')]:
+        if config.legacy:
             logger.warn('DeprecationWarning: You are using a deprecated config file please update'
                         ' your configuration file to v0.3 standard.')
-            return config
-        else:
-            return config
+        return config
 
     @property
     def plugin_config(self):
-        if self._config.get('plugins') is None:
-            self._config['plugins'] = \
-                {
-                    'raxmon':
-                    {
-                        'scale_up_threshold': self._config.get('scale_up_threshold', 0.6),
-                        'scale_down_threshold': self._config.get('scale_down_threshold', 0.4),
-                        'check_config': self._config.get('check_config', '{}'),
-                        'metric_name': self._config.get('metric_name', '1m'),
-                        'check_type': self._config.get('check_type', 'agent.load_average')
-                    }
-                }
-        return self._config.get('plugins')
+        """dict of plugin name -> raxas.configuration.PluginConfig"""
+        return self._config.plugins
+
+    @property
+    def request_cache(self):
+        """raxas.cache.RequestCache shared by everything evaluating this group"""
+        return self._request_cache
+
+    def cached(self, resource, func, *args):
+        """This function returns func(*args), fetching it at most once while
+           this group is being evaluated.
+
+          :param resource: name of the kind of resource, e.g. 'loadbalancer'
+          :param func: function fetching the resource
+          :param args: hashable arguments passed to func
+          :returns: value returned by func
+        """
+        return self._request_cache.get(resource, func, *args)
 
     @property
     def group_uuid(self):
-        return self.get_group_value('group_id')
+        return self._config.group_id
 
     @property
     def launch_config(self):
@@ -89,12 +172,15 @@ class ScalingGroup(object):
     @property
     def scaling_group(self):
         if self._scaling_group is None:
+            import pyrax
             logger = common.get_logger()
             autoscale_api = pyrax.autoscale
 
             try:
-                self._scaling_group = autoscale_api.get(self.group_uuid)
-            except pyrax.exc.PyraxException as error:
+                self._scaling_group = self.cached('scaling_group',
+                                                  autoscale_api.get,
+                                                  self.group_uuid)
+            except pyrax.exceptions.PyraxException as error:
                 logger.error('Error: Unable to get scaling group \'%s\': %s',
                              self.group_uuid, error)
                 return None
@@ -107,7 +193,8 @@ class ScalingGroup(object):
     def state(self):
         if self._servers_state is None:
             try:
-                self._servers_state = self.scaling_group.get_state()
+                self._servers_state = self.cached('state',
+                                                  self.scaling_group.get_state)
             except AttributeError:
                 return None
             else:
@@ -127,29 +214,72 @@ class ScalingGroup(object):
         else:
             return self._active_servers
 
+    def read_master_cache(self):
+        """This function returns the cached masters of this group, or None if
+           they are not cached, the cache has expired or could have been
+           written by another user.
+
+          :returns: list of server uuids
+        """
+        logger = common.get_logger()
+        file_path = MASTER_CACHE_FILE % self.group_uuid
+
+        try:
+            with open(file_path, 'r') as cache_file:
+                stat = os.fstat(cache_file.fileno())
+                if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                    logger.warning('ignoring master cache %s, it is not private',
+                                   file_path)
+                    return None
+                data = json.load(cache_file)
+            if data['expires'] > time.time():
+                return data['masters']
+        except (IOError, OSError, ValueError, KeyError, TypeError) as error:
+            logger.debug('unable to read master cache %s: %s', file_path, error)
+
+        return None
+
+    def write_master_cache(self, masters):
+        """This function caches the masters of this group for MASTER_CACHE_TTL
+           seconds.
+
+          :param masters: list of server uuids
+        """
+        logger = common.get_logger()
+        file_path = MASTER_CACHE_FILE % self.group_uuid
+        data = {'masters': masters, 'expires': time.time() + MASTER_CACHE_TTL}
+
+        try:
+            common.write_atomically(file_path,
+                                    lambda cache_file: json.dump(data, cache_file))
+        except (IOError, OSError) as error:
+            logger.error('unable to write master cache %s: %s', file_path, error)
+
     @property
     def is_master(self):
         """This property checks scaling group state and determines if this node is a master.
 
+        The masters are the first two active servers. They are cached for
+        MASTER_CACHE_TTL seconds, so most runs don't fetch the group state.
+
         :returns: enums.NodeStatus
         """
         logger = common.get_logger()
-        masters = []
         node_id = common.get_machine_uuid(self)
 
         if node_id is None:
             logger.error('Failed to get server uuid')
             return enums.NodeStatus.Unknown
 
-        active_count = len(self.active_servers)
-        if active_count == 1:
-            masters.append(self.active_servers[0])
-        elif active_count > 1:
-            masters.append(self.active_servers[0])
-            masters.append(self.active_servers[1])
+        masters = self.read_master_cache()
+        if masters is None:
+            masters = self.active_servers[:2]
+            if not masters:
+                logger.error('Unknown cluster state')
+                return enums.NodeStatus.Unknown
+            self.write_master_cache(masters)
         else:
-            logger.error('Unknown cluster state')
-            return enums.NodeStatus.Unknown
+            logger.debug('using cached masters: %s', masters)
 
         if node_id in masters:
             logger.info('Node is a master, continuing')
@@ -158,6 +288,23 @@ class ScalingGroup(object):
             logger.info('Node is not a master, nothing to do. Exiting')
             return enums.NodeStatus.Slave
 
+    @property
+    def cached_node_status(self):
+        """This property determines if this node is a master from the uuid and
+           master caches only, without calling any API.
+
+        :returns: enums.NodeStatus, Unknown if either cache is missing
+        """
+        node_id = common.read_uuid_cache()
+        masters = self.read_master_cache()
+
+        if node_id is None or masters is None:
+            return enums.NodeStatus.Unknown
+        elif node_id in masters:
+            return enums.NodeStatus.Master
+        else:
+            return enums.NodeStatus.Slave
+
     def get_group_value(self, key):
         """This function returns value in autoscale_groups section associated with
            provided key.
@@ -189,33 +336,132 @@ class ScalingGroup(object):
         hook = hook.name.lower()
 
         try:
-            return self._config['webhooks'][policy][hook]
+            return self._config.webhooks[policy][hook]
         except KeyError:
             logger.error('Error: unable to get config value for '
                          '[\'%s\'][\'webhooks\'][\'%s\'][\'%s\']',
                          self._group_name, policy, hook)
             return None
 
-    def execute_webhook(self, policy, hook):
+    @property
+    def webhook_settings(self):
+        """Timeout, retry and dispatch settings for webhooks, from the webhooks
+           section of the group configuration.
+        """
+        return self._webhook_settings
+
+    @property
+    def hysteresis_settings(self):
+        """Consecutive decision and cooldown settings, from the hysteresis
+           section of the group configuration.
+        """
+        return self._hysteresis_settings
+
+    def policy_id(self, policy):
+        """
+        :param policy: raxas.enums.ScaleDirection
+        :returns: id of the scale up or scale down policy
+        """
+        if policy == enums.ScaleDirection.Up:
+            return self._config.scale_up_policy
+        return self._config.scale_down_policy
+
+    def get_cooldowns(self, policy):
+        """This function returns the cooldowns the Autoscale API applies to
+           executing a policy, read from the already fetched scaling group.
+           The group cooldown runs after any scaling action, the policy
+           cooldown only after that policy was executed.
+
+        :param policy: raxas.enums.ScaleDirection
+        :returns: (group cooldown, policy cooldown) tuple of seconds, 0 if the
+                  scaling group is not available
+        """
+        group = self.scaling_group
+        if group is None:
+            return 0, 0
+
+        policy_id = self.policy_id(policy)
+        policy_cooldown = 0
+        for group_policy in getattr(group, 'policies', None) or []:
+            if getattr(group_policy, 'id', None) == policy_id:
+                policy_cooldown = getattr(group_policy, 'cooldown', None) or 0
+        return getattr(group, 'cooldown', None) or 0, policy_cooldown
+
+    def webhook_payload(self, policy, decisions=None):
+        """This function builds the json document posted to webhooks.
+
+        The document holds the payload version, group name and id, scaling
+        direction, number of active servers and the decision of each plugin.
+        The group configuration is only added when include_config is set in
+        the webhooks section.
+
+        :param policy: raxas.enums.ScaleDirection
+        :param decisions: dict of plugin name -> decision (1, 0, -1 or None)
+        :returns: compact json string
+        """
+        payload = {
+            'version': WEBHOOK_PAYLOAD_VERSION,
+            'group': self._group_name,
+            'group_id': self._config.group_id,
+            'direction': policy.name,
+            'active_capacity': len(self.active_servers),
+            'decisions': decisions or {}
+        }
+        if self.webhook_settings['include_config']:
+            payload['config'] = self._config
+
+        return json.dumps(payload, separators=(',', ':'), sort_keys=True)
+
+    def execute_webhook(self, policy, hook, payload=None):
         """This function makes webhook calls.
 
+        All urls of a hook are called concurrently through a pooled session.
+        The call returns once every url has answered, unless hook is
+        HookType.Post and post_async is set, in which case the requests are
+        sent in the background.
+
         :param policy: raxas.enums.ScaleDirection
         :param hook: raxas.enums.HookType
+        :param payload: json string from webhook_payload(), built if None
+        :returns: threading.Thread sending asynchronous post hooks, or None
         """
+        import requests.exceptions
         logger = common.get_logger()
 
         logger.info('Executing webhook: scale_%s:%s', policy.name, hook.name)
         urls = self.get_webhook_values(policy, hook)
-        data = json.dumps(self._config)
+        if not urls:
+            return None
+
+        if payload is None:
+            payload = self.webhook_payload(policy)
+        settings = self.webhook_settings
+        session = get_webhook_session(settings['retries'], settings['backoff'])
 
-        for url in urls:
+        def post(url):
             logger.info('Sending POST request to url: \'%s\'', url)
             try:
-                response = requests.post(url, json=data)
-                logger.info('Received status code %d from url: \'%s\'', response.status_code, url)
+                response = session.post(url, data=payload,
+                                        headers={'Content-Type': 'application/json'},
+                                        timeout=settings['timeout'])
+                logger.info('Received status code %d from url: \'%s\'',
+                            response.status_code, url)
             except requests.exceptions.RequestException as error:
                 logger.error(error)
 
+        def post_all():
+            common.parallel_map(post, urls, max_workers=len(urls))
+
+        if hook == enums.HookType.Post and settings['post_async']:
+            # not a daemon thread, so the process waits for it before exiting
+            sender = threading.Thread(target=post_all,
+                                      name='webhooks-%s' % self._group_name)
+            sender.start()
+            return sender
+
+        post_all()
+        return None
+
     def execute_policy(self, policy):
         """
 
@@ -223,9 +469,10 @@ class ScalingGroup(object):
         :returns: True
                   False
         """
+        import pyrax.exceptions
         logger = common.get_logger()
 
-        policy_id = self.get_group_value('scale_%s_policy' % policy.name)
+        policy_id = self.policy_id(policy)
 
         if len(self.active_servers) == 1 and policy == enums.ScaleDirection.Down:
             logger.info('Current active server count is 1, will not scale down')
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import math
+import struct
+
+from raxas import common
+
+# file layout: header followed by 'capacity' samples, oldest first
+HEADER = struct.Struct('<4sBIIdddd')
+SAMPLE = struct.Struct('<dd')
+MAGIC = 'RXTS'
+VERSION = 1
+
+# metric history of the scaling groups, one file per group and metric. A day
+# of one minute samples is kept.
+HISTORY_FILE = '/dev/shm/.raxas-history-%s.ts'
+HISTORY_SIZE = 1440
+
+
+def _pack_optional(value):
+    return float('nan') if value is None else value
+
+
+def _unpack_optional(value):
+    return None if math.isnan(value) else value
+
+
+def linear_trend(samples):
+    """This function fits a line through samples with least squares.
+
+    :param samples: list of (timestamp, value) tuples
+    :returns: (slope, intercept) tuple, None if there are fewer than two
+              distinct timestamps
+    """
+    if len(samples) < 2:
+        return None
+
+    count = float(len(samples))
+    mean_x = math.fsum(timestamp for timestamp, _ in samples) / count
+    mean_y = math.fsum(value for _, value in samples) / count
+    variance = math.fsum((timestamp - mean_x) ** 2 for timestamp, _ in samples)
+    if not variance:
+        return None
+
+    covariance = math.fsum((timestamp - mean_x) * (value - mean_y)
+                           for timestamp, value in samples)
+    slope = covariance / variance
+    return slope, mean_y - slope * mean_x
+
+
+def forecast(samples, timestamp):
+    """This function extrapolates the linear trend of samples.
+
+    :param samples: list of (timestamp, value) tuples
+    :param timestamp: time of the forecast
+    :returns: forecast value, None if there is no trend
+    """
+    trend = linear_trend(samples)
+    if trend is None:
+        return None
+    slope, intercept = trend
+    return slope * timestamp + intercept
+
+
+def open_history(group_id, *metric):
+    """This function returns the metric history of a scaling group.
+
+    :param group_id: scaling group id
+    :param metric: parts of the metric name, e.g. check type and metric name
+    :returns: RingBuffer
+    """
+    key = ' '.join(str(part) for part in (group_id,) + metric)
+    return RingBuffer(HISTORY_FILE % hashlib.sha1(key).hexdigest()[:16],
+                      capacity=HISTORY_SIZE)
+
+
+class RingBuffer(object):
+    """
+    This class keeps the latest (timestamp, value) samples of a metric in a
+    fixed-size ring buffer persisted to a file. The running sum and the EWMA
+    are updated on every change, so querying them takes constant time.
+    """
+
+    def __init__(self, file_path, capacity=64, alpha=0.5):
+        """
+        :param file_path: file the samples are persisted to
+        :param capacity: maximum number of samples kept
+        :param alpha: weight of the newest sample in the EWMA, 0 < alpha <= 1
+        """
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        if not 0 < alpha <= 1:
+            raise ValueError('alpha must be greater than 0 and at most 1')
+
+        self.file_path = file_path
+        self.capacity = capacity
+        self.alpha = alpha
+        self.count = 0
+        self.total = 0.0
+        self._timestamps = [0.0] * capacity
+        self._values = [0.0] * capacity
+        self._start = 0
+        self._ewma = None
+        self._previous_ewma = None
+        self._changed = False
+
+        self.load()
+
+    def __len__(self):
+        return self.count
+
+    def _index(self, position):
+        return (self._start + position) % self.capacity
+
+    def _next_ewma(self, previous, value):
+        if previous is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * previous
+
+    @property
+    def last_timestamp(self):
+        """
+        :returns: timestamp of the newest sample, None if there are no samples
+        """
+        if not self.count:
+            return None
+        return self._timestamps[self._index(self.count - 1)]
+
+    @property
+    def mean(self):
+        """
+        :returns: mean of the samples in the buffer, None if there are none
+        """
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    @property
+    def ewma(self):
+        """
+        :returns: exponentially weighted moving average of the samples,
+                  None if there are none
+        """
+        return self._ewma
+
+    def samples(self):
+        """
+        :returns: list of (timestamp, value) tuples, oldest first
+        """
+        return [(self._timestamps[self._index(position)],
+                 self._values[self._index(position)])
+                for position in range(self.count)]
+
+    def since(self, timestamp):
+        """
+        :param timestamp: seconds since the epoch
+        :returns: list of (timestamp, value) tuples not older than timestamp,
+                  oldest first
+        """
+        return [sample for sample in self.samples() if sample[0] >= timestamp]
+
+    def append(self, timestamp, value):
+        """
+        This adds a sample, dropping the oldest one when the buffer is full.
+        A sample with the same timestamp as the newest one replaces it.
+
+        :param timestamp: seconds since the epoch, not older than the newest
+                          sample
+        :param value: sample value
+        """
+        value = float(value)
+        last_timestamp = self.last_timestamp
+
+        if last_timestamp is not None and timestamp < last_timestamp:
+            raise ValueError('sample at %s is older than the newest sample at %s'
+                             % (timestamp, last_timestamp))
+
+        if timestamp == last_timestamp:
+            index = self._index(self.count - 1)
+            self.total += value - self._values[index]
+            self._values[index] = value
+            self._ewma = self._next_ewma(self._previous_ewma, value)
+            self._changed = True
+            return
+
+        if self.count == self.capacity:
+            self.total -= self._values[self._start]
+            self._start = self._index(1)
+            self.count -= 1
+
+        index = self._index(self.count)
+        self._timestamps[index] = timestamp
+        self._values[index] = value
+        self.count += 1
+        self.total += value
+        self._previous_ewma = self._ewma
+        self._ewma = self._next_ewma(self._ewma, value)
+        self._changed = True
+
+    def expire(self, before):
+        """
+        This drops the samples older than a timestamp.
+
+        :param before: seconds since the epoch
+        """
+        while self.count and self._timestamps[self._start] < before:
+            self.total -= self._values[self._start]
+            self._start = self._index(1)
+            self.count -= 1
+            self._changed = True
+
+        if not self.count and self._ewma is not None:
+            self.total = 0.0
+            self._ewma = self._previous_ewma = None
+
+    def load(self):
+        """
+        This restores the samples saved in the file. A missing or unreadable
+        file leaves the buffer empty.
+        """
+        logger = logging.getLogger(__name__)
+
+        try:
+            with open(self.file_path, 'rb') as store_file:
+                data = store_file.read()
+        except IOError:
+            return
+
+        try:
+            (magic, version, capacity, count, total, ewma, previous_ewma,
+             alpha) = HEADER.unpack_from(data)
+            if (magic != MAGIC or version != VERSION or count > capacity or
+                    len(data) != HEADER.size + capacity * SAMPLE.size):
+                raise ValueError('unknown format')
+        except (struct.error, ValueError) as error:
+            logger.warning('Ignoring time series %s: %s', self.file_path, error)
+            return
+
+        samples = [SAMPLE.unpack_from(data, HEADER.size + position * SAMPLE.size)
+                   for position in range(count)]
+
+        if capacity != self.capacity or alpha != self.alpha:
+            # the running values depend on both, compute them again
+            for timestamp, value in samples[-self.capacity:]:
+                self.append(timestamp, value)
+            return
+
+        for position, (timestamp, value) in enumerate(samples):
+            self._timestamps[position] = timestamp
+            self._values[position] = value
+        self._start = 0
+        self.count = count
+        self.total = total
+        self._ewma = _unpack_optional(ewma)
+        self._previous_ewma = _unpack_optional(previous_ewma)
+        self._changed = False
+
+    def save(self):
+        """
+        This writes the samples to the file if they changed since they were
+        loaded or last saved.
+        """
+        logger = logging.getLogger(__name__)
+
+        if not self._changed:
+            return
+
+        data = [HEADER.pack(MAGIC, VERSION, self.capacity, self.count,
+                            self.total, _pack_optional(self._ewma),
+                            _pack_optional(self._previous_ewma), self.alpha)]
+        samples = self.samples()
+        samples.extend([(0.0, 0.0)] * (self.capacity - self.count))
+        data.extend(SAMPLE.pack(timestamp, value) for timestamp, value in samples)
+
+        try:
+            common.write_atomically(
+                self.file_path, lambda store_file: store_file.write(''.join(data)),
+                mode='wb')
+        except (IOError, OSError) as error:
+            logger.error('Unable to save time series %s: %s', self.file_path, error)
+            return
+
+        self._changed = False
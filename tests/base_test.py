@@ -17,9 +17,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import os
+import shutil
+import tempfile
 import unittest2
 import json
 
+from mock import patch
+
 
 class BaseTest(unittest2.TestCase):
     def __init__(self, *args, **kwargs):
@@ -72,3 +77,20 @@ class BaseTest(unittest2.TestCase):
         """
 
         self._config_parsed = json.loads(self._config_json)
+
+    def make_temp_dir(self):
+        """Creates a directory that is removed after the test"""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        return path
+
+    def patch_file(self, target, name):
+        """Points the file name constant target at name in a temporary
+           directory for the duration of the test, so tests never touch the
+           real caches in /dev/shm.
+        """
+        file_path = os.path.join(self.make_temp_dir(), name)
+        patcher = patch(target, file_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return file_path
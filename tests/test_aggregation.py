@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest2
+
+from raxas import aggregation
+
+
+class AggregationTest(unittest2.TestCase):
+    def setUp(self):
+        self.values = [3.0, 1.0, 4.0, 1.0, 5.0, 9.0, 2.0, 6.0, 5.0, 100.0]
+
+    def test_mean(self):
+        self.assertEqual(13.6, aggregation.aggregate('mean', self.values))
+
+    def test_median(self):
+        self.assertEqual(4.5, aggregation.aggregate('median', self.values))
+        self.assertEqual(4.0, aggregation.aggregate('median', [4.0, 1.0, 9.0]))
+
+    def test_percentile(self):
+        self.assertEqual(1.0, aggregation.aggregate('p0', self.values))
+        self.assertAlmostEqual(59.05, aggregation.aggregate('p95', self.values))
+        self.assertEqual(100.0, aggregation.aggregate('P100', self.values))
+        self.assertEqual(7.0, aggregation.aggregate('p99.9', [7.0]))
+
+    def test_trimmed_mean(self):
+        self.assertEqual(4.375, aggregation.aggregate('trimmed_mean', self.values))
+        self.assertEqual(2.0, aggregation.aggregate('trimmed_mean', [1.0, 3.0]))
+
+    def test_max(self):
+        self.assertEqual(100.0, aggregation.aggregate('max', self.values))
+
+    def test_ewma(self):
+        self.assertEqual(4.5, aggregation.aggregate('ewma', [2.0, 4.0, 6.0]))
+
+    def test_empty(self):
+        self.assertIsNone(aggregation.aggregate('median', []))
+
+    def test_unknown_aggregator(self):
+        self.assertRaises(ValueError, aggregation.get_aggregator, 'average')
+        self.assertRaises(ValueError, aggregation.get_aggregator, 'p101')
+        self.assertRaises(ValueError, aggregation.aggregate, 'p', [1.0])
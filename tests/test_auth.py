@@ -18,14 +18,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import unittest2
-from mock import patch, mock_open
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import threading
+import time
+from mock import MagicMock, patch, mock_open
 import pyrax
 from pyrax.exceptions import AuthenticationFailed
+from tests.base_test import BaseTest
 from raxas.auth import Auth
 
 
-class AuthTest(unittest2.TestCase):
+class AuthTest(BaseTest):
     def __init__(self, *args, **kwargs):
         super(AuthTest, self).__init__(*args, **kwargs)
         self.username = "AUTHUSER"
@@ -36,9 +43,29 @@ class AuthTest(unittest2.TestCase):
         self.token_file_contents = """{"tenant_id": 123456,
         "token": "testtokenplsignore"}"""
         self.empty_json = """{"test":""}"""
+        self.catalog = [
+            {"name": "cloudServersOpenStack", "type": "compute",
+             "endpoints": [{"region": "HKG", "tenantId": "123456",
+                            "publicURL": "https://hkg.servers.api.rackspacecloud.com/v2/123456"},
+                           {"region": "DFW", "tenantId": "123456",
+                            "publicURL": "https://dfw.servers.api.rackspacecloud.com/v2/123456"}]},
+            {"name": "cloudMonitoring", "type": "rax:monitor",
+             "endpoints": [{"tenantId": "123456",
+                            "publicURL": "https://monitoring.api.rackspacecloud.com/v1.0/123456"}]},
+            {"name": "cloudLoadBalancers", "type": "rax:load-balancer",
+             "endpoints": [{"region": "DFW", "tenantId": "123456",
+                            "publicURL": "https://dfw.loadbalancers.api."
+                                         "rackspacecloud.com/v1.0/123456"}]}]
         self.tenant_id = "123456"
         self.api_key = "testtokenplsignore"
 
+    def setUp(self):
+        self.token_dir = self.make_temp_dir()
+        # keep authenticate() from creating a lock file in the home directory
+        patcher = patch('raxas.auth.fcntl', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_load_token_true(self):
         auth = Auth(self.username, self.api_key, self.region)
         with patch('__builtin__.open',
@@ -67,18 +94,89 @@ class AuthTest(unittest2.TestCase):
         auth = Auth(self.username, self.api_key, self.region)
         auth._tenant_id = self.tenant_id
         auth._token = self.api_key
-        auth._token_filename = "token.file"
-        with patch('__builtin__.open', mock_open(), create=True) as mocked:
-            self.assertTrue(auth.save_token())
-            mocked.assert_called_once_with('token.file', 'w')
+        auth._token_filename = os.path.join(self.token_dir, 'token.file')
+        self.assertTrue(auth.save_token())
+
+        with open(auth._token_filename) as token_file:
+            self.assertEqual({'token': self.api_key, 'tenant_id': self.tenant_id},
+                             json.load(token_file))
+        self.assertEqual(0600, os.stat(auth._token_filename).st_mode & 0777)
+        self.assertEqual(['token.file'], os.listdir(self.token_dir))
+
+    def test_save_token_error_keeps_file(self):
+        auth = Auth(self.username, self.api_key, self.region)
+        auth._token_filename = os.path.join(self.token_dir, 'token.file')
+        with open(auth._token_filename, 'w') as token_file:
+            token_file.write(self.token_file_contents)
+        auth._tenant_id = self.tenant_id
+        auth._token = object()
+
+        self.assertFalse(auth.save_token())
+        with open(auth._token_filename) as token_file:
+            self.assertEqual(self.token_file_contents, token_file.read())
+        self.assertEqual(['token.file'], os.listdir(self.token_dir))
+
+    @patch('raxas.auth.fcntl', fcntl)
+    def test_token_lock_serializes_refresh(self):
+        token_filename = os.path.join(self.token_dir, 'token.file')
+        first = Auth(self.username, self.api_key, self.region,
+                     token_filename=token_filename)
+        second = Auth(self.username, self.api_key, self.region,
+                      token_filename=token_filename)
+        locked, released = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with first.token_lock():
+                locked.set()
+                released.wait(5)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(5)
+            started = time.time()
+            with second.token_lock(timeout=0.3):
+                self.assertGreaterEqual(time.time() - started, 0.3)
+        finally:
+            released.set()
+            holder.join()
+
+        started = time.time()
+        with second.token_lock(timeout=5):
+            self.assertLess(time.time() - started, 1)
+
+    @patch.object(Auth, 'authenticate_cached', return_value=True)
+    @patch.object(Auth, 'authenticate_credentials')
+    def test_authenticate_reuses_token_refreshed_while_waiting(self, mock_creds,
+                                                               mock_cached):
+        auth = self._cached_auth(datetime.timedelta(seconds=60))
+        auth._token_filename = os.path.join(self.token_dir, 'token.file')
+        refreshed = self._cached_auth(datetime.timedelta(hours=1))
+        refreshed._token_filename = auth._token_filename
+        auth.save_token()
+
+        @contextlib.contextmanager
+        def wait_for_refresh(*args):
+            # another process refreshes the token while we hold the lock
+            refreshed.save_token()
+            yield
+        with patch.object(Auth, 'token_lock', side_effect=wait_for_refresh):
+            self.assertTrue(auth.authenticate())
+
+        self.assertFalse(mock_creds.called)
+        self.assertTrue(mock_cached.called)
 
+    @patch('pyrax.identity', create=True)
+    @patch.object(Auth, 'save_token', return_value=True)
     @patch('pyrax.auth_with_token', return_value=True)
-    def test_authenticate_token_success(self, mock_token):
+    def test_authenticate_token_success(self, mock_token, mock_save,
+                                        mock_identity):
         auth = Auth(self.username, self.api_key, self.region)
         auth._tenant_id = self.tenant_id
         auth._token = self.api_key
         auth._token_filename = "token.file"
         self.assertTrue(auth.authenticate_token())
+        self.assertTrue(mock_save.called)
 
     def test_authenticate_token_fail(self):
         auth = Auth(self.username, self.api_key, self.region)
@@ -198,3 +296,108 @@ class AuthTest(unittest2.TestCase):
 
         self.assertTrue(mock_identity.unauthenticate.called)
         self.assertTrue(mock_os.called)
+
+    @patch('pyrax.identity', create=True)
+    def test_token_expires_soon_false(self, mock_identity):
+        mock_identity.expires = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        self.assertFalse(Auth.token_expires_soon())
+
+    @patch('pyrax.identity', create=True)
+    def test_token_expires_soon_true(self, mock_identity):
+        mock_identity.expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+        self.assertTrue(Auth.token_expires_soon())
+
+    @patch('pyrax.identity', None, create=True)
+    def test_token_expires_soon_unauthenticated(self):
+        self.assertTrue(Auth.token_expires_soon())
+
+    def _cached_auth(self, expires_in):
+        auth = Auth(self.username, self.api_key, self.region)
+        auth._token = self.api_key
+        auth._tenant_id = self.tenant_id
+        auth._expires = datetime.datetime.utcnow() + expires_in
+        auth._user = {"id": "1", "name": self.username, "roles": []}
+        auth._catalog = self.catalog[:2]
+        return auth
+
+    def test_token_valid(self):
+        auth = self._cached_auth(datetime.timedelta(hours=1))
+        self.assertTrue(auth.token_valid())
+        auth._expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+        self.assertFalse(auth.token_valid())
+        auth._expires = None
+        self.assertFalse(auth.token_valid())
+
+    def test_load_token_with_expiry(self):
+        auth = Auth(self.username, self.api_key, self.region)
+        data = ('{"tenant_id": 123456, "token": "testtokenplsignore", '
+                '"expires": "2030-01-02T03:04:05Z", "catalog": [], '
+                '"user": {"id": "1"}}')
+        with patch('__builtin__.open', mock_open(read_data=data), create=True):
+            self.assertTrue(auth.load_token())
+        self.assertEqual(datetime.datetime(2030, 1, 2, 3, 4, 5), auth._expires)
+        self.assertEqual({"id": "1"}, auth._user)
+
+    def test_load_token_without_expiry(self):
+        auth = Auth(self.username, self.api_key, self.region)
+        with patch('__builtin__.open',
+                   mock_open(read_data=self.token_file_contents), create=True):
+            self.assertTrue(auth.load_token())
+        self.assertIsNone(auth._expires)
+
+    @patch('pyrax.identity', create=True)
+    def test_read_identity_keeps_region_endpoints(self, mock_identity):
+        mock_identity.expires = datetime.datetime(2030, 1, 1)
+        mock_identity.service_catalog = self.catalog
+        auth = Auth(self.username, self.api_key, self.region)
+        auth.read_identity()
+
+        self.assertEqual(datetime.datetime(2030, 1, 1), auth._expires)
+        self.assertEqual(['cloudServersOpenStack', 'cloudMonitoring'],
+                         [service['name'] for service in auth._catalog])
+        self.assertEqual(['HKG'], [endpoint['region'] for endpoint
+                                   in auth._catalog[0]['endpoints']])
+
+    @patch.object(Auth, 'authenticate_token')
+    @patch.object(Auth, 'authenticate_cached', return_value=True)
+    def test_authenticate_cached_flow(self, mock_cached, mock_token):
+        auth = self._cached_auth(datetime.timedelta(hours=1))
+        with patch.object(Auth, 'load_token', return_value=True):
+            self.assertTrue(auth.authenticate())
+
+        self.assertFalse(mock_token.called)
+
+    @patch.object(Auth, 'authenticate_credentials', return_value=True)
+    @patch.object(Auth, 'authenticate_token')
+    @patch.object(Auth, 'authenticate_cached')
+    def test_authenticate_refreshes_expiring_token(self, mock_cached,
+                                                   mock_token, mock_creds):
+        auth = self._cached_auth(datetime.timedelta(seconds=60))
+        with patch.object(Auth, 'load_token', return_value=True):
+            self.assertTrue(auth.authenticate())
+
+        self.assertFalse(mock_cached.called)
+        self.assertFalse(mock_token.called)
+        self.assertTrue(mock_creds.called)
+
+    @patch('pyrax.services', ())
+    @patch('pyrax.regions', ())
+    @patch('pyrax.connect_to_services')
+    @patch('pyrax.identity', create=True)
+    def test_authenticate_cached_rebuilds_identity(self, mock_identity,
+                                                   mock_connect):
+        auth = self._cached_auth(datetime.timedelta(hours=1))
+
+        self.assertTrue(auth.authenticate_cached())
+        self.assertEqual(self.api_key, pyrax.identity.token)
+        self.assertTrue(pyrax.identity.authenticated)
+        self.assertEqual(auth._expires.replace(microsecond=0),
+                         pyrax.identity.expires)
+        self.assertIn('compute', pyrax.services)
+        mock_connect.assert_called_once_with(region=self.region)
+
+    def test_authenticate_cached_without_catalog(self):
+        auth = self._cached_auth(datetime.timedelta(hours=1))
+        auth._catalog = None
+
+        self.assertFalse(auth.authenticate_cached())
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from mock import MagicMock, patch
+
+from tests.base_test import BaseTest
+from raxas import autoscale
+from raxas.auth import Auth
+from raxas.configuration import Config, PluginConfig
+from raxas.decision import DecisionState
+from raxas.enums import ScaleDirection, ScaleEvent
+from raxas.scaling_group import ScalingGroup, HYSTERESIS_DEFAULTS
+
+
+class AutoscaleTest(BaseTest):
+    def setUp(self):
+        autoscale._plugin_classes.clear()
+        self.scaling_group = MagicMock(spec=ScalingGroup)
+        self.scaling_group.plugin_config = {'raxmon': PluginConfig('raxmon', {}),
+                                            'raxclb': PluginConfig('raxclb', {})}
+        self.scaling_group.hysteresis_settings = dict(HYSTERESIS_DEFAULTS)
+        self.scaling_group.get_cooldowns.return_value = (0, 0)
+        self.scaling_group.execute_policy.return_value = ScaleEvent.Success
+
+        self.patch_file('raxas.decision.DECISION_STATE_FILE', 'decision-%s.state')
+
+    @patch('raxas.plugin_registry.load_class')
+    @patch('raxas.plugin_registry.get_registry')
+    def test_load_plugins_resolves_once(self, get_registry_mock,
+                                        load_class_mock):
+        raxmon, raxclb = MagicMock(), MagicMock()
+        get_registry_mock.return_value = {'raxmon': 'raxmon:Raxmon',
+                                          'raxclb': 'raxclb:Raxclb',
+                                          'newrelic': 'newrelic:NewRelic'}
+        load_class_mock.side_effect = lambda target: {
+            'raxmon:Raxmon': raxmon, 'raxclb:Raxclb': raxclb}[target]
+
+        self.assertEqual(2, len(autoscale.load_plugins(self.scaling_group)))
+        self.assertEqual(2, len(autoscale.load_plugins(self.scaling_group)))
+        get_registry_mock.assert_called_once_with()
+        self.assertEqual(2, load_class_mock.call_count)
+        raxmon.assert_called_with(self.scaling_group)
+
+    @patch('raxas.plugin_registry.load_class')
+    @patch('raxas.plugin_registry.get_registry', return_value={})
+    def test_load_plugins_missing_plugin(self, get_registry_mock,
+                                         load_class_mock):
+        self.assertEqual([], autoscale.load_plugins(self.scaling_group))
+        get_registry_mock.assert_called_with(rescan=True)
+        self.assertFalse(load_class_mock.called)
+
+    def test_make_decisions(self):
+        up, broken = MagicMock(), MagicMock()
+        up.name, broken.name = 'raxmon', 'raxclb'
+        up.make_decision.return_value = 1
+        broken.make_decision.side_effect = ValueError
+
+        self.assertEqual([1, None], autoscale.make_decisions(
+            [up, broken], self.scaling_group.plugin_config))
+
+    def test_make_decisions_timeout(self):
+        event = threading.Event()
+        slow, fast = MagicMock(), MagicMock()
+        slow.name, fast.name = 'raxmon', 'raxclb'
+        slow.make_decision.side_effect = lambda: event.wait(5) or 1
+        fast.make_decision.return_value = -1
+        plugin_config = {'raxmon': PluginConfig('raxmon', {'decision_timeout': 0.1}),
+                         'raxclb': PluginConfig('raxclb', {})}
+
+        try:
+            self.assertEqual([None, -1], autoscale.make_decisions(
+                [slow, fast], plugin_config))
+        finally:
+            event.set()
+
+    def test_execute_decision_nothing(self):
+        state = DecisionState('group')
+
+        self.assertEqual(ScaleEvent.NoAction,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Nothing,
+                                                    {'dry_run': False}, {}))
+        self.assertFalse(self.scaling_group.execute_policy.called)
+
+    def test_execute_decision_waits_for_consecutive_decisions(self):
+        self.scaling_group.hysteresis_settings['scale_up_after'] = 2
+        state = DecisionState('group')
+        args = {'dry_run': False}
+
+        self.assertEqual(ScaleEvent.NoAction,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Up, args, {}))
+        self.assertFalse(self.scaling_group.execute_policy.called)
+
+        self.assertEqual(ScaleEvent.Success,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Up, args, {}))
+        self.scaling_group.execute_policy.assert_called_once_with(ScaleDirection.Up)
+
+    @patch('raxas.autoscale.time.time', return_value=1000)
+    def test_execute_decision_holds_back_during_cooldown(self, time_mock):
+        self.scaling_group.hysteresis_settings['scale_down_cooldown'] = 120
+        self.scaling_group.get_cooldowns.return_value = (300, 0)
+        state = DecisionState('group')
+        state.record_action(ScaleDirection.Down, 800)
+
+        self.assertEqual(ScaleEvent.NoAction,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Down,
+                                                    {'dry_run': False}, {}))
+        self.assertFalse(self.scaling_group.execute_policy.called)
+        self.scaling_group.get_cooldowns.assert_called_once_with(ScaleDirection.Down)
+
+        time_mock.return_value = 1100
+        self.assertEqual(ScaleEvent.Success,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Down,
+                                                    {'dry_run': False}, {}))
+        self.assertEqual(ScaleDirection.Down, state.last_action)
+        self.assertEqual(1100, state.last_action_time)
+
+    @patch('raxas.autoscale.time.time', return_value=1000)
+    def test_execute_decision_policy_cooldown_after_same_policy(self, time_mock):
+        self.scaling_group.get_cooldowns.return_value = (0, 600)
+        state = DecisionState('group')
+        state.record_action(ScaleDirection.Up, 800)
+
+        self.assertEqual(ScaleEvent.NoAction,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Up,
+                                                    {'dry_run': False}, {}))
+        self.assertFalse(self.scaling_group.execute_policy.called)
+
+        self.assertEqual(ScaleEvent.Success,
+                         autoscale.execute_decision(self.scaling_group, state,
+                                                    ScaleDirection.Down,
+                                                    {'dry_run': False}, {}))
+        self.scaling_group.execute_policy.assert_called_once_with(ScaleDirection.Down)
+
+    def test_execute_decision_dry_run_records_nothing(self):
+        state = DecisionState('group')
+
+        autoscale.execute_decision(self.scaling_group, state, ScaleDirection.Up,
+                                   {'dry_run': True}, {})
+        self.assertFalse(self.scaling_group.execute_policy.called)
+        self.assertIsNone(state.last_action)
+
+    @patch('raxas.autoscale.make_decisions', return_value=[1])
+    @patch('raxas.autoscale.load_plugins')
+    @patch('raxas.autoscale.ScalingGroup')
+    def test_autoscale_dry_run_keeps_state(self, scaling_group_mock,
+                                           load_plugins_mock, make_decisions_mock):
+        scaling_group_mock.return_value = self.scaling_group
+        self.scaling_group.group_uuid = 'group'
+        load_plugins_mock.return_value = [MagicMock()]
+
+        self.assertEqual(ScaleEvent.Success,
+                         autoscale.autoscale('group0', self._config_parsed,
+                                             {'cluster': False, 'dry_run': True}))
+        self.assertFalse(os.path.exists(DecisionState('group').file_path))
+
+        autoscale.autoscale('group0', self._config_parsed,
+                            {'cluster': False, 'dry_run': False})
+        self.assertEqual(ScaleDirection.Up, DecisionState('group').last_action)
+
+    def test_import_time(self):
+        # importing the CLI must not pull in the API clients, they account
+        # for most of the startup time
+        code = ('import sys, time; started = time.time(); '
+                'import raxas.autoscale; print(time.time() - started); '
+                'print(" ".join(sorted(set(sys.modules) & '
+                'set(["pyrax", "requests", "pkg_resources"]))))')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=root).splitlines()
+
+        self.assertLess(float(output[0]), 1.0)
+        self.assertEqual('', output[1].strip())
+
+    @patch('raxas.plugin_registry.get_registry',
+           return_value={'raxmon': 'raxas.core_plugins.raxmon:Raxmon'})
+    def test_validate_config(self, get_registry_mock):
+        self.assertTrue(autoscale.validate_config(Config(self._config_parsed)))
+
+        self._config_parsed['autoscale_groups']['group0']['plugins']['other'] = {}
+        self._config_parsed['autoscale_groups']['group0']['group_id'] = None
+        with patch.object(autoscale.logger, 'error') as error_mock:
+            self.assertFalse(autoscale.validate_config(
+                Config(self._config_parsed)))
+
+        self.assertEqual(2, error_mock.call_count)
+        get_registry_mock.assert_called_with(rescan=True)
+
+    def test_get_as_group_single_group(self):
+        self.assertEqual('group0', autoscale.get_as_group({}, self._config_parsed))
+
+    def test_get_as_group_from_args(self):
+        self.assertEqual('other', autoscale.get_as_group({'as_group': 'other'},
+                                                         self._config_parsed))
+
+    @patch('raxas.autoscale.autoscale')
+    def test_autoscale_groups(self, autoscale_mock):
+        def scale(group, config_data, args):
+            if group == 'broken':
+                raise ValueError(group)
+            return ScaleEvent.NoAction
+        autoscale_mock.side_effect = scale
+
+        summary = autoscale.autoscale_groups(['group0', 'broken'],
+                                             self._config_parsed, {'workers': 2})
+
+        self.assertEqual({'group0': ScaleEvent.NoAction,
+                          'broken': ScaleEvent.Error}, summary)
+
+    @patch('os.path.getmtime', return_value=1)
+    @patch('raxas.autoscale.autoscale')
+    def test_run_daemon_stops(self, autoscale_mock, getmtime_mock):
+        stop = threading.Event()
+
+        def scale(*args):
+            stop.set()
+            return ScaleEvent.NoAction
+        autoscale_mock.side_effect = scale
+        session = MagicMock(spec=Auth)
+        session.token_expires_soon.return_value = False
+
+        autoscale.run_daemon('config.json', self._config_parsed, session,
+                             {'interval': 60}, stop=stop)
+
+        self.assertEqual(1, autoscale_mock.call_count)
+        self.assertFalse(session.authenticate.called)
+
+    @patch('raxas.common.get_config')
+    @patch('os.path.getmtime')
+    @patch('raxas.autoscale.autoscale')
+    def test_run_daemon_reloads_changed_config(self, autoscale_mock,
+                                               getmtime_mock, get_config_mock):
+        stop = threading.Event()
+        autoscale_mock.side_effect = lambda *args: stop.set() or ScaleEvent.NoAction
+        getmtime_mock.side_effect = [1, 2]
+        get_config_mock.return_value = Config(self._config_parsed)
+        session = MagicMock(spec=Auth)
+        session.token_expires_soon.return_value = True
+        session.authenticate.return_value = True
+
+        autoscale.run_daemon('config.json', {}, session, {'interval': 60},
+                             stop=stop)
+
+        get_config_mock.assert_called_once_with('config.json')
+        self.assertTrue(session.authenticate.called)
+        autoscale_mock.assert_called_once_with('group0', self._config_parsed,
+                                               {'interval': 60})
+
+    @patch('raxas.common.get_config')
+    @patch('os.path.getmtime')
+    @patch('raxas.autoscale.autoscale')
+    def test_run_daemon_keeps_config_on_invalid_reload(self, autoscale_mock,
+                                                       getmtime_mock, get_config_mock):
+        stop = threading.Event()
+        calls = []
+
+        def scale(group, config_data, args):
+            calls.append(config_data)
+            if len(calls) == 2:
+                stop.set()
+            # check_config() exits on an invalid group
+            raise SystemExit(1)
+        autoscale_mock.side_effect = scale
+        getmtime_mock.side_effect = [1, 1, 2]
+        self._config_parsed['autoscale_groups']['group0']['scale_up_policy'] = 5
+        get_config_mock.return_value = Config(self._config_parsed)
+        session = MagicMock(spec=Auth)
+        session.token_expires_soon.return_value = False
+        config_data = Config(json.loads(self._config_json))
+
+        stop.wait = MagicMock()
+
+        autoscale.run_daemon('config.json', config_data, session,
+                             {'interval': 60}, stop=stop)
+
+        get_config_mock.assert_called_once_with('config.json')
+        self.assertEqual(2, len(calls))
+        self.assertIs(config_data, calls[1])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+import unittest2
+
+from mock import Mock
+
+from raxas.cache import RequestCache
+
+
+class RequestCacheTest(unittest2.TestCase):
+    def test_get_caches_by_resource_and_args(self):
+        cache = RequestCache()
+        fetch = Mock(side_effect=lambda lb_id: 'lb%s' % lb_id)
+
+        self.assertEqual('lb1', cache.get('loadbalancer', fetch, 1))
+        self.assertEqual('lb2', cache.get('loadbalancer', fetch, 2))
+        self.assertEqual('lb1', cache.get('loadbalancer', fetch, 1))
+        self.assertEqual(2, fetch.call_count)
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+
+    def test_get_does_not_cache_exceptions(self):
+        cache = RequestCache()
+        fetch = Mock(side_effect=[ValueError, 'lb'])
+
+        self.assertRaises(ValueError, cache.get, 'loadbalancer', fetch, 1)
+        self.assertEqual('lb', cache.get('loadbalancer', fetch, 1))
+
+    def test_get_concurrent_callers_fetch_once(self):
+        cache = RequestCache()
+        calls = []
+
+        def fetch(lb_id):
+            calls.append(lb_id)
+            time.sleep(0.05)
+            return lb_id
+
+        threads = [threading.Thread(target=cache.get, args=('loadbalancer', fetch, 1))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([1], calls)
+
+    def test_clear(self):
+        cache = RequestCache()
+        fetch = Mock(return_value='lb')
+        cache.get('loadbalancer', fetch, 1)
+        cache.clear()
+        cache.get('loadbalancer', fetch, 1)
+        self.assertEqual(2, fetch.call_count)
@@ -23,6 +23,8 @@ from __future__ import with_statement
 import os
 import sys
 import json
+import threading
+import time
 from mock import patch, mock_open, MagicMock
 
 from tests.base_test import BaseTest
@@ -32,6 +34,9 @@ from raxas.scaling_group import ScalingGroup
 
 
 class CommonTest(BaseTest):
+    def setUp(self):
+        common.clear_server_cache()
+
     @patch('os.path.isfile', return_value=True)
     @patch('os.access', return_value=True)
     def test_check_file_should_return_abs_path(self, access_mock, isfile_mock):
@@ -122,16 +127,19 @@ class CommonTest(BaseTest):
         self.assertEqual(common.get_machine_uuid(None), '1234')
 
     @patch('raxas.common.read_uuid_cache', return_value=None)
+    @patch('raxas.common.read_metadata_uuid', return_value=None)
     @patch('raxas.common.write_uuid_cache')
     @patch('netifaces.interfaces')
     @patch('netifaces.ifaddresses')
     @patch('pyrax.cloudservers')
     def test_get_machine_uuid(self, cloud_servers_mock,
                               ifaddr_mock, interfaces_mock, write_uuid_mock,
-                              read_uuid_mock):
+                              read_metadata_mock, read_uuid_mock):
 
         uuid = 'eb8f2464-17a4-4796-a1ba-ab635ad287b9'
         scaling_group = MagicMock(spec=ScalingGroup)
+        scaling_group.cached.side_effect = \
+            lambda resource, func, *args: func(*args)
         scaling_group.plugin_config = {'raxclb': {}}
         scaling_group.launch_config = {'load_balancers': [{'loadBalancerId': 231231}]}
         scaling_group.active_servers = [uuid]
@@ -139,13 +147,43 @@ class CommonTest(BaseTest):
         ifaddr_mock.return_value = {2: [{'addr': '119.9.94.249'}]}
         interfaces_mock.return_value = ['eth0']
 
-        get_mock = cloud_servers_mock.servers.get.return_value
-        get_mock.networks.values.return_value = \
+        other_mock = MagicMock()
+        other_mock.networks.values.return_value = [['119.9.94.249']]
+        other_mock.id = 'not-in-the-scaling-group'
+        server_mock = MagicMock()
+        server_mock.networks.values.return_value = \
             [['119.9.94.249', '2401:1800:7800:102:be76:4eff:fe1c:1945'],
              ['10.176.68.154']]
-        get_mock.id = uuid
+        server_mock.id = uuid
+        cloud_servers_mock.servers.list.return_value = [other_mock, server_mock]
 
         self.assertEqual(common.get_machine_uuid(scaling_group), uuid)
+        write_uuid_mock.assert_called_once_with(uuid)
+        self.assertFalse(cloud_servers_mock.servers.get.called)
+
+    @patch('raxas.common.read_uuid_cache', return_value=None)
+    @patch('raxas.common.read_metadata_uuid',
+           return_value='eb8f2464-17a4-4796-a1ba-ab635ad287b9')
+    @patch('raxas.common.write_uuid_cache')
+    @patch('pyrax.cloudservers')
+    def test_get_machine_uuid_from_metadata(self, cloud_servers_mock,
+                                            write_uuid_mock, read_metadata_mock,
+                                            read_uuid_mock):
+        self.assertEqual(common.get_machine_uuid(None),
+                         'eb8f2464-17a4-4796-a1ba-ab635ad287b9')
+        self.assertFalse(cloud_servers_mock.servers.list.called)
+
+    @patch('subprocess.Popen')
+    def test_read_metadata_uuid(self, popen_mock):
+        popen_mock.return_value.communicate.return_value = \
+            ('instance-eb8f2464-17a4-4796-a1ba-ab635ad287b9\n', '')
+        popen_mock.return_value.returncode = 0
+        self.assertEqual(common.read_metadata_uuid(),
+                         'eb8f2464-17a4-4796-a1ba-ab635ad287b9')
+
+    @patch('subprocess.Popen', side_effect=OSError)
+    def test_read_metadata_uuid_no_xenstore(self, popen_mock):
+        self.assertIsNone(common.read_metadata_uuid())
 
     def test_get_user_value_from_config(self):
         sys.argv = ['/path/to/noserunner.py']
@@ -174,3 +212,86 @@ class CommonTest(BaseTest):
         self.assertEqual(common.is_ipv4('100.200.300.400'), False)
         self.assertEqual(common.is_ipv4('hello'), False)
         self.assertEqual(common.is_ipv4('1.2.3.4.5'), False)
+
+    def test_parallel_map_keeps_order(self):
+        self.assertEqual(common.parallel_map(lambda x: x * 2, [3, 1, 2],
+                                             max_workers=2), [6, 2, 4])
+
+    def test_parallel_map_empty(self):
+        self.assertEqual(common.parallel_map(lambda x: x, []), [])
+
+    def test_parallel_map_errors_return_none(self):
+        def func(item):
+            if item == 1:
+                raise ValueError(item)
+            if item == 2:
+                common.exit_with_error('fatal')
+            return item
+
+        self.assertEqual(common.parallel_map(func, [0, 1, 2]), [0, None, None])
+
+    def test_parallel_map_timeout_returns_none(self):
+        event = threading.Event()
+        try:
+            self.assertEqual(common.parallel_map(lambda x: event.wait(5) or x,
+                                                 [1], timeout=0.1), [None])
+        finally:
+            event.set()
+
+    def test_write_atomically(self):
+        file_path = os.path.join(self.make_temp_dir(), 'data.cache')
+
+        common.write_atomically(file_path, lambda data_file: data_file.write('new'))
+        with open(file_path) as data_file:
+            self.assertEqual('new', data_file.read())
+
+    def test_write_atomically_failure_keeps_file(self):
+        directory = self.make_temp_dir()
+        file_path = os.path.join(directory, 'data.cache')
+        with open(file_path, 'w') as data_file:
+            data_file.write('old')
+
+        def write(data_file):
+            data_file.write('partial')
+            raise IOError('disk full')
+
+        self.assertRaises(IOError, common.write_atomically, file_path, write)
+        self.assertEqual(['data.cache'], os.listdir(directory))
+        with open(file_path) as data_file:
+            self.assertEqual('old', data_file.read())
+
+    @patch('pyrax.cloudservers', create=True)
+    def test_get_server_cached(self, cloud_servers_mock):
+        server = cloud_servers_mock.servers.get.return_value
+
+        self.assertEqual(common.get_server('1234'), server)
+        self.assertEqual(common.get_server('1234'), server)
+        cloud_servers_mock.servers.get.assert_called_once_with('1234')
+        self.assertFalse(cloud_servers_mock.list.called)
+
+    @patch('pyrax.cloudservers', create=True)
+    def test_get_server_cache_expires(self, cloud_servers_mock):
+        common.get_server('1234')
+        with patch('time.time', return_value=time.time() +
+                   common.SERVER_CACHE_TTL + 1):
+            common.get_server('1234')
+        self.assertEqual(cloud_servers_mock.servers.get.call_count, 2)
+
+    @patch('pyrax.cloudservers', create=True)
+    def test_get_server_drops_expired_servers(self, cloud_servers_mock):
+        common.get_server('deleted')
+        with patch('time.time', return_value=time.time() +
+                   common.SERVER_CACHE_TTL + 1):
+            common.get_server('1234')
+        self.assertEqual(['1234'], list(common._server_cache))
+
+    @patch('pyrax.cloudservers', create=True)
+    def test_get_server_not_found(self, cloud_servers_mock):
+        cloud_servers_mock.servers.get.side_effect = Exception('not found')
+        self.assertIsNone(common.get_server('1234'))
+
+    @patch('pyrax.cloudservers', create=True)
+    def test_get_servers(self, cloud_servers_mock):
+        cloud_servers_mock.servers.get.side_effect = \
+            lambda server_id: None if server_id == 'b' else server_id.upper()
+        self.assertEqual(common.get_servers(['a', 'b', 'c']), ['A', None, 'C'])
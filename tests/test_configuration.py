@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from mock import patch
+
+from tests.base_test import BaseTest
+from raxas import configuration
+from raxas.configuration import Config, GroupConfig, PluginConfig
+
+
+class ConfigurationTest(BaseTest):
+    def setUp(self):
+        self.config_dir = self.make_temp_dir()
+        self.config_file = os.path.join(self.config_dir, 'config.json')
+        with open(self.config_file, 'w') as config_file:
+            config_file.write(self._config_json)
+
+    def test_compile(self):
+        config = Config(self._config_parsed)
+        group = config['autoscale_groups']['group0']
+
+        self.assertEqual(self._config_parsed, config)
+        self.assertIsInstance(group, GroupConfig)
+        self.assertEqual('group id', group.group_id)
+        self.assertEqual([], group.errors)
+        self.assertFalse(group.legacy)
+        self.assertIsInstance(group.plugins['raxmon'], PluginConfig)
+        self.assertEqual(0.6, group.plugins['raxmon'].get('scale_up_threshold'))
+        self.assertEqual('api_username', config.auth['os_username'])
+
+    def test_compile_group_errors(self):
+        group = GroupConfig({'group_id': 'id', 'plugins': {'raxmon': 1}})
+
+        self.assertEqual(['autoscale_groups.group.scale_down_policy: '
+                          'missing required key',
+                          'autoscale_groups.group.scale_up_policy: '
+                          'missing required key',
+                          'autoscale_groups.group.plugins.raxmon: '
+                          'expected an object, got 1'], group.errors)
+
+    def test_validate_reports_every_problem(self):
+        data = json.loads(self._config_json)
+        group = data['autoscale_groups']['group0']
+        group['scale_up_policy'] = 42
+        group['webhooks']['timeout'] = -1
+        group['webhooks']['scale_up']['pre'].append(None)
+        group['plugins']['raxmon']['max_samples'] = True
+        group['plugins']['raxmon']['treshold'] = 1
+        group['plugins']['newrelic'] = {}
+        group['plugins']['custom'] = {'anything': 1, 'decision_timeout': '1'}
+        data['autoscale_groups']['group1'] = []
+
+        config = Config(data)
+
+        self.assertFalse(config.valid)
+        self.assertEqual([
+            'autoscale_groups.group0.scale_up_policy: expected a string, got 42',
+            'autoscale_groups.group0.webhooks.scale_up.pre[2]: '
+            'expected a string, got null',
+            'autoscale_groups.group0.webhooks.timeout: must be at least 0, got -1',
+            'autoscale_groups.group0.plugins.custom.decision_timeout: '
+            'expected a number, got "1"',
+            'autoscale_groups.group0.plugins.raxmon.max_samples: '
+            'expected an integer, got true',
+            'autoscale_groups.group1: expected an object, got []'],
+            config.errors)
+        self.assertEqual(['autoscale_groups.group0.plugins.raxmon.treshold: '
+                          'unknown key'], config.warnings)
+
+    def test_validate_plugin_choices(self):
+        group = GroupConfig({'group_id': 'id', 'scale_up_policy': 'up',
+                             'scale_down_policy': 'down',
+                             'plugins': {'raxmon': {'aggregate': 'p95',
+                                                    'data_points': 'all'},
+                                         'raxclb': {'ewma_alpha': 0},
+                                         'newrelic': {'aggregate': 'average',
+                                                      'data_points': 'some'}}})
+
+        self.assertEqual([
+            'autoscale_groups.group.plugins.newrelic.aggregate: unknown aggregate '
+            "'average', expected one of ewma, max, mean, median, trimmed_mean or pN",
+            'autoscale_groups.group.plugins.newrelic.data_points: must be one of '
+            'latest, all, got "some"',
+            'autoscale_groups.group.plugins.raxclb.ewma_alpha: must be greater '
+            'than 0 and at most 1, got 0'], group.errors)
+
+    def test_validate_ordered_aggregate(self):
+        group = GroupConfig({'group_id': 'id', 'scale_up_policy': 'up',
+                             'scale_down_policy': 'down',
+                             'plugins': {'raxmon': {'aggregate': 'ewma',
+                                                    'data_points': 'all'},
+                                         'newrelic': {'aggregate': 'EWMA'}}})
+
+        self.assertEqual(['autoscale_groups.group.plugins.newrelic.aggregate: '
+                          'EWMA needs data_points "all"'], group.errors)
+
+    def test_validate_hysteresis(self):
+        group = GroupConfig({'group_id': 'id', 'scale_up_policy': 'up',
+                             'scale_down_policy': 'down', 'plugins': {},
+                             'hysteresis': {'scale_up_after': 0,
+                                            'scale_down_after': 3,
+                                            'scale_down_cooldown': 600}})
+
+        self.assertEqual({'scale_up_after': 0, 'scale_down_after': 3,
+                          'scale_down_cooldown': 600}, group.hysteresis)
+        self.assertEqual(['autoscale_groups.group.hysteresis.scale_up_after: '
+                          'must be at least 1, got 0'], group.errors)
+
+    def test_validate_missing_groups(self):
+        config = Config({'auth': {}})
+
+        self.assertEqual(['autoscale_groups: expected an object with at least '
+                          'one scaling group'], config.errors)
+
+    def test_compile_legacy_group(self):
+        group = GroupConfig({'group_id': 'id', 'scale_up_threshold': 0.8})
+
+        self.assertTrue(group.legacy)
+        self.assertEqual(0.8, group.plugins['raxmon']['scale_up_threshold'])
+        self.assertIs(group.plugins, group['plugins'])
+
+    def test_load_config_uses_cache(self):
+        config = configuration.load_config(self.config_file)
+        self.assertTrue(os.path.isfile(
+            configuration.cache_file_name(self.config_file)))
+
+        with patch('json.loads') as loads_mock, \
+                patch('__builtin__.open', side_effect=open) as open_mock:
+            cached = configuration.load_config(self.config_file)
+
+        self.assertFalse(loads_mock.called)
+        self.assertNotIn(self.config_file,
+                         [call[0][0] for call in open_mock.call_args_list])
+        self.assertEqual(config, cached)
+        self.assertIsInstance(cached['autoscale_groups']['group0'], GroupConfig)
+
+    def test_load_config_touched_file(self):
+        configuration.load_config(self.config_file)
+        os.utime(self.config_file, (1, 1))
+
+        with patch('json.loads') as loads_mock:
+            configuration.load_config(self.config_file)
+        self.assertFalse(loads_mock.called)
+
+    def test_load_config_changed_file(self):
+        configuration.load_config(self.config_file)
+        data = json.loads(self._config_json)
+        data['autoscale_groups']['group0']['group_id'] = 'new id'
+        with open(self.config_file, 'w') as config_file:
+            json.dump(data, config_file)
+        os.utime(self.config_file, (1, 1))
+
+        config = configuration.load_config(self.config_file)
+        self.assertEqual('new id', config.groups['group0'].group_id)
+
+    def test_read_cache_ignores_shared_file(self):
+        configuration.load_config(self.config_file)
+        os.chmod(configuration.cache_file_name(self.config_file), 0666)
+
+        self.assertIsNone(configuration.read_cache(self.config_file))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+
+from tests.base_test import BaseTest
+from raxas import decision
+from raxas.decision import DecisionState
+from raxas.enums import ScaleDirection
+
+
+class DecisionStateTest(BaseTest):
+    def setUp(self):
+        self.patch_file('raxas.decision.DECISION_STATE_FILE', 'decision-%s.state')
+
+    def test_observe_counts_consecutive_decisions(self):
+        state = DecisionState('group')
+
+        self.assertEqual(1, state.observe(ScaleDirection.Up))
+        self.assertEqual(2, state.observe(ScaleDirection.Up))
+        self.assertEqual(1, state.observe(ScaleDirection.Down))
+        self.assertEqual(1, state.observe(ScaleDirection.Up))
+
+    def test_cooldown_remaining(self):
+        state = DecisionState('group')
+        self.assertEqual(0, state.cooldown_remaining(300, 1000))
+
+        state.record_action(ScaleDirection.Up, 1000)
+        self.assertEqual(300, state.cooldown_remaining(300, 1000))
+        self.assertEqual(60, state.cooldown_remaining(300, 1240))
+        self.assertEqual(0, state.cooldown_remaining(300, 1400))
+
+    def test_record_action_starts_new_streak(self):
+        state = DecisionState('group')
+        state.observe(ScaleDirection.Up)
+        state.observe(ScaleDirection.Up)
+        state.record_action(ScaleDirection.Up, 1000)
+
+        self.assertEqual(1, state.observe(ScaleDirection.Up))
+
+    def test_save_and_load(self):
+        state = DecisionState('group')
+        state.observe(ScaleDirection.Down)
+        state.record_action(ScaleDirection.Up, 1000)
+        state.observe(ScaleDirection.Down)
+        state.save()
+
+        loaded = DecisionState('group')
+        self.assertEqual(ScaleDirection.Down, loaded.direction)
+        self.assertEqual(1, loaded.streak)
+        self.assertEqual(ScaleDirection.Up, loaded.last_action)
+        self.assertEqual(1000, loaded.last_action_time)
+        self.assertEqual(0, DecisionState('other group').streak)
+
+    def test_load_corrupt_file(self):
+        with open(decision.DECISION_STATE_FILE % 'group', 'w') as state_file:
+            state_file.write('{"direction": 5}')
+
+        state = DecisionState('group')
+        self.assertEqual(ScaleDirection.Nothing, state.direction)
+        self.assertEqual(0, state.streak)
+
+    def test_load_ignores_shared_file(self):
+        state = DecisionState('group')
+        state.record_action(ScaleDirection.Up, 1000)
+        state.save()
+        os.chmod(state.file_path, 0666)
+
+        self.assertIsNone(DecisionState('group').last_action)
+
+    def test_load_ignores_future_action(self):
+        state = DecisionState('group')
+        state.observe(ScaleDirection.Up)
+        state.record_action(ScaleDirection.Up, time.time() + 3600)
+        state.save()
+
+        loaded = DecisionState('group')
+        self.assertIsNone(loaded.last_action)
+        self.assertEqual(0, loaded.cooldown_remaining(300, time.time()))
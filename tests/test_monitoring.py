@@ -20,11 +20,14 @@
 
 from __future__ import with_statement
 
+import time
+
 from mock import patch, PropertyMock, MagicMock
 
 from tests.base_test import BaseTest
 from raxas import monitoring
 from raxas.scaling_group import ScalingGroup
+import pyrax.exceptions
 from pyrax import fakes
 from pyrax.cloudmonitoring import CloudMonitorEntity
 from pyrax.cloudmonitoring import CloudMonitorCheck
@@ -40,6 +43,17 @@ class MonitoringTest(BaseTest):
             'check_type': 'agent.plugin'}}
         self.scaling_group.state = {'active_capacity': 1}
         self.scaling_group.active_servers = ['server1']
+        monitoring.invalidate_check_cache()
+        self.scaling_group.group_uuid = 'group id'
+
+        self.index = {}
+        read_patcher = patch('raxas.monitoring.read_entity_index',
+                             side_effect=lambda group_id: dict(self.index))
+        read_patcher.start()
+        self.addCleanup(read_patcher.stop)
+        write_patcher = patch('raxas.monitoring.write_entity_index')
+        self.write_index_mock = write_patcher.start()
+        self.addCleanup(write_patcher.stop)
 
     @patch('pyrax.cloud_monitoring')
     def test_add_entity_check(self, mock_cloud_monitoring):
@@ -119,3 +133,160 @@ class MonitoringTest(BaseTest):
         entity = fakes.FakeCloudMonitorEntity(info={'agent_id': 'NOTINASGRP'})
         mock_cloud_monitoring.list_entities.return_value = [entity]
         self.assertNotEqual(monitoring.get_entities(self.scaling_group), [entity])
+
+    @patch('pyrax.cloud_monitoring')
+    def test_return_entities_writes_index(self, mock_cloud_monitoring):
+        entity = fakes.FakeCloudMonitorEntity(info={'agent_id': 'server1'})
+        mock_cloud_monitoring.list_entities.return_value = [entity]
+
+        monitoring.get_entities(self.scaling_group)
+
+        self.write_index_mock.assert_called_once_with('group id',
+                                                      {'server1': entity.id})
+
+    @patch('pyrax.cloud_monitoring')
+    def test_return_entities_from_index(self, mock_cloud_monitoring):
+        """ Test that indexed entities are fetched without listing every
+            entity on the account
+        """
+        entity = fakes.FakeCloudMonitorEntity(info={'agent_id': 'server1'})
+        self.index = {'server1': entity.id}
+        mock_cloud_monitoring.get_entity.return_value = entity
+
+        self.assertEqual(monitoring.get_entities(self.scaling_group), [entity])
+        mock_cloud_monitoring.get_entity.assert_called_once_with(entity.id)
+        self.assertFalse(mock_cloud_monitoring.list_entities.called)
+        self.assertFalse(self.write_index_mock.called)
+
+    @patch('pyrax.cloud_monitoring')
+    def test_return_entities_stale_index(self, mock_cloud_monitoring):
+        """ Test that an index entry pointing at another agent's entity
+            falls back to listing the entities
+        """
+        entity = fakes.FakeCloudMonitorEntity(info={'agent_id': 'server1'})
+        other = fakes.FakeCloudMonitorEntity(info={'agent_id': 'server2'})
+        self.index = {'server1': other.id}
+        mock_cloud_monitoring.get_entity.return_value = other
+        mock_cloud_monitoring.list_entities.return_value = [entity, other]
+
+        self.assertEqual(monitoring.get_entities(self.scaling_group), [entity])
+        self.write_index_mock.assert_called_once_with('group id',
+                                                      {'server1': entity.id})
+
+    @patch('time.time', return_value=1000)
+    @patch('pyrax.cloud_monitoring')
+    def test_return_entities_remembers_missing(self, mock_cloud_monitoring,
+                                               time_mock):
+        mock_cloud_monitoring.list_entities.return_value = []
+
+        self.assertEqual(monitoring.get_entities(self.scaling_group), [])
+        self.write_index_mock.assert_called_once_with(
+            'group id', {'server1': 1000 + monitoring.MISSING_ENTITY_TTL})
+
+        self.index = self.write_index_mock.call_args[0][1]
+        self.write_index_mock.reset_mock()
+        self.assertEqual(monitoring.get_entities(self.scaling_group), [])
+        self.assertEqual(1, mock_cloud_monitoring.list_entities.call_count)
+        self.assertFalse(self.write_index_mock.called)
+
+    @patch('pyrax.cloud_monitoring')
+    def test_return_entities_missing_expired(self, mock_cloud_monitoring):
+        entity = fakes.FakeCloudMonitorEntity(info={'agent_id': 'server1'})
+        self.index = {'server1': time.time() - 1, 'server2': 'deleted'}
+        mock_cloud_monitoring.list_entities.return_value = [entity]
+
+        self.assertEqual(monitoring.get_entities(self.scaling_group), [entity])
+        self.write_index_mock.assert_called_once_with('group id',
+                                                      {'server1': entity.id})
+
+    def test_entity_check_cached(self):
+        entity = self._entity_with_metric('server1', 1)
+
+        check = monitoring.get_entity_check(entity, 'agent.load_average')
+        self.assertEqual(monitoring.get_entity_check(entity, 'agent.load_average'),
+                         check)
+        monitoring.add_entity_checks([entity], 'agent.load_average', '1m')
+        self.assertEqual(monitoring.get_latest_metric(entity, 'agent.load_average',
+                                                      '1m', 600), 1)
+        self.assertEqual(entity.list_checks.call_count, 1)
+
+    def test_entity_check_cache_expires(self):
+        entity = self._entity_with_metric('server1', 1)
+
+        monitoring.get_entity_check(entity, 'agent.load_average')
+        with patch('time.time', return_value=time.time() +
+                   monitoring.CHECK_CACHE_TTL + 1):
+            monitoring.get_entity_check(entity, 'agent.load_average')
+        self.assertEqual(entity.list_checks.call_count, 2)
+
+    def test_entity_check_cache_drops_expired_checks(self):
+        deleted = self._entity_with_metric('deleted', 1)
+        monitoring.get_entity_check(deleted, 'agent.load_average')
+        with patch('time.time', return_value=time.time() +
+                   monitoring.CHECK_CACHE_TTL + 1):
+            monitoring.get_entity_check(self._entity_with_metric('server1', 1),
+                                        'agent.load_average')
+        self.assertEqual([('server1', 'agent.load_average')],
+                         list(monitoring._check_cache))
+
+    def test_entity_check_invalidated_on_not_found(self):
+        entity = self._entity_with_metric('server1', 1)
+        check = entity.list_checks.return_value[0]
+        check.get_metric_data_points.side_effect = pyrax.exceptions.NotFound(404)
+
+        self.assertIsNone(monitoring.get_latest_metric(
+            entity, 'agent.load_average', '1m', 600))
+        monitoring.get_entity_check(entity, 'agent.load_average')
+        self.assertEqual(entity.list_checks.call_count, 2)
+
+    def _entity_with_metric(self, agent, value):
+        entity = MagicMock(spec=CloudMonitorEntity)
+        type(entity).agent_id = PropertyMock(return_value=agent)
+        check = MagicMock(spec=CloudMonitorCheck)
+        type(check).type = PropertyMock(return_value='agent.load_average')
+        check.get_metric_data_points.return_value = (
+            [] if value is None else [{'average': 0}, {'average': value}])
+        entity.list_checks.return_value = [check]
+        return entity
+
+    def test_get_metric_samples_latest_points(self):
+        entities = [self._entity_with_metric('server%d' % i, i)
+                    for i in range(3)]
+        self.assertEqual(sorted(monitoring.get_metric_samples(
+            entities, 'agent.load_average', '1m', 600, 10)), [0, 1, 2])
+
+    def test_get_metric_samples_all_points(self):
+        entities = [self._entity_with_metric('server%d' % i, i)
+                    for i in range(1, 3)]
+        entities[0].list_checks.return_value[0].get_metric_data_points.return_value = [
+            {'timestamp': 1000, 'average': 0.5}, {'timestamp': 2000, 'average': 1}]
+
+        self.assertEqual(sorted(monitoring.get_metric_samples(
+            entities, 'agent.load_average', '1m', 600, 10, all_points=True)),
+            [[(0, 0), (0, 2)], [(1000, 0.5), (2000, 1)]])
+
+    def test_get_metric_samples_stops_at_max_samples(self):
+        entities = [self._entity_with_metric('server%d' % i, i)
+                    for i in range(5)]
+        results = monitoring.get_metric_samples(entities, 'agent.load_average',
+                                                '1m', 600, 2)
+
+        self.assertEqual(sorted(results), [0, 1])
+        for entity in entities[2:]:
+            self.assertFalse(entity.list_checks.called)
+
+    def test_get_metric_samples_skips_entities_without_data(self):
+        entities = [self._entity_with_metric('server0', None),
+                    self._entity_with_metric('server1', 5)]
+        entities[0].list_checks.side_effect = pyrax.exceptions.NotFound(404)
+        self.assertEqual(monitoring.get_metric_samples(
+            entities, 'agent.load_average', '1m', 600, 1), [5])
+
+    @patch('raxas.monitoring.get_latest_metric')
+    def test_get_metric_samples_survives_fetch_errors(self, latest_mock):
+        latest_mock.side_effect = [RuntimeError('boom'), 3]
+        entities = [self._entity_with_metric('server%d' % i, i)
+                    for i in range(2)]
+
+        self.assertEqual(monitoring.get_metric_samples(
+            entities, 'agent.load_average', '1m', 600, 1), [3])
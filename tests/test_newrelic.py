@@ -18,25 +18,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import unittest2
-
 from mock import MagicMock, patch
+from tests.base_test import BaseTest
+from raxas import common
+from raxas.core_plugins import newrelic as newrelic_plugin
 from raxas.scaling_group import ScalingGroup
 from raxas.core_plugins.newrelic import NewRelic
 from novaclient.v1_1.servers import Server
 from newrelic_api import Applications, Servers
+from newrelic_api.exceptions import NewRelicAPIServerException
 
 
-class NewRelicTest(unittest2.TestCase):
+class NewRelicTest(BaseTest):
 
     def __init__(self, *args, **kwargs):
         super(NewRelicTest, self).__init__(*args, **kwargs)
 
     def setUp(self):
+        common.clear_server_cache()
         self.scaling_group = MagicMock(spec=ScalingGroup)
+        self.scaling_group.cached.side_effect = \
+            lambda resource, func, *args: func(*args)
         self.scaling_group.plugin_config = {'newrelic': {}}
         self.scaling_group.state = {'active_capacity': 1}
 
+        self.patch_file('raxas.core_plugins.newrelic.ID_CACHE_FILE', 'newrelic-%s.cache')
+
     @patch('raxas.core_plugins.newrelic.Applications', create=True)
     def test_scaleup_application(self, mock_newrelic_api):
         self.scaling_group.plugin_config = {'newrelic': {
@@ -52,6 +59,21 @@ class NewRelicTest(unittest2.TestCase):
         newrelic = NewRelic(self.scaling_group)
         self.assertEqual(1, newrelic.make_decision())
 
+    @patch('raxas.core_plugins.newrelic.Applications', create=True)
+    def test_application_name_alias(self, mock_newrelic_api):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "application_name": "Test"}}
+        mock_application = MagicMock(spec=Applications)
+        mock_newrelic_api.return_value = mock_application
+        mock_application.list.return_value = {"applications": [{"name": "Test", "id": 123456}]}
+        mock_application.metric_data.return_value = {"metric_data": {
+            "metrics": [{"timeslices": [{"values": {"average_value": 15}}]}]}}
+        newrelic = NewRelic(self.scaling_group)
+
+        self.assertEqual(1, newrelic.make_decision())
+        mock_application.list.assert_called_once_with(filter_name="Test")
+
     @patch('pyrax.cloudservers', create=True)
     @patch('raxas.core_plugins.newrelic.Servers', create=True)
     def test_scaleup_servers(self, mock_newrelic_api, mock_pyrax):
@@ -61,7 +83,7 @@ class NewRelicTest(unittest2.TestCase):
             "metric_value": "average_response_time"}}
         self.scaling_group.active_servers = [123456]
         mock_nova_server = MagicMock(spec=Server)
-        mock_nova_server.human_id.return_value = "Test-server"
+        mock_nova_server.human_id = "Test-server"
         mock_server = MagicMock(spec=Servers)
         mock_pyrax.servers.get.return_value = mock_nova_server
         mock_server.list.return_value = {"servers": [{"name": "Test-server", "id": 512354134}]}
@@ -96,7 +118,7 @@ class NewRelicTest(unittest2.TestCase):
 
         self.scaling_group.active_servers = [123456]
         mock_nova_server = MagicMock(spec=Server)
-        mock_nova_server.human_id.return_value = "Test-server"
+        mock_nova_server.human_id = "Test-server"
         mock_server = MagicMock(spec=Servers)
         mock_pyrax.servers.get.return_value = mock_nova_server
         mock_server.list.return_value = {"servers": [{"name": "Test-server", "id": 512354134}]}
@@ -138,3 +160,156 @@ class NewRelicTest(unittest2.TestCase):
             "metrics": [{"timeslices": [{"values": {"average_response_time": 12}}]}]}}
         newrelic = NewRelic(self.scaling_group)
         self.assertEqual(0, newrelic.make_decision())
+
+    @patch('raxas.core_plugins.newrelic.Applications', None)
+    def test_missing_newrelic_api(self):
+        self.assertRaises(ImportError, NewRelic, self.scaling_group)
+
+    @patch('pyrax.cloudservers', create=True)
+    @patch('raxas.core_plugins.newrelic.Servers', create=True)
+    def test_servers_fleet_average(self, mock_newrelic_api, mock_pyrax):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "scale_down_threshold": 10,
+            "scale_up_threshold": 15,
+            "metric_value": "average_value"}}
+        self.scaling_group.active_servers = ['uuid-1', 'uuid-2', 'uuid-3']
+        nova_servers = {}
+        for number in range(1, 4):
+            nova_servers['uuid-%d' % number] = MagicMock(spec=Server)
+            nova_servers['uuid-%d' % number].human_id = 'web-%d' % number
+        mock_pyrax.servers.get.side_effect = lambda server_id: nova_servers[server_id]
+        mock_server = MagicMock(spec=Servers)
+        mock_server.list.side_effect = [
+            {"servers": [{"name": "WEB-1", "id": 1}, {"name": "db", "id": 9}],
+             "pages": {"next": {"url": "page 2"}}},
+            {"servers": [{"name": "web-2", "id": 2}]}]
+        values = {1: 8, 2: 16}
+        # metric_data is called from several threads, the call_count of a
+        # mock is not thread-safe
+        fetched = []
+
+        def metric_data(server_id, *args, **kwargs):
+            fetched.append(server_id)
+            return {"metric_data": {"metrics": [{"timeslices": [{"values": {
+                "average_value": values[server_id]}}]}]}}
+        mock_server.metric_data.side_effect = metric_data
+        mock_newrelic_api.return_value = mock_server
+
+        newrelic = NewRelic(self.scaling_group)
+        self.assertEqual(0, newrelic.make_decision())
+        self.assertEqual(2, mock_server.list.call_count)
+        self.assertEqual([1, 2], sorted(fetched))
+
+        # every hostname is cached now, web-3 as unknown to New Relic
+        newrelic = NewRelic(self.scaling_group)
+        self.assertEqual(0, newrelic.make_decision())
+        self.assertEqual(2, mock_server.list.call_count)
+        self.assertEqual([1, 1, 2, 2], sorted(fetched))
+
+    def test_id_cache_expiry(self):
+        newrelic_plugin.write_id_cache('key', 'servers', {'web-1': 1}, 60)
+        newrelic_plugin.write_id_cache('key', 'servers', {'web-2': None}, -1)
+        newrelic_plugin.write_id_cache('key', 'applications', {'app': 5}, 60)
+
+        self.assertEqual({'web-1': 1}, newrelic_plugin.read_id_cache('key', 'servers'))
+        self.assertEqual({'app': 5}, newrelic_plugin.read_id_cache('key', 'applications'))
+        self.assertEqual({}, newrelic_plugin.read_id_cache('other key', 'servers'))
+
+    @patch('raxas.core_plugins.newrelic.Applications', create=True)
+    def test_application_id_cached(self, mock_newrelic_api):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "application": "Test",
+            "metric_value": "average_response_time"}}
+        mock_application = MagicMock(spec=Applications)
+        mock_newrelic_api.return_value = mock_application
+        mock_application.list.return_value = {"applications": [{"name": "Test", "id": 123456}]}
+        mock_application.metric_data.return_value = {"metric_data": {
+            "metrics": [{"timeslices": [{"values": {"average_response_time": 15}}]}]}}
+
+        self.assertEqual(1, NewRelic(self.scaling_group).make_decision())
+        self.assertEqual(1, NewRelic(self.scaling_group).make_decision())
+
+        self.assertEqual(1, mock_application.list.call_count)
+        self.assertEqual(123456, mock_application.metric_data.call_args[0][0])
+
+    @patch('raxas.core_plugins.newrelic.Applications', create=True)
+    def test_application_id_not_found(self, mock_newrelic_api):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "application": "Test",
+            "metric_value": "average_response_time"}}
+        newrelic_plugin.write_id_cache('fakeapikey', 'applications', {'Test': 1}, 60)
+        mock_application = MagicMock(spec=Applications)
+        mock_newrelic_api.return_value = mock_application
+        mock_application.list.return_value = {"applications": [{"name": "Test", "id": 2}]}
+        metric_data = {"metric_data": {
+            "metrics": [{"timeslices": [{"values": {"average_response_time": 15}}]}]}}
+        mock_application.metric_data.side_effect = [
+            NewRelicAPIServerException('404: not found'), metric_data]
+
+        self.assertEqual(1, NewRelic(self.scaling_group).make_decision())
+
+        self.assertEqual([1, 2], [call[0][0] for call
+                                  in mock_application.metric_data.call_args_list])
+        self.assertEqual({'Test': 2}, newrelic_plugin.read_id_cache('fakeapikey',
+                                                                    'applications'))
+
+    @patch('raxas.core_plugins.newrelic.Applications', create=True)
+    def test_application_server_error(self, mock_newrelic_api):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "application": "Test"}}
+        mock_application = MagicMock(spec=Applications)
+        mock_newrelic_api.return_value = mock_application
+        mock_application.list.return_value = {"applications": [{"name": "Test", "id": 1}]}
+        mock_application.metric_data.side_effect = NewRelicAPIServerException('500: error')
+
+        self.assertRaises(NewRelicAPIServerException,
+                          NewRelic(self.scaling_group).make_decision)
+        self.assertEqual({'Test': 1}, newrelic_plugin.read_id_cache('fakeapikey',
+                                                                    'applications'))
+
+    @patch('pyrax.cloudservers', create=True)
+    @patch('raxas.core_plugins.newrelic.Servers', create=True)
+    def test_servers_aggregate_all_points(self, mock_newrelic_api, mock_pyrax):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "scale_down_threshold": 10,
+            "scale_up_threshold": 15,
+            "metric_value": "average_value",
+            "aggregate": "max",
+            "data_points": "all"}}
+        self.scaling_group.active_servers = ['uuid-1']
+        mock_nova_server = MagicMock(spec=Server)
+        mock_nova_server.human_id = "web-1"
+        mock_pyrax.servers.get.return_value = mock_nova_server
+        mock_server = MagicMock(spec=Servers)
+        mock_server.list.return_value = {"servers": [{"name": "web-1", "id": 1}]}
+        mock_server.metric_data.return_value = {"metric_data": {"metrics": [{"timeslices": [
+            {"from": "2016-02-01T10:00:00+00:00", "values": {"average_value": 12}},
+            {"from": "2016-02-01T10:01:00+00:00", "values": {"average_value": 20}},
+            {"from": "2016-02-01T10:02:00+00:00", "values": {"average_value": 11}}]}]}}
+        mock_newrelic_api.return_value = mock_server
+
+        self.assertEqual(1, NewRelic(self.scaling_group).make_decision())
+        self.assertFalse(mock_server.metric_data.call_args[1]['summarize'])
+
+    def test_unknown_aggregate(self):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "aggregate": "average"}}
+
+        self.assertRaises(ValueError, NewRelic, self.scaling_group)
+
+    @patch.dict('os.environ', {'NEW_RELIC_API_KEY': 'environment key'})
+    def test_api_key_from_environment(self):
+        self.assertEqual('environment key', NewRelic(self.scaling_group).api_key)
+
+    def test_ewma_needs_all_data_points(self):
+        self.scaling_group.plugin_config = {'newrelic': {
+            "api_key": "fakeapikey",
+            "aggregate": "ewma"}}
+
+        self.assertRaises(ValueError, NewRelic, self.scaling_group)
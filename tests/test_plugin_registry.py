@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from mock import patch
+
+from tests.base_test import BaseTest
+from raxas import plugin_registry
+from raxas.core_plugins.raxclb import Raxclb
+
+
+class PluginRegistryTest(BaseTest):
+    def setUp(self):
+        self.patch_file('raxas.plugin_registry.REGISTRY_CACHE_FILE', 'plugins-%s.cache')
+
+        self.site_dir = self.make_temp_dir()
+
+    @patch('raxas.plugin_registry.scan_entry_points',
+           return_value={'raxclb': 'raxas.core_plugins.raxclb:Raxclb'})
+    def test_get_registry_scans_once(self, scan_mock):
+        self.assertEqual(scan_mock.return_value, plugin_registry.get_registry())
+        self.assertEqual(scan_mock.return_value, plugin_registry.get_registry())
+        self.assertEqual(1, scan_mock.call_count)
+
+        plugin_registry.get_registry(rescan=True)
+        self.assertEqual(2, scan_mock.call_count)
+
+    @patch('raxas.plugin_registry.scan_entry_points', return_value={})
+    def test_get_registry_environment_changed(self, scan_mock):
+        with patch('sys.path', [self.site_dir]):
+            plugin_registry.get_registry()
+            os.mkdir(os.path.join(self.site_dir, 'raxas_plugin-1.0.dist-info'))
+            plugin_registry.get_registry()
+
+        self.assertEqual(2, scan_mock.call_count)
+
+    def test_environment_fingerprint_ignores_modules(self):
+        with patch('sys.path', [self.site_dir]):
+            fingerprint = plugin_registry.environment_fingerprint()
+            open(os.path.join(self.site_dir, 'module.py'), 'w').close()
+            self.assertEqual(fingerprint, plugin_registry.environment_fingerprint())
+
+    def test_read_registry_corrupt(self):
+        with open(plugin_registry.registry_cache_file(), 'w') as cache_file:
+            cache_file.write('{')
+
+        self.assertIsNone(plugin_registry.read_registry('fingerprint'))
+
+    def test_read_registry_ignores_shared_file(self):
+        plugin_registry.write_registry('fingerprint', {'raxclb': 'os:system'})
+        self.assertEqual({'raxclb': 'os:system'},
+                         plugin_registry.read_registry('fingerprint'))
+
+        os.chmod(plugin_registry.registry_cache_file(), 0666)
+        self.assertIsNone(plugin_registry.read_registry('fingerprint'))
+
+    def test_load_class(self):
+        self.assertIs(Raxclb, plugin_registry.load_class(
+            'raxas.core_plugins.raxclb:Raxclb'))
+        self.assertRaises(AttributeError, plugin_registry.load_class,
+                          'raxas.core_plugins.raxclb:Missing')
@@ -26,6 +26,7 @@ from pyrax.cloudloadbalancers import Node
 from pyrax.cloudmonitoring import CloudMonitorCheck
 from pyrax.cloudmonitoring import CloudMonitorEntity
 from pyrax import fakes
+from raxas import monitoring
 from raxas.core_plugins.raxmon_autoscale import Raxmon_autoscale
 from raxas.scaling_group import ScalingGroup
 
@@ -38,12 +39,21 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
 
     def setUp(self):
         self.scaling_group = MagicMock(spec=ScalingGroup)
+        self.scaling_group.cached.side_effect = \
+            lambda resource, func, *args: func(*args)
         self.scaling_group.plugin_config = {'raxmon_autoscale': {
             'load_balancers': [12345, 67889],
             'num_static_servers': 0,
             'check_type': 'agent.plugin'}}
         self.scaling_group.state = {'active_capacity': 1}
         self.scaling_group.active_servers = ['server1']
+        monitoring.invalidate_check_cache()
+
+        for name, value in [('read_entity_index', {}),
+                            ('write_entity_index', None)]:
+            patcher = patch('raxas.monitoring.%s' % name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
     @patch('pyrax.cloud_loadbalancers')
     def test_static_lb_nodes_do_nothing(self, fake_clb, mock_cloud_monitoring):
@@ -63,6 +73,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         check = MagicMock(spec=CloudMonitorCheck)
         check_type = PropertyMock(return_value='agent.plugin')
@@ -106,6 +117,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         check = MagicMock(spec=CloudMonitorCheck)
         check_type = PropertyMock(return_value='agent.plugin')
@@ -144,6 +156,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         check = MagicMock(spec=CloudMonitorCheck)
         check_type = PropertyMock(return_value='agent.plugin')
@@ -184,6 +197,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         check = MagicMock(spec=CloudMonitorCheck)
         check_type = PropertyMock(return_value='agent.plugin')
@@ -220,6 +234,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         check = MagicMock(spec=CloudMonitorCheck)
         check_type = PropertyMock(return_value='agent.plugin')
@@ -245,6 +260,7 @@ class Raxmon_autoscaleTest(unittest2.TestCase):
         entity = MagicMock(spec=CloudMonitorEntity)
         agent_id = PropertyMock(return_value='server1')
         type(entity).agent_id = agent_id
+        type(entity).id = PropertyMock(return_value='en1')
 
         class mock_ipaddr(object):
             def values(self):
@@ -18,27 +18,34 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import unittest2
+from datetime import datetime, timedelta
 
 from mock import MagicMock, patch
 from pyrax.exceptions import NotFound
 from pyrax.cloudloadbalancers import CloudLoadBalancer
 
+from tests.base_test import BaseTest
+from raxas.core_plugins import raxclb
 from raxas.core_plugins.raxclb import Raxclb
+from raxas.timeseries import RingBuffer
 from raxas.scaling_group import ScalingGroup
 
 
 @patch('pyrax.cloud_loadbalancers', create=True)
-class RaxclbTest(unittest2.TestCase):
+class RaxclbTest(BaseTest):
     def __init__(self, *args, **kwargs):
         super(RaxclbTest, self).__init__(*args, **kwargs)
 
     def setUp(self):
         self.scaling_group = MagicMock(spec=ScalingGroup)
+        self.scaling_group.cached.side_effect = \
+            lambda resource, func, *args: func(*args)
         self.scaling_group.plugin_config = {'raxclb': {}}
         self.scaling_group.launch_config = {'load_balancers': [{'loadBalancerId': 231231}]}
         self.scaling_group.state = {'active_capacity': 1}
 
+        self.patch_file('raxas.core_plugins.raxclb.USAGE_STORE_FILE', 'usage-%s-%s.ts')
+
     def test_make_decision_no_lb(self, mock_clb):
         self.scaling_group.launch_config = {'test': 'case'}
 
@@ -80,13 +87,82 @@ class RaxclbTest(unittest2.TestCase):
         self.scaling_group.plugin_config = {'raxclb': {'check_type': 'ssl'}}
         fakelb = MagicMock(spec=CloudLoadBalancer)
         fakelb.get_stats.return_value = {'currentConnSsl': 20}
+        start_time = (datetime.utcnow() - timedelta(minutes=30)).strftime(
+            '%Y-%m-%dT%H:%M:%SZ')
         fakelb.get_usage.return_value = {
             'loadBalancerUsageRecords': [
-                {'averageNumConnectionsSsl': 5},
-                {'averageNumConnectionsSsl': 8}
+                {'averageNumConnectionsSsl': 5, 'startTime': start_time},
+                {'averageNumConnectionsSsl': 8, 'startTime': start_time}
             ]
         }
         mock_clb.get.return_value = fakelb
 
         rclb = Raxclb(self.scaling_group)
         self.assertEqual(0, rclb.make_decision())
+
+    def test_make_decision_skips_missing_lb(self, mock_clb):
+        self.scaling_group.plugin_config = {'raxclb': {'loadbalancers': [1, 2]}}
+        fakelb = MagicMock(spec=CloudLoadBalancer)
+        fakelb.get_stats.return_value = {'currentConn': 100}
+
+        def get_lb(lb_id):
+            if lb_id == 1:
+                raise NotFound(404)
+            return fakelb
+        mock_clb.get.side_effect = get_lb
+
+        rclb = Raxclb(self.scaling_group)
+        self.assertEqual(1, rclb.make_decision())
+
+    def seed_store(self, lb_id, samples, alpha=0.5):
+        store = RingBuffer(raxclb.USAGE_STORE_FILE % (lb_id, 'averageNumConnections'),
+                           capacity=raxclb.USAGE_STORE_SIZE, alpha=alpha)
+        for hour, value in samples:
+            store.append(raxclb.epoch(datetime(2016, 2, 1, hour)), value)
+        store.save()
+
+    @patch('raxas.core_plugins.raxclb.datetime')
+    def test_usage_records_fetched_incrementally(self, datetime_mock, mock_clb):
+        datetime_mock.utcnow.return_value = datetime(2016, 2, 1, 12, 0)
+        datetime_mock.strptime.side_effect = datetime.strptime
+        datetime_mock.utcfromtimestamp.side_effect = datetime.utcfromtimestamp
+        self.scaling_group.plugin_config = {'raxclb': {
+            'loadbalancers': [7], 'scale_up_threshold': 21}}
+        self.seed_store(7, [(9, 100), (10, 10), (11, 20)])
+        fakelb = MagicMock(spec=CloudLoadBalancer)
+        fakelb.get_stats.return_value = {'currentConn': 10}
+        fakelb.get_usage.return_value = {'loadBalancerUsageRecords': [
+            {'startTime': '2016-02-01T12:00:00Z', 'averageNumConnections': 40},
+            {'startTime': '2016-02-01T05:00:00-06:00', 'averageNumConnections': 30}]}
+        mock_clb.get.return_value = fakelb
+
+        rclb = Raxclb(self.scaling_group)
+        self.assertEqual(0, rclb.make_decision())
+
+        fakelb.get_usage.assert_called_once_with(start=datetime(2016, 2, 1, 11, 0))
+        store = RingBuffer(raxclb.USAGE_STORE_FILE % (7, 'averageNumConnections'),
+                           capacity=raxclb.USAGE_STORE_SIZE)
+        self.assertEqual([10, 30, 40], [value for _, value in store.samples()])
+
+    @patch('raxas.core_plugins.raxclb.datetime')
+    def test_make_decision_ewma(self, datetime_mock, mock_clb):
+        datetime_mock.utcnow.return_value = datetime(2016, 2, 1, 12, 0)
+        datetime_mock.utcfromtimestamp.side_effect = datetime.utcfromtimestamp
+        self.scaling_group.plugin_config = {'raxclb': {
+            'loadbalancers': [7], 'scale_up_threshold': 21,
+            'historical_average': 'ewma'}}
+        self.seed_store(7, [(10, 10), (11, 30), (12, 40)])
+        fakelb = MagicMock(spec=CloudLoadBalancer)
+        fakelb.get_stats.return_value = {'currentConn': 10}
+        fakelb.get_usage.return_value = {'loadBalancerUsageRecords': []}
+        mock_clb.get.return_value = fakelb
+
+        rclb = Raxclb(self.scaling_group)
+        self.assertEqual(1, rclb.make_decision())
+
+    def test_parse_time(self, mock_clb):
+        self.assertEqual(datetime(2016, 2, 1, 10, 30),
+                         raxclb.parse_time('2016-02-01T04:30:00-06:00'))
+        self.assertEqual(datetime(2016, 2, 1, 10, 0),
+                         raxclb.parse_time('2016-02-01T10:00:00Z'))
+        self.assertIsNone(raxclb.parse_time(None))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mock import MagicMock, patch
+
+from tests.base_test import BaseTest
+from raxas import timeseries
+from raxas.core_plugins.raxmon import Raxmon
+from raxas.scaling_group import ScalingGroup
+
+NOW = 1454320800
+
+
+@patch('raxas.core_plugins.raxmon.time.time', return_value=NOW)
+@patch('raxas.monitoring.add_entity_checks')
+@patch('raxas.monitoring.get_entities', return_value=[])
+@patch('raxas.monitoring.get_metric_samples')
+class RaxmonTest(BaseTest):
+    def setUp(self):
+        self.scaling_group = MagicMock(spec=ScalingGroup)
+        self.scaling_group.group_uuid = 'group id'
+        self.scaling_group.plugin_config = {'raxmon': {}}
+
+        self.patch_file('raxas.timeseries.HISTORY_FILE', 'history-%s.ts')
+
+    def seed_history(self, values):
+        history = timeseries.open_history('group id', 'agent.load_average', '1m')
+        for minutes_ago, value in values:
+            history.append(NOW - minutes_ago * 60, value)
+        history.save()
+
+    def test_make_decision_threshold(self, samples_mock, *mocks):
+        samples_mock.return_value = [0.7, 0.5]
+
+        self.assertEqual(0, Raxmon(self.scaling_group).make_decision())
+        self.assertEqual(600, samples_mock.call_args[0][3])
+        self.assertFalse(samples_mock.call_args[1]['all_points'])
+
+    def test_make_decision_no_data(self, samples_mock, *mocks):
+        samples_mock.return_value = []
+
+        self.assertIsNone(Raxmon(self.scaling_group).make_decision())
+
+    def test_make_decision_predicts_scale_up(self, samples_mock, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'mode': 'predictive'}}
+        self.seed_history([(4, 0.2), (3, 0.3), (2, 0.4)])
+        samples_mock.return_value = [[((NOW - 60) * 1000, 0.5)],
+                                     [((NOW - 60) * 1000, 0.5), (NOW * 1000, 0.55)]]
+
+        self.assertEqual(1, Raxmon(self.scaling_group).make_decision())
+        self.assertEqual(120, samples_mock.call_args[0][3])
+
+        history = timeseries.open_history('group id', 'agent.load_average', '1m')
+        self.assertEqual([(NOW - 60, 0.5), (NOW, 0.55)], history.since(NOW - 60))
+
+    def test_make_decision_prediction_holds_scale_down(self, samples_mock, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'mode': 'predictive'}}
+        self.seed_history([(3, 0.3), (2, 0.32), (1, 0.34)])
+        samples_mock.return_value = [[(NOW * 1000, 0.35)]]
+
+        self.assertEqual(0, Raxmon(self.scaling_group).make_decision())
+
+    def test_make_decision_predictive_without_history(self, samples_mock, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'mode': 'predictive'}}
+        samples_mock.return_value = [[(NOW * 1000, 0.3)]]
+
+        self.assertEqual(-1, Raxmon(self.scaling_group).make_decision())
+        self.assertEqual(600, samples_mock.call_args[0][3])
+
+    def test_make_decision_predictive_all_points(self, samples_mock, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'mode': 'predictive',
+                                                       'data_points': 'all'}}
+        self.seed_history([(3, 0.3), (2, 0.3), (1, 0.3)])
+        samples_mock.return_value = [[((NOW - 540) * 1000, 0.9), ((NOW - 480) * 1000, 0.9),
+                                      (NOW * 1000, 0.3)]]
+
+        # the threshold covers the whole window, not just the new points
+        self.assertEqual(1, Raxmon(self.scaling_group).make_decision())
+        self.assertEqual(600, samples_mock.call_args[0][3])
+
+    def test_make_decision_ewma_in_time_order(self, samples_mock, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {
+            'aggregate': 'ewma', 'data_points': 'all', 'scale_up_threshold': 0.7}}
+        samples_mock.return_value = [[(3000, 0.2)], [(1000, 1.0), (2000, 1.0)]]
+
+        self.assertEqual(0, Raxmon(self.scaling_group).make_decision())
+
+    def test_ewma_needs_all_data_points(self, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'aggregate': 'ewma'}}
+
+        self.assertRaises(ValueError, Raxmon, self.scaling_group)
+
+    def test_unknown_mode(self, *mocks):
+        self.scaling_group.plugin_config = {'raxmon': {'mode': 'psychic'}}
+
+        self.assertRaises(ValueError, Raxmon, self.scaling_group)
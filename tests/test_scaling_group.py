@@ -18,6 +18,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import time
+
 from mock import patch, Mock, MagicMock
 from pyrax.autoscale import ScalingGroup as pyrax_ScalingGroup
 from pyrax.fakes import FakeScalingGroup, FakeIdentity
@@ -26,7 +30,9 @@ from raxas.enums import *
 import requests
 
 from tests.base_test import BaseTest
-from raxas.scaling_group import ScalingGroup
+from raxas.configuration import GroupConfig
+import raxas.scaling_group
+from raxas.scaling_group import ScalingGroup, get_webhook_session
 
 
 class TestScalingGroup(BaseTest):
@@ -40,6 +46,8 @@ class TestScalingGroup(BaseTest):
             'active_capacity': 1
         }
 
+        self.patch_file('raxas.scaling_group.MASTER_CACHE_FILE', 'masters-%s.cache')
+
     @patch('raxas.common.exit_with_error')
     def test_does_not_exit_with_valid_config(self, exit_mock):
         scaling_group = ScalingGroup(self.group_config, 'group0')
@@ -134,6 +142,16 @@ class TestScalingGroup(BaseTest):
         self.assertIsInstance(scaling_group.scaling_group, pyrax_ScalingGroup)
         self.assertEqual(1, autoscale_mock.get.call_count)
 
+    def test_cached_fetches_once(self):
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        fetch = Mock(return_value='lb')
+
+        self.assertEqual('lb', scaling_group.cached('loadbalancer', fetch, 1))
+        self.assertEqual('lb', scaling_group.cached('loadbalancer', fetch, 1))
+        fetch.assert_called_once_with(1)
+        self.assertEqual(1, scaling_group.request_cache.hits)
+        self.assertEqual(1, scaling_group.request_cache.misses)
+
     @patch.object(ScalingGroup, 'scaling_group')
     def test_state_returned_correctly(self, scaling_group_mock):
         scaling_group_mock.get_state.return_value = self._state
@@ -235,7 +253,54 @@ class TestScalingGroup(BaseTest):
 
         self.assertEqual(NodeStatus.Slave, scaling_group.is_master)
 
-    @patch('requests.post')
+    @patch.object(ScalingGroup, 'active_servers')
+    @patch('raxas.common.get_machine_uuid', return_value=123456)
+    def test_is_master_uses_cached_masters(self, get_machine_uuid_mock,
+                                           active_servers_mock):
+        active_servers_mock.__get__ = Mock(return_value=[123456, 434987, 78910])
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        self.assertEqual(NodeStatus.Master, scaling_group.is_master)
+
+        active_servers_mock.__get__ = Mock(side_effect=AssertionError('API called'))
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        self.assertEqual(NodeStatus.Master, scaling_group.is_master)
+        self.assertEqual([123456, 434987], scaling_group.read_master_cache())
+
+    @patch.object(ScalingGroup, 'active_servers')
+    @patch('raxas.common.get_machine_uuid', return_value=123456)
+    def test_is_master_cache_expires(self, get_machine_uuid_mock,
+                                     active_servers_mock):
+        active_servers_mock.__get__ = Mock(return_value=[123456])
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        self.assertEqual(NodeStatus.Master, scaling_group.is_master)
+
+        active_servers_mock.__get__ = Mock(return_value=[78910, 434987])
+        with patch('time.time', return_value=time.time() + 3600):
+            self.assertIsNone(scaling_group.read_master_cache())
+            self.assertEqual(NodeStatus.Slave, scaling_group.is_master)
+
+    @patch('raxas.common.read_uuid_cache', return_value=78910)
+    def test_cached_node_status(self, read_uuid_cache_mock):
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        self.assertEqual(NodeStatus.Unknown, scaling_group.cached_node_status)
+
+        scaling_group.write_master_cache([123456, 434987])
+        self.assertEqual(NodeStatus.Slave, scaling_group.cached_node_status)
+
+        read_uuid_cache_mock.return_value = 123456
+        self.assertEqual(NodeStatus.Master, scaling_group.cached_node_status)
+
+        read_uuid_cache_mock.return_value = None
+        self.assertEqual(NodeStatus.Unknown, scaling_group.cached_node_status)
+
+    def test_read_master_cache_ignores_shared_file(self):
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+        scaling_group.write_master_cache([])
+        os.chmod(raxas.scaling_group.MASTER_CACHE_FILE % scaling_group.group_uuid, 0666)
+
+        self.assertIsNone(scaling_group.read_master_cache())
+
+    @patch('requests.Session.post')
     def test_webhook_call_status_200(self, post_mock):
         post_mock.return_value.status_code = 200
         scaling_group = ScalingGroup(self.group_config, 'group0')
@@ -244,17 +309,111 @@ class TestScalingGroup(BaseTest):
         self.assertEqual(post_mock.call_count, 1)
 
     @patch('raxas.common.get_logger')
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_webhook_call_request_exception(self, post_mock, get_logger_mock):
+        # the urls are posted concurrently and mock call counters are not
+        # thread safe, so record calls in lists instead
         logger_mock = MagicMock(autospec=True)
+        errors, urls = [], []
+        logger_mock.error.side_effect = errors.append
         get_logger_mock.return_value = logger_mock
-        post_mock.return_value.status_code = 500
-        post_mock.side_effect = requests.exceptions.RequestException
+
+        def post(url, **kwargs):
+            urls.append(url)
+            raise requests.exceptions.RequestException
+        post_mock.side_effect = post
         scaling_group = ScalingGroup(self.group_config, 'group0')
 
         scaling_group.execute_webhook(ScaleDirection.Down, HookType.Pre)
+        self.assertEqual(['predwn1', 'predwn2'], sorted(urls))
+        self.assertEqual(2, len(errors))
+
+    @patch('requests.Session.post')
+    def test_webhook_call_uses_settings(self, post_mock):
+        self.group_config['webhooks']['timeout'] = 3
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        scaling_group.execute_webhook(ScaleDirection.Up, HookType.Pre)
         self.assertEqual(post_mock.call_count, 2)
-        self.assertEqual(logger_mock.error.call_count, 2)
+        self.assertEqual(3, post_mock.call_args[1]['timeout'])
+
+    @patch('requests.Session.post')
+    def test_webhook_call_post_async(self, post_mock):
+        self.group_config['webhooks']['post_async'] = True
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        self.assertIsNone(scaling_group.execute_webhook(ScaleDirection.Up,
+                                                        HookType.Pre))
+        sender = scaling_group.execute_webhook(ScaleDirection.Up, HookType.Post)
+        sender.join()
+        self.assertEqual(post_mock.call_count, 3)
+
+    @patch('requests.Session.post')
+    def test_webhook_call_missing_hook(self, post_mock):
+        del self.group_config['webhooks']['scale_down']
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        scaling_group.execute_webhook(ScaleDirection.Down, HookType.Pre)
+        self.assertEqual(post_mock.call_count, 0)
+
+    @patch.object(ScalingGroup, 'active_servers')
+    def test_webhook_payload(self, active_servers_mock):
+        active_servers_mock.__get__ = Mock(return_value=['a', 'b'])
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        payload = json.loads(scaling_group.webhook_payload(ScaleDirection.Up,
+                                                           {'raxmon': 1}))
+        self.assertEqual({'version': 1,
+                          'group': 'group0',
+                          'group_id': 'group id',
+                          'direction': 'Up',
+                          'active_capacity': 2,
+                          'decisions': {'raxmon': 1}}, payload)
+
+    def test_webhook_payload_include_config(self):
+        self.group_config['webhooks']['include_config'] = True
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        payload = json.loads(scaling_group.webhook_payload(ScaleDirection.Down))
+        self.assertEqual(self.group_config, payload['config'])
+
+    @patch('requests.Session.post')
+    def test_webhook_call_sends_payload(self, post_mock):
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        scaling_group.execute_webhook(ScaleDirection.Up, HookType.Post, '{"a":1}')
+        self.assertEqual('{"a":1}', post_mock.call_args[1]['data'])
+
+    def test_hysteresis_settings(self):
+        self.group_config['hysteresis'] = {'scale_down_after': 3}
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        self.assertEqual({'scale_up_after': 1,
+                          'scale_down_after': 3,
+                          'scale_up_cooldown': 0,
+                          'scale_down_cooldown': 0}, scaling_group.hysteresis_settings)
+
+    @patch.object(ScalingGroup, 'scaling_group')
+    def test_get_cooldowns(self, scaling_group_mock):
+        scale_up = Mock(id=self.group_config['scale_up_policy'], cooldown=600)
+        scale_down = Mock(id=self.group_config['scale_down_policy'], cooldown=60)
+        scaling_group_mock.__get__ = Mock(return_value=Mock(
+            cooldown=300, policies=[scale_up, scale_down]))
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        self.assertEqual((300, 600), scaling_group.get_cooldowns(ScaleDirection.Up))
+        self.assertEqual((300, 60), scaling_group.get_cooldowns(ScaleDirection.Down))
+
+    @patch.object(ScalingGroup, 'scaling_group')
+    def test_get_cooldowns_without_group(self, scaling_group_mock):
+        scaling_group_mock.__get__ = Mock(return_value=None)
+        scaling_group = ScalingGroup(self.group_config, 'group0')
+
+        self.assertEqual((0, 0), scaling_group.get_cooldowns(ScaleDirection.Up))
+
+    def test_webhook_session_reused(self):
+        self.assertIs(get_webhook_session(2, 0.5), get_webhook_session(2, 0.5))
+        self.assertIsNot(get_webhook_session(2, 0.5), get_webhook_session(0, 0.5))
 
     @patch.object(ScalingGroup, 'active_servers')
     def test_execute_policy_one_active(self, active_servers_mock):
@@ -292,7 +451,7 @@ class TestScalingGroup(BaseTest):
     def test_get_webhook_values_key_error(self, get_logger_mock, config_mock):
         logger_mock = MagicMock(autospec=True)
         get_logger_mock.return_value = logger_mock
-        config_mock.return_value = {'fake': 'config'}
+        config_mock.return_value = GroupConfig({'fake': 'config'})
         scaling_group = ScalingGroup(self.group_config, 'group0')
         scaling_group.get_webhook_values(ScaleDirection.Up, HookType.Post)
         self.assertEqual(1, logger_mock.error.call_count)
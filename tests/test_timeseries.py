@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# this file is part of 'RAX-AutoScaler'
+#
+# Copyright 2014 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from mock import patch
+
+from tests.base_test import BaseTest
+from raxas import timeseries
+from raxas.timeseries import RingBuffer
+
+
+class RingBufferTest(BaseTest):
+    def setUp(self):
+        self.store_file = os.path.join(self.make_temp_dir(), 'metric.ts')
+
+    def test_empty(self):
+        store = RingBuffer(self.store_file)
+
+        self.assertEqual(0, len(store))
+        self.assertIsNone(store.mean)
+        self.assertIsNone(store.ewma)
+        self.assertIsNone(store.last_timestamp)
+
+    def test_append_evicts_oldest(self):
+        store = RingBuffer(self.store_file, capacity=3, alpha=0.5)
+        for timestamp, value in enumerate([4, 8, 6, 10]):
+            store.append(timestamp, value)
+
+        self.assertEqual([(1, 8), (2, 6), (3, 10)], store.samples())
+        self.assertEqual(8, store.mean)
+        self.assertEqual(8, store.ewma)
+        self.assertEqual(3, store.last_timestamp)
+
+    def test_append_replaces_newest(self):
+        store = RingBuffer(self.store_file, alpha=0.5)
+        store.append(1, 4)
+        store.append(2, 8)
+        store.append(2, 2)
+
+        self.assertEqual([(1, 4), (2, 2)], store.samples())
+        self.assertEqual(3, store.mean)
+        self.assertEqual(3, store.ewma)
+
+    def test_append_out_of_order(self):
+        store = RingBuffer(self.store_file)
+        store.append(2, 1)
+
+        self.assertRaises(ValueError, store.append, 1, 1)
+
+    def test_expire(self):
+        store = RingBuffer(self.store_file)
+        for timestamp in range(5):
+            store.append(timestamp, timestamp)
+
+        store.expire(3)
+        self.assertEqual([(3, 3), (4, 4)], store.samples())
+        self.assertEqual(3.5, store.mean)
+
+        store.expire(10)
+        self.assertEqual(0, len(store))
+        self.assertIsNone(store.ewma)
+
+    def test_save_and_load(self):
+        store = RingBuffer(self.store_file, capacity=3, alpha=0.5)
+        for timestamp, value in enumerate([4, 8, 6, 10]):
+            store.append(timestamp, value)
+        store.save()
+
+        loaded = RingBuffer(self.store_file, capacity=3, alpha=0.5)
+        self.assertEqual(store.samples(), loaded.samples())
+        self.assertEqual(store.mean, loaded.mean)
+        self.assertEqual(store.ewma, loaded.ewma)
+
+        loaded.append(4, 2)
+        self.assertEqual(5, loaded.ewma)
+
+    def test_load_other_capacity(self):
+        store = RingBuffer(self.store_file, capacity=4)
+        for timestamp, value in enumerate([4, 8, 6, 10]):
+            store.append(timestamp, value)
+        store.save()
+
+        loaded = RingBuffer(self.store_file, capacity=2, alpha=0.25)
+        self.assertEqual([(2, 6), (3, 10)], loaded.samples())
+        self.assertEqual(8, loaded.mean)
+        self.assertEqual(7, loaded.ewma)
+
+    def test_load_corrupt_file(self):
+        with open(self.store_file, 'wb') as store_file:
+            store_file.write('RXTS')
+
+        self.assertEqual(0, len(RingBuffer(self.store_file)))
+
+    def test_since(self):
+        store = RingBuffer(self.store_file, capacity=3)
+        for timestamp in range(5):
+            store.append(timestamp, timestamp * 2)
+
+        self.assertEqual([(3, 6), (4, 8)], store.since(3))
+
+    def test_linear_trend(self):
+        self.assertEqual((2, 1), timeseries.linear_trend([(0, 1), (1, 3), (2, 5)]))
+        self.assertIsNone(timeseries.linear_trend([(0, 1)]))
+        self.assertIsNone(timeseries.linear_trend([(1, 1), (1, 2)]))
+
+    def test_forecast(self):
+        self.assertAlmostEqual(8.3333333, timeseries.forecast([(60, 1), (120, 2), (180, 4)], 360))
+        self.assertIsNone(timeseries.forecast([], 360))
+
+    def test_open_history(self):
+        with patch('raxas.timeseries.HISTORY_FILE',
+                   os.path.join(os.path.dirname(self.store_file), '%s.ts')):
+            history = timeseries.open_history('group', 'agent.plugin', 'a/b')
+            history.append(1, 1)
+            history.save()
+
+            self.assertEqual([(1, 1)], timeseries.open_history(
+                'group', 'agent.plugin', 'a/b').samples())
+            self.assertEqual(0, len(timeseries.open_history(
+                'other group', 'agent.plugin', 'a/b')))